@@ -1,12 +1,58 @@
-from flask import Flask, request, jsonify, send_from_directory, send_file, render_template_string
+from flask import (Flask, request, jsonify, send_file, render_template_string,
+                   Response, stream_with_context, redirect)
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 import sqlite3
-from datetime import datetime
+from datetime import date, datetime, timedelta
+from urllib.parse import quote
+from xml.sax.saxutils import escape as xml_escape
 import os
-import shutil
 import threading
+import atexit
+import tempfile
+import shutil
+import gzip
+import re
+import calendar
+import zipfile
+import hashlib
+import base64
+import binascii
+import io
+import click
+import json
+import time
+import random
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial, wraps
+from collections import OrderedDict
+import contextlib
+import mimetypes
+from zoneinfo import ZoneInfo
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+try:
+    import brotli
+except ImportError:  # opcional: sin él los estáticos se sirven sólo con gzip
+    brotli = None
 
-app = Flask(__name__, static_folder='.', static_url_path='')
+try:
+    import orjson
+except ImportError:  # opcional: sin él las respuestas se serializan con el json estándar
+    orjson = None
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow es opcional: sin él no se generan miniaturas
+    Image = None
+
+app = Flask(__name__, static_folder=None)   # los estáticos los sirve _servir_estatico
 CORS(app)
 
 # Configuración de la base de datos
@@ -17,76 +63,991 @@ BACKUP_DIR = 'backups'
 BACKUP_PIN = 'komei2024'
 
 # =====================================================
-# BACKUP AUTOMÁTICO DIARIO
+# BACKUP AUTOMÁTICO DIARIO (CADENA INCREMENTAL)
 # =====================================================
+# Cada punto de restauración `asistencias_AAAAMMDD` es uno de:
+#   - completo:    asistencias_AAAAMMDD.full.gz  la base entera, comprimida
+#   - incremental: asistencias_AAAAMMDD.inc.gz   sólo las páginas que cambiaron
+#                  desde el punto anterior (`base` en el manifiesto)
+# con su manifiesto asistencias_AAAAMMDD.json. El último punto guarda además el
+# hash de cada página (.paginas) para calcular el próximo incremental.
+# Un punto se reconstruye partiendo del completo de su cadena y aplicando en
+# orden los incrementales (`flask --app app restaurar-backup <punto>`).
 
-BACKUP_KEEP_COUNT = 5       # Cantidad de backups a conservar
-CLEANUP_INTERVAL  = 604800  # Limpieza semanal (7 días en segundos)
+BACKUP_RETENCION_DIAS = 180     # días de puntos de restauración a conservar
+BACKUP_COMPLETO_CADA  = 7       # puntos por cadena: al llegar a 7 se toma un completo nuevo
+BACKUP_PAGINAS        = 256     # páginas copiadas por paso de la API de backup (~1 MB)
+BACKUP_PAUSA          = 0.05    # segundos entre pasos: los escritores no quedan esperando
+BACKUP_HASH_BYTES     = 16      # bytes de BLAKE2b por página en el archivo .paginas
 
-def limpiar_backups_viejos():
-    """Elimina los backups más viejos, conservando solo los últimos BACKUP_KEEP_COUNT."""
+PATRON_PUNTO = re.compile(r'^asistencias_\d{8}(_\d{6})?$')
+
+# Un punto a la vez: el lock para los hilos de este proceso y
+# `.cadena.lock` (flock) para los demás workers
+_backup_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def bloqueo_archivo(ruta):
+    """Lock exclusivo entre procesos sobre `ruta` (espera si otro lo tiene)."""
+    if fcntl is None:   # Windows: sólo el servidor de desarrollo, un proceso
+        yield
+        return
+    with open(ruta, 'a') as archivo:
+        fcntl.flock(archivo, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(archivo, fcntl.LOCK_UN)
+
+
+def _ruta_backup(nombre):
+    return os.path.join(BACKUP_DIR, nombre)
+
+
+def _escribir_atomico(ruta, datos):
+    with open(ruta + '.tmp', 'wb') as f:
+        f.write(datos)
+    os.replace(ruta + '.tmp', ruta)
+
+
+def sha256_archivo(ruta):
+    h = hashlib.sha256()
+    with open(ruta, 'rb') as f:
+        for bloque in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(bloque)
+    return h.hexdigest()
+
+
+def copiar_db_en_linea(destino):
+    """Copia consistente de la DB activa con la API de backup de SQLite.
+
+    Copia de a BACKUP_PAGINAS páginas con una pausa entre pasos. La conexión de
+    origen mantiene abierta una transacción de lectura: en modo WAL eso no
+    bloquea a los escritores, y evita que cada escritura ajena reinicie la copia
+    desde cero. Incluye lo que todavía está en el -wal, sin checkpoint previo.
+    """
+    origen = _abrir_conexion()
+    copia = sqlite3.connect(destino)
     try:
-        if not os.path.exists(BACKUP_DIR):
-            return
+        origen.execute('BEGIN')
+        origen.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()   # fija la instantánea
+        # `sleep` de backup() sólo se aplica si la base está ocupada: la pausa va en el progreso
+        origen.backup(copia, pages=BACKUP_PAGINAS,
+                      progress=lambda estado, restantes, total: time.sleep(BACKUP_PAUSA))
+        origen.rollback()
+        # La copia queda como una base normal (sin -wal) lista para abrir en otro lado
+        copia.execute('PRAGMA journal_mode=DELETE')
+    finally:
+        copia.close()
+        origen.close()
+
+
+def verificar_integridad(ruta):
+    """Resultado de PRAGMA integrity_check: 'ok' o la lista de problemas."""
+    conn = sqlite3.connect(f'file:{ruta}?mode=ro', uri=True)
+    try:
+        resultado = [fila[0] for fila in conn.execute('PRAGMA integrity_check')]
+    finally:
+        conn.close()
+    return 'ok' if resultado == ['ok'] else '; '.join(resultado)
+
+
+def leer_manifiesto(punto):
+    try:
+        with open(_ruta_backup(punto + '.json')) as f:
+            manifiesto = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifiesto if 'tipo' in manifiesto else None
+
+
+def listar_puntos():
+    """Manifiestos de todos los puntos de restauración, del más viejo al más nuevo."""
+    if not os.path.isdir(BACKUP_DIR):
+        return []
+    puntos = sorted(nombre[:-len('.json')] for nombre in os.listdir(BACKUP_DIR)
+                    if nombre.endswith('.json') and PATRON_PUNTO.match(nombre[:-len('.json')]))
+    return [m for m in map(leer_manifiesto, puntos) if m is not None]
+
 
-        archivos = sorted([
-            f for f in os.listdir(BACKUP_DIR)
-            if f.startswith('asistencias_') and f.endswith('.db')
-        ], reverse=True)  # Más nuevo primero
+def cadena_de(punto):
+    """Manifiestos desde el completo hasta `punto`; ValueError si falta un eslabón."""
+    cadena = []
+    while punto is not None:
+        manifiesto = leer_manifiesto(punto)
+        if manifiesto is None:
+            raise ValueError(f'Falta el punto {punto} de la cadena')
+        cadena.append(manifiesto)
+        punto = manifiesto['base']
+    return cadena[::-1]
 
-        a_eliminar = archivos[BACKUP_KEEP_COUNT:]  # Todo lo que pase de los últimos 5
+
+def estado_punto(punto):
+    """'verificado' si todos los archivos de la cadena están y coinciden con sus
+    manifiestos, 'alterado' si alguno cambió de tamaño e 'incompleto' si falta alguno."""
+    try:
+        cadena = cadena_de(punto)
+    except ValueError:
+        return 'incompleto'
+    for manifiesto in cadena:
+        ruta = _ruta_backup(manifiesto['archivo'])
+        if not os.path.exists(ruta):
+            return 'incompleto'
+        if manifiesto['integridad'] != 'ok' or os.path.getsize(ruta) != manifiesto['comprimido']:
+            return 'alterado'
+    return 'verificado'
+
+
+def crear_punto_backup(punto):
+    """Agrega `punto` a la cadena: incremental sobre el último punto, o completo.
+
+    La copia de la base pasa por integrity_check antes de guardar nada; el
+    manifiesto se escribe al final, así un punto a medio crear no existe.
+    Devuelve el manifiesto.
+    """
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    inicio = time.monotonic()
+    temporal = _ruta_backup(punto + '.db.tmp')
+    with _backup_lock, bloqueo_archivo(_ruta_backup('.cadena.lock')):
+        try:
+            copiar_db_en_linea(temporal)
+            integridad = verificar_integridad(temporal)
+            if integridad != 'ok':
+                raise RuntimeError(f'integrity_check falló: {integridad}')
+            conn = sqlite3.connect(temporal)
+            page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+            conn.close()
+            total = os.path.getsize(temporal) // page_size
+
+            # Incremental sólo si el último punto sigue siendo la punta de una cadena corta
+            puntos = listar_puntos()
+            anterior = puntos[-1] if puntos else None
+            hashes_anteriores = None
+            if (anterior and anterior['page_size'] == page_size
+                    and anterior['largo_cadena'] < BACKUP_COMPLETO_CADA
+                    and estado_punto(anterior['punto']) == 'verificado'
+                    and os.path.exists(_ruta_backup(anterior['punto'] + '.paginas'))):
+                with open(_ruta_backup(anterior['punto'] + '.paginas'), 'rb') as f:
+                    hashes_anteriores = f.read()
+            incremental = hashes_anteriores is not None
+            archivo = f'{punto}.inc.gz' if incremental else f'{punto}.full.gz'
+
+            hashes = bytearray()
+            sha256 = hashlib.sha256()
+            guardadas = 0
+            with open(temporal, 'rb') as db, open(_ruta_backup(archivo) + '.tmp', 'wb') as salida:
+                # mtime=0: el mismo contenido produce siempre el mismo .gz
+                with gzip.GzipFile(fileobj=salida, mode='wb', mtime=0) as gz:
+                    for numero in range(1, total + 1):
+                        pagina = db.read(page_size)
+                        sha256.update(pagina)
+                        h = hashlib.blake2b(pagina, digest_size=BACKUP_HASH_BYTES).digest()
+                        hashes += h
+                        if incremental:
+                            desde = (numero - 1) * BACKUP_HASH_BYTES
+                            if hashes_anteriores[desde:desde + BACKUP_HASH_BYTES] == h:
+                                continue
+                            gz.write(numero.to_bytes(4, 'big'))
+                        gz.write(pagina)
+                        guardadas += 1
+            os.replace(_ruta_backup(archivo) + '.tmp', _ruta_backup(archivo))
+            _escribir_atomico(_ruta_backup(punto + '.paginas'), bytes(hashes))
+
+            manifiesto = {
+                'punto':        punto,
+                'tipo':         'incremental' if incremental else 'completo',
+                'base':         anterior['punto'] if incremental else None,
+                'largo_cadena': anterior['largo_cadena'] + 1 if incremental else 1,
+                'archivo':      archivo,
+                'page_size':    page_size,
+                'paginas':      total,
+                'guardadas':    guardadas,
+                'bytes':        total * page_size,
+                'sha256':       sha256.hexdigest(),
+                'comprimido':   os.path.getsize(_ruta_backup(archivo)),
+                'integridad':   integridad,
+                'creado':       datetime.now().isoformat(timespec='seconds'),
+                'segundos':     round(time.monotonic() - inicio, 2),
+            }
+            _escribir_atomico(_ruta_backup(punto + '.json'),
+                              json.dumps(manifiesto, indent=2).encode())
+            # Sólo la punta de la cadena necesita los hashes de página
+            if anterior and os.path.exists(_ruta_backup(anterior['punto'] + '.paginas')):
+                os.remove(_ruta_backup(anterior['punto'] + '.paginas'))
+            return manifiesto
+        finally:
+            for resto in (temporal, _ruta_backup(punto + '.full.gz.tmp'),
+                          _ruta_backup(punto + '.inc.gz.tmp')):
+                if os.path.exists(resto):
+                    os.remove(resto)
+
+
+def reconstruir_punto(punto, destino):
+    """Escribe en `destino` (archivo abierto en 'w+b') la base tal como era en `punto`.
+
+    Lanza ValueError si la cadena está incompleta y RuntimeError si el
+    resultado no coincide con el SHA-256 del manifiesto.
+    """
+    cadena = cadena_de(punto)
+    for manifiesto in cadena:
+        tam = manifiesto['page_size']
+        with gzip.open(_ruta_backup(manifiesto['archivo']), 'rb') as gz:
+            if manifiesto['tipo'] == 'completo':
+                destino.seek(0)
+                shutil.copyfileobj(gz, destino)
+            else:
+                while cabecera := gz.read(4):
+                    destino.seek((int.from_bytes(cabecera, 'big') - 1) * tam)
+                    destino.write(gz.read(tam))
+        destino.truncate(manifiesto['bytes'])
+
+    destino.flush()
+    destino.seek(0)
+    sha256 = hashlib.sha256()
+    for bloque in iter(lambda: destino.read(1024 * 1024), b''):
+        sha256.update(bloque)
+    if sha256.hexdigest() != cadena[-1]['sha256']:
+        raise RuntimeError(f'La reconstrucción de {punto} no coincide con su SHA-256')
+    destino.seek(0)
+
+
+def estado_backup(ruta):
+    """Estado de un backup .db del formato anterior (copia completa sin cadena).
+
+    'verificado' si su manifiesto dice integrity_check ok y el tamaño coincide,
+    'alterado' si no coincide y 'sin_verificar' si no tiene manifiesto.
+    """
+    try:
+        with open(ruta[:-len('.db')] + '.json') as f:
+            manifiesto = json.load(f)
+    except (OSError, ValueError):
+        return 'sin_verificar', None
+    if manifiesto.get('integridad') != 'ok' or manifiesto.get('bytes') != os.path.getsize(ruta):
+        return 'alterado', manifiesto
+    return 'verificado', manifiesto
+
+
+def limpiar_backups_viejos():
+    """Borra las cadenas cuyo punto más nuevo tiene más de BACKUP_RETENCION_DIAS días.
+
+    Una cadena (un completo y sus incrementales) se borra entera, y nunca la
+    última. Los .db del formato anterior se borran por su fecha.
+    """
+    if not os.path.exists(BACKUP_DIR):
+        return 'sin backups'
+    limite = datetime.now() - timedelta(days=BACKUP_RETENCION_DIAS)
+
+    with bloqueo_archivo(_ruta_backup('.cadena.lock')):
+        cadenas = []
+        for manifiesto in listar_puntos():
+            if manifiesto['tipo'] == 'completo' or not cadenas:
+                cadenas.append([])
+            cadenas[-1].append(manifiesto)
+
+        a_eliminar = []
+        for cadena in cadenas[:-1]:
+            if datetime.fromisoformat(cadena[-1]['creado']) < limite:
+                for manifiesto in cadena:
+                    a_eliminar += [manifiesto['archivo'], manifiesto['punto'] + '.json',
+                                   manifiesto['punto'] + '.paginas']
+        for nombre in os.listdir(BACKUP_DIR):
+            ruta = _ruta_backup(nombre)
+            if (nombre.startswith('asistencias_') and nombre.endswith('.db')
+                    and datetime.fromtimestamp(os.path.getmtime(ruta)) < limite):
+                a_eliminar += [nombre, nombre[:-len('.db')] + '.json']
+
+        eliminados = 0
         for archivo in a_eliminar:
-            os.remove(os.path.join(BACKUP_DIR, archivo))
-            print(f'[Backup] Respaldo eliminado: {archivo}')
+            if os.path.exists(_ruta_backup(archivo)):
+                os.remove(_ruta_backup(archivo))
+                eliminados += 1
+                print(f'[Backup] Respaldo eliminado: {archivo}')
+
+    if eliminados:
+        return f'{eliminados} archivo(s) eliminado(s)'
+    return f'nada que eliminar ({len(cadenas)} cadena(s))'
+
+
+def realizar_backup():
+    """Agrega a la cadena el punto de restauración del día."""
+    if not os.path.exists(DATABASE):
+        return 'sin base de datos'
+
+    punto = f'asistencias_{datetime.now().strftime("%Y%m%d")}'
+
+    # Solo hacer backup si no existe uno de hoy
+    if leer_manifiesto(punto) is not None:
+        return f'ya existe respaldo de hoy: {punto}'
+    m = crear_punto_backup(punto)
+    precalcular_descarga(punto)
+    return (f'{m["tipo"]} {m["archivo"]}: {m["guardadas"]}/{m["paginas"]} páginas, '
+            f'{m["comprimido"]/1024:.1f} KB')
+
+# =====================================================
+# TAREAS PROGRAMADAS
+# =====================================================
+# Cada worker arranca un hilo programador (al nacer con gunicorn, ver
+# iniciar_worker; si no, con su primer request), pero sólo ejecuta tareas el que
+# obtiene el flock de PROGRAMADOR_LOCK. Si ese proceso muere, el sistema
+# operativo libera el lock y otro worker lo toma en su próxima vuelta.
+# Los horarios son expresiones cron (minuto hora día mes día-de-semana, con
+# `*`, listas, rangos y `/paso`) en la zona ZONA_TAREAS. Una tarea que nunca
+# corrió, o cuya hora pasó con el servidor apagado, corre en la próxima vuelta.
+
+ZONA_TAREAS        = ZoneInfo('Asia/Tokyo')
+PROGRAMADOR_LOCK   = DATABASE + '.programador.lock'
+PROGRAMADOR_VUELTA = 30     # segundos entre revisiones
+TAREAS_ACTIVAS     = os.environ.get('TAREAS_ACTIVAS', '1') != '0'   # 0: este proceso no corre tareas (p. ej. al medir)
+
+TAREAS = {
+    # nombre: (cron, función que devuelve un resumen de lo hecho); otras secciones
+    # agregan las suyas más abajo (p. ej. limpieza_sync)
+    'backup':           ('30 2 * * *', realizar_backup),          # todas las noches, 02:30
+    'limpieza_backups': ('0 3 * * 0',  limpiar_backups_viejos),   # domingos, 03:00
+}
 
-        if a_eliminar:
-            print(f'[Backup] Limpieza semanal: {len(a_eliminar)} respaldo(s) eliminado(s), quedan {min(len(archivos), BACKUP_KEEP_COUNT)}')
+_programador = {'pid': None, 'ejecutor': False, 'lock': None}
+_programador_lock = threading.Lock()
+
+
+def _campo_cron(texto, minimo, maximo):
+    valores = set()
+    for parte in texto.split(','):
+        rango, _, paso = parte.partition('/')
+        if rango == '*':
+            desde, hasta = minimo, maximo
+        elif '-' in rango:
+            desde, hasta = map(int, rango.split('-'))
         else:
-            print(f'[Backup] Limpieza semanal: nada que eliminar ({len(archivos)} respaldo(s))')
+            desde = int(rango)
+            hasta = maximo if paso else desde
+        if not minimo <= desde <= hasta <= maximo:
+            raise ValueError(f'Valor fuera de rango en cron: {parte}')
+        valores.update(range(desde, hasta + 1, int(paso or 1)))
+    return valores
 
-    except Exception as e:
-        print(f'[Backup] Error en limpieza: {e}')
-    finally:
-        # Programar la próxima limpieza en 7 días
-        timer = threading.Timer(CLEANUP_INTERVAL, limpiar_backups_viejos)
-        timer.daemon = True
-        timer.start()
 
+def siguiente_ejecucion(cron, desde):
+    """Primer minuto posterior a `desde` que cumple la expresión cron.
 
-def realizar_backup():
-    """Crea una copia de respaldo de la DB con la fecha del día."""
+    Si se indican día del mes y día de la semana, deben cumplirse ambos.
+    El día de la semana va de 0 (domingo) a 6; 7 también es domingo.
+    """
+    campos = cron.split()
+    if len(campos) != 5:
+        raise ValueError(f'Expresión cron inválida: {cron}')
+    minutos = _campo_cron(campos[0], 0, 59)
+    horas = _campo_cron(campos[1], 0, 23)
+    dias = _campo_cron(campos[2], 1, 31)
+    meses = _campo_cron(campos[3], 1, 12)
+    dias_semana = {d % 7 for d in _campo_cron(campos[4], 0, 7)}
+
+    t = desde.replace(second=0, microsecond=0) + timedelta(minutes=1)
+    limite = t + timedelta(days=366 * 5)
+    while t < limite:
+        if t.month not in meses:
+            t = (t.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+        elif t.day not in dias or (t.weekday() + 1) % 7 not in dias_semana:
+            t = t.replace(hour=0, minute=0) + timedelta(days=1)
+        elif t.hour not in horas:
+            t = t.replace(minute=0) + timedelta(hours=1)
+        elif t.minute not in minutos:
+            t += timedelta(minutes=1)
+        else:
+            return t
+    raise ValueError(f'La expresión cron nunca se cumple: {cron}')
+
+
+
+def _intentar_ser_ejecutor():
+    """Toma el lock del programador sin esperar; queda tomado mientras viva el proceso."""
+    if fcntl is None:   # Windows: sólo el servidor de desarrollo, un proceso
+        return True
+    archivo = open(PROGRAMADOR_LOCK, 'a')
     try:
-        if not os.path.exists(DATABASE):
-            return
+        fcntl.flock(archivo, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        archivo.close()
+        return False
+    _programador['lock'] = archivo
+    return True
 
-        os.makedirs(BACKUP_DIR, exist_ok=True)
-        fecha_hoy = datetime.now().strftime('%Y%m%d')
-        destino = os.path.join(BACKUP_DIR, f'asistencias_{fecha_hoy}.db')
 
-        # Solo hacer backup si no existe uno de hoy
-        if not os.path.exists(destino):
-            shutil.copy2(DATABASE, destino)
-            print(f'[Backup] Respaldo creado: {destino}')
-        else:
-            print(f'[Backup] Ya existe respaldo de hoy: {destino}')
+def _tarea_pendiente(conn, nombre, cron, ahora):
+    fila = conn.execute('SELECT ultimo_inicio FROM tareas_estado WHERE tarea = ?',
+                        (nombre,)).fetchone()
+    if fila is None:
+        return True
+    return siguiente_ejecucion(cron, datetime.fromisoformat(fila['ultimo_inicio'])) <= ahora
+
 
+def ejecutar_tarea(nombre):
+    """Corre la tarea ahora y guarda en tareas_estado cuándo, cuánto tardó y cómo terminó."""
+    cron, funcion = TAREAS[nombre]
+    inicio = datetime.now(ZONA_TAREAS)
+    t0 = time.monotonic()
+    try:
+        detalle = funcion()
+        resultado = 'ok'
     except Exception as e:
-        print(f'[Backup] Error al crear respaldo: {e}')
+        detalle = f'{type(e).__name__}: {e}'
+        resultado = 'error'
+    duracion = round(time.monotonic() - t0, 2)
+    proxima = siguiente_ejecucion(cron, datetime.now(ZONA_TAREAS))
+
+    conn = get_db()
+    conn.execute('''
+        INSERT INTO tareas_estado (tarea, cron, ultimo_inicio, duracion, resultado, detalle, proxima, pid)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (tarea) DO UPDATE SET
+            cron = excluded.cron, ultimo_inicio = excluded.ultimo_inicio,
+            duracion = excluded.duracion, resultado = excluded.resultado,
+            detalle = excluded.detalle, proxima = excluded.proxima, pid = excluded.pid
+    ''', (nombre, cron, inicio.isoformat(timespec='seconds'), duracion, resultado,
+          detalle, proxima.isoformat(timespec='seconds'), os.getpid()))
+    conn.commit()
+    print(f'[Tareas] {nombre}: {resultado} en {duracion}s — {detalle}')
+
+
+def _bucle_programador():
+    while True:
+        try:
+            if not _programador['ejecutor']:
+                _programador['ejecutor'] = _intentar_ser_ejecutor()
+                if _programador['ejecutor']:
+                    print(f'[Tareas] Programador activo en el proceso {os.getpid()}')
+            if _programador['ejecutor']:
+                conn = get_db()
+                for nombre, (cron, _) in TAREAS.items():
+                    if _tarea_pendiente(conn, nombre, cron, datetime.now(ZONA_TAREAS)):
+                        ejecutar_tarea(nombre)
+        except Exception as e:
+            print(f'[Tareas] Error del programador: {e}')
+        time.sleep(PROGRAMADOR_VUELTA)
+
+
+def iniciar_programador():
+    """Arranca el hilo programador de este proceso (una vez por proceso, también tras un fork)."""
+    if _programador['pid'] == os.getpid() or not TAREAS_ACTIVAS:
+        return
+    with _programador_lock:
+        if _programador['pid'] == os.getpid():
+            return
+        # Tras un fork el lock heredado pertenece al padre: empezar de cero
+        _programador.update(pid=os.getpid(), ejecutor=False, lock=None)
+        threading.Thread(target=_bucle_programador, name='programador', daemon=True).start()
+
+
+@app.before_request
+def arrancar_programador():
+    iniciar_programador()
+
+
+# =====================================================
+# MÉTRICAS (PROMETHEUS)
+# =====================================================
+# Cada request suma su latencia (histograma), su código y sus bytes por ruta;
+# cada sentencia SQL suma ejecuciones, segundos y filas. El tiempo de una
+# consulta incluye el de sus fetch, que es donde SQLite hace el trabajo de un
+# SELECT. Todo se expone en /metrics. Los contadores son de cada worker: con
+# gunicorn, cada scrape muestra los del worker que lo atendió (etiqueta pid).
+
+METRICAS_CUBETAS  = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)   # segundos
+SQL_METRICAS_MAX  = 500     # consultas distintas con serie propia; el resto va a "otras"
+SQL_LENTA_SEGUNDOS = float(os.environ.get('SQL_LENTA_SEGUNDOS', '0'))   # 0 = sin log de lentas
+
+_metricas_lock = threading.Lock()
+_http_duracion = {}     # (ruta, método) → [conteo por cubeta..., +Inf, suma]
+_http_respuestas = {}   # (ruta, método, código) → cantidad
+_http_bytes = {}        # (ruta, método) → bytes enviados
+_sql_metricas = {}      # consulta → [ejecuciones, segundos, filas, lentas]
+_sql_huellas = {}       # texto SQL → consulta normalizada
+_proceso_inicio = time.time()
+
+
+def _huella_sql(sql):
+    """Texto de la consulta apto como etiqueta: sin espacios de más ni listas de `?`."""
+    huella = _sql_huellas.get(sql)
+    if huella is None:
+        huella = ' '.join(sql.split())
+        huella = re.sub(r'\?(?:\s*,\s*\?)+', '?, …', huella)
+        huella = re.sub(r'\(\?, …\)(?:\s*,\s*\(\?, …\))+', '(?, …), …', huella)
+        huella = re.sub(r'\(\?\)(?:\s*,\s*\(\?\))+', '(?), …', huella)
+        if len(_sql_huellas) >= SQL_METRICAS_MAX * 4:
+            _sql_huellas.clear()
+        _sql_huellas[sql] = huella
+    return huella
+
+
+def _registrar_sql(sql, segundos, filas):
+    consulta = _huella_sql(sql)
+    lenta = SQL_LENTA_SEGUNDOS and segundos >= SQL_LENTA_SEGUNDOS
+    with _metricas_lock:
+        datos = _sql_metricas.get(consulta)
+        if datos is None:
+            if len(_sql_metricas) >= SQL_METRICAS_MAX:
+                consulta = 'otras'
+            datos = _sql_metricas.setdefault(consulta, [0, 0.0, 0, 0])
+        datos[0] += 1
+        datos[1] += segundos
+        datos[2] += filas
+        if lenta:
+            datos[3] += 1
+    if lenta:
+        print(f'[SQL lenta] {segundos:.3f}s {filas} filas: {consulta[:300]}')
+
+
+class CursorMedido(sqlite3.Cursor):
+    """Cursor que mide cada sentencia: el execute más todos sus fetch.
+
+    La medición se registra al terminar la sentencia: cuando se leyeron todas
+    las filas, al ejecutar otra o al cerrar (o descartar) el cursor.
+    """
+    _sql = None
+
+    def _terminar(self):
+        if self._sql is not None:
+            sql, self._sql = self._sql, None
+            _registrar_sql(sql, self._segundos, self._filas)
+
+    def execute(self, sql, params=()):
+        self._terminar()
+        t0 = time.perf_counter()
+        try:
+            return super().execute(sql, params)
+        finally:
+            self._sql, self._segundos = sql, time.perf_counter() - t0
+            self._filas = max(self.rowcount, 0)
+            if self.description is None:    # no devuelve filas: ya terminó
+                self._terminar()
+
+    def executemany(self, sql, params):
+        self._terminar()
+        t0 = time.perf_counter()
+        try:
+            return super().executemany(sql, params)
+        finally:
+            self._sql, self._segundos = sql, time.perf_counter() - t0
+            self._filas = max(self.rowcount, 0)
+            self._terminar()
+
+    def fetchone(self):
+        t0 = time.perf_counter()
+        fila = super().fetchone()
+        if self._sql is not None:
+            self._segundos += time.perf_counter() - t0
+            if fila is None:
+                self._terminar()
+            else:
+                self._filas += 1
+        return fila
+
+    def fetchmany(self, size=None):
+        t0 = time.perf_counter()
+        filas = super().fetchmany(self.arraysize if size is None else size)
+        if self._sql is not None:
+            self._segundos += time.perf_counter() - t0
+            self._filas += len(filas)
+            if not filas:
+                self._terminar()
+        return filas
+
+    def fetchall(self):
+        t0 = time.perf_counter()
+        filas = super().fetchall()
+        if self._sql is not None:
+            self._segundos += time.perf_counter() - t0
+            self._filas += len(filas)
+            self._terminar()
+        return filas
+
+    def close(self):
+        self._terminar()
+        super().close()
+
+    def __del__(self):
+        try:
+            self._terminar()
+        except Exception:
+            pass
+
+
+class ConexionMedida(sqlite3.Connection):
+    """Conexión cuyos cursores (también los de conn.execute) son CursorMedido."""
+
+    def cursor(self, factory=CursorMedido):
+        return super().cursor(factory)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, params):
+        return self.cursor().executemany(sql, params)
+
+
+def _contando_bytes(cuerpo, clave):
+    """Pasa el cuerpo de una respuesta transmitida y suma sus bytes al terminar."""
+    total = 0
+    try:
+        for parte in cuerpo:
+            total += len(parte)
+            yield parte
     finally:
-        # Programar el próximo backup en 24 horas
-        timer = threading.Timer(86400, realizar_backup)
-        timer.daemon = True
-        timer.start()
+        if hasattr(cuerpo, 'close'):
+            cuerpo.close()
+        with _metricas_lock:
+            _http_bytes[clave] = _http_bytes.get(clave, 0) + total
 
-def get_db():
-    """Obtiene una conexión a la base de datos"""
-    conn = sqlite3.connect(DATABASE)
+
+@app.before_request
+def iniciar_medicion():
+    request.environ['metricas.inicio'] = time.perf_counter()
+
+
+@app.after_request
+def registrar_medicion(respuesta):
+    inicio = request.environ.get('metricas.inicio')
+    if inicio is None:
+        return respuesta
+    clave = (request.url_rule.rule if request.url_rule else 'sin_ruta', request.method)
+    codigo = respuesta.status_code
+    largo = respuesta.content_length
+    if largo is None and respuesta.is_streamed and not respuesta.direct_passthrough:
+        respuesta.response = _contando_bytes(respuesta.response, clave)
+        largo = 0
+
+    def al_cerrar():
+        # La latencia llega hasta el último byte enviado, también en las transmitidas
+        segundos = time.perf_counter() - inicio
+        with _metricas_lock:
+            cubetas = _http_duracion.get(clave)
+            if cubetas is None:
+                cubetas = _http_duracion[clave] = [0] * (len(METRICAS_CUBETAS) + 1) + [0.0]
+            for i, limite in enumerate(METRICAS_CUBETAS):
+                if segundos <= limite:
+                    cubetas[i] += 1
+                    break
+            else:
+                cubetas[len(METRICAS_CUBETAS)] += 1
+            cubetas[-1] += segundos
+            clave_codigo = clave + (codigo,)
+            _http_respuestas[clave_codigo] = _http_respuestas.get(clave_codigo, 0) + 1
+            _http_bytes[clave] = _http_bytes.get(clave, 0) + (largo or 0)
+
+    respuesta.call_on_close(al_cerrar)
+    return respuesta
+
+
+def _etiquetas(**valores):
+    pares = []
+    for nombre, valor in valores.items():
+        valor = str(valor).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+        pares.append(f'{nombre}="{valor}"')
+    return '{' + ','.join(pares) + '}'
+
+
+def texto_metricas(extra=()):
+    """Las métricas de este proceso en formato de texto de Prometheus.
+
+    `extra` son tuplas (nombre, tipo, ayuda, [(etiquetas, valor), ...]) que
+    se agregan al final (pool, tareas).
+    """
+    with _metricas_lock:
+        duracion = {k: list(v) for k, v in _http_duracion.items()}
+        respuestas = dict(_http_respuestas)
+        enviados = dict(_http_bytes)
+        sql = {k: list(v) for k, v in _sql_metricas.items()}
+
+    lineas = []
+
+    def familia(nombre, tipo, ayuda):
+        lineas.append(f'# HELP {nombre} {ayuda}')
+        lineas.append(f'# TYPE {nombre} {tipo}')
+
+    pid = os.getpid()
+    familia('nippos_proceso_inicio_seconds', 'gauge', 'Hora de arranque del worker (epoch)')
+    lineas.append(f'nippos_proceso_inicio_seconds{_etiquetas(pid=pid)} {_proceso_inicio:.3f}')
+
+    familia('nippos_http_request_duration_seconds', 'histogram',
+            'Latencia de cada request hasta el último byte, por ruta')
+    for (ruta, metodo), cubetas in sorted(duracion.items()):
+        acumulado = 0
+        for limite, cantidad in zip(METRICAS_CUBETAS + ('+Inf',), cubetas):
+            acumulado += cantidad
+            lineas.append('nippos_http_request_duration_seconds_bucket'
+                          f'{_etiquetas(ruta=ruta, metodo=metodo, le=limite)} {acumulado}')
+        etiquetas = _etiquetas(ruta=ruta, metodo=metodo)
+        lineas.append(f'nippos_http_request_duration_seconds_sum{etiquetas} {cubetas[-1]:.6f}')
+        lineas.append(f'nippos_http_request_duration_seconds_count{etiquetas} {acumulado}')
+
+    familia('nippos_http_requests_total', 'counter', 'Respuestas por ruta y código HTTP')
+    for (ruta, metodo, codigo), cantidad in sorted(respuestas.items()):
+        lineas.append('nippos_http_requests_total'
+                      f'{_etiquetas(ruta=ruta, metodo=metodo, codigo=codigo)} {cantidad}')
+
+    familia('nippos_http_response_bytes_total', 'counter', 'Bytes de cuerpo enviados por ruta')
+    for (ruta, metodo), total in sorted(enviados.items()):
+        lineas.append(f'nippos_http_response_bytes_total{_etiquetas(ruta=ruta, metodo=metodo)} {total}')
+
+    for indice, nombre, ayuda in ((0, 'nippos_sql_statements_total', 'Ejecuciones por consulta'),
+                                  (1, 'nippos_sql_seconds_total', 'Segundos en execute + fetch por consulta'),
+                                  (2, 'nippos_sql_rows_total', 'Filas leídas o modificadas por consulta'),
+                                  (3, 'nippos_sql_slow_total', 'Ejecuciones sobre SQL_LENTA_SEGUNDOS')):
+        familia(nombre, 'counter', ayuda)
+        for consulta, datos in sorted(sql.items()):
+            valor = f'{datos[indice]:.6f}' if indice == 1 else datos[indice]
+            lineas.append(f'{nombre}{_etiquetas(consulta=consulta)} {valor}')
+
+    for nombre, tipo, ayuda, muestras in extra:
+        familia(nombre, tipo, ayuda)
+        for etiquetas, valor in muestras:
+            lineas.append(f'{nombre}{_etiquetas(**etiquetas) if etiquetas else ""} {valor}')
+    return '\n'.join(lineas) + '\n'
+
+
+# =====================================================
+# CONTROL DE ADMISIÓN (CARRILES POR CLASE DE PEDIDO)
+# =====================================================
+# Cada pedido entra por el carril de su clase: escritura (guardar asistencias y
+# datos maestros), lectura, reportes (consultas de rango completo, resúmenes y
+# exportaciones) o backups (descargas de la base). Cada carril tiene un número
+# de lugares compartido por todos los workers: cada lugar es un archivo en
+# CARRILES_DIR y estar atendiendo es tener su flock (si el proceso muere, el
+# sistema operativo lo libera). Sin lugar libre se espera, pero sólo si hay
+# turno en la cola del carril (también acotada) y hasta un tiempo máximo; si
+# no, se responde enseguida 429 (cola llena) o 503 (se agotó la espera), con
+# Retry-After. Así unos pocos reportes de fin de mes no pueden ocupar todos
+# los workers y los guardados del registro siguen entrando.
+
+CARRILES_DIR    = DATABASE + '.carriles'
+CARRIL_SONDEO   = 0.025    # segundos entre intentos mientras se espera lugar
+
+# clase: (lugares entre todos los workers, turnos de espera, segundos de espera, Retry-After)
+CARRILES_CONFIG = {
+    'escritura': (8, 32, 10, 2),
+    'lectura':   (8, 32, 5, 2),
+    # Esperando también se ocupa un worker: los pesados casi no esperan
+    'reportes':  (2, 2, 3, 30),
+    'backups':   (1, 0, 0, 60),
+}
+
+# Endpoints pesados; el resto es lectura (GET) o escritura (los demás métodos)
+CLASE_ENDPOINT = {
+    'get_asistencias':       'reportes',   # con `limit` es una página: lectura
+    'resumen_asistencias':   'reportes',
+    'exportar_komei':        'reportes',
+    'descargar_exportacion': 'reportes',
+    'backup_descargar':      'backups',
+}
+
+# Sin control: archivos de la interfaz y monitoreo, que tienen que responder siempre
+SIN_CARRIL = {'index', 'estatico', 'estatico_con_huella', 'metrics', 'sistema_db', 'sistema_tareas'}
+
+
+class Carril:
+    """Lugares y cola de espera de una clase de pedidos, compartidos entre procesos con flock.
+
+    Los contadores son de este worker (como el resto de /metrics).
+    """
+
+    def __init__(self, clase, lugares, turnos, espera_max, reintentar):
+        self.clase = clase
+        self.lugares = lugares
+        self.turnos = turnos
+        self.espera_max = espera_max
+        self.reintentar = reintentar
+        self.activos = 0
+        self.esperando = 0
+        self.admitidos = 0
+        self.rechazados = {'cola': 0, 'espera': 0}
+        self.espera_segundos = 0.0
+        self._lock = threading.Lock()
+
+    def _tomar(self, tipo, cantidad):
+        """Descriptor con el flock de un archivo libre de `tipo`, o None si están todos tomados."""
+        for i in range(cantidad):
+            fd = os.open(os.path.join(CARRILES_DIR, f'{self.clase}.{tipo}{i}'), os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except BlockingIOError:
+                os.close(fd)
+        return None
+
+    def entrar(self):
+        """(descriptor del lugar, None) o (None, motivo del rechazo: 'cola' o 'espera')."""
+        lugar = self._tomar('lugar', self.lugares)
+        if lugar is None:
+            turno = self._tomar('turno', self.turnos)
+            if turno is None:
+                with self._lock:
+                    self.rechazados['cola'] += 1
+                return None, 'cola'
+            inicio = time.monotonic()
+            with self._lock:
+                self.esperando += 1
+            try:
+                while lugar is None and time.monotonic() - inicio < self.espera_max:
+                    time.sleep(CARRIL_SONDEO)
+                    lugar = self._tomar('lugar', self.lugares)
+            finally:
+                os.close(turno)
+                with self._lock:
+                    self.esperando -= 1
+                    self.espera_segundos += time.monotonic() - inicio
+            if lugar is None:
+                with self._lock:
+                    self.rechazados['espera'] += 1
+                return None, 'espera'
+        with self._lock:
+            self.activos += 1
+            self.admitidos += 1
+        return lugar, None
+
+    def salir(self, lugar):
+        os.close(lugar)   # al cerrar se suelta el flock
+        with self._lock:
+            self.activos -= 1
+
+
+carriles = {clase: Carril(clase, *config) for clase, config in CARRILES_CONFIG.items()}
+
+
+def clase_del_pedido():
+    """Carril del pedido en curso, o None si no pasa por el control."""
+    endpoint = request.endpoint
+    if endpoint is None or endpoint in SIN_CARRIL:
+        return None
+    if endpoint == 'get_asistencias' and request.args.get('limit'):
+        return 'lectura'
+    return CLASE_ENDPOINT.get(endpoint) or ('lectura' if request.method in ('GET', 'HEAD') else 'escritura')
+
+
+@app.before_request
+def admitir_pedido():
+    if fcntl is None:   # Windows: sólo el servidor de desarrollo, un proceso
+        return None
+    clase = clase_del_pedido()
+    if clase is None:
+        return None
+    carril = carriles[clase]
+    os.makedirs(CARRILES_DIR, exist_ok=True)
+    lugar, motivo = carril.entrar()
+    if lugar is None:
+        respuesta = jsonify({'error': f'Servidor ocupado ({clase}); reintente en {carril.reintentar} s',
+                             'clase': clase})
+        respuesta.status_code = 429 if motivo == 'cola' else 503
+        respuesta.headers['Retry-After'] = str(carril.reintentar)
+        return respuesta
+    request.environ['admision.lugar'] = (carril, lugar)
+    return None
+
+
+@app.after_request
+def liberar_lugar_al_cerrar(respuesta):
+    # El lugar se suelta con el último byte enviado, también en las respuestas transmitidas
+    tomado = request.environ.pop('admision.lugar', None)
+    if tomado is not None:
+        respuesta.call_on_close(partial(tomado[0].salir, tomado[1]))
+    return respuesta
+
+
+@app.teardown_request
+def liberar_lugar(exc):
+    # Si no llegó a after_request (p. ej. falló otro after_request), soltarlo acá
+    tomado = request.environ.pop('admision.lugar', None)
+    if tomado is not None:
+        tomado[0].salir(tomado[1])
+
+
+# =====================================================
+# CONEXIONES A LA BASE DE DATOS (POOL POR HILO)
+# =====================================================
+
+DB_BUSY_TIMEOUT = 5000         # ms de espera si otro proceso tiene el lock de escritura
+DB_CACHE_SIZE   = -16000       # negativo = KiB de caché de páginas por conexión (~16 MB)
+DB_MMAP_SIZE    = 134217728    # 128 MB de lectura vía mmap
+
+_pool_local = threading.local()
+_pool_lock = threading.Lock()
+_pool_conexiones = {}          # ident del hilo → conexión abierta
+_pool_stats = {'hits': 0, 'misses': 0, 'cerradas': 0}
+
+
+def _abrir_conexion():
+    """Abre una conexión nueva en modo WAL con los pragmas de rendimiento."""
+    conn = sqlite3.connect(DATABASE, timeout=DB_BUSY_TIMEOUT / 1000, check_same_thread=False,
+                           factory=ConexionMedida)
     conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute(f'PRAGMA busy_timeout = {DB_BUSY_TIMEOUT}')
+    conn.execute(f'PRAGMA cache_size = {DB_CACHE_SIZE}')
+    conn.execute(f'PRAGMA mmap_size = {DB_MMAP_SIZE}')
+    conn.execute('PRAGMA temp_store = MEMORY')
     return conn
 
-def init_db():
-    """Inicializa la base de datos con las tablas necesarias"""
-    conn = get_db()
+
+def _purgar_hilos_muertos():
+    """Cierra las conexiones de hilos que ya terminaron (llamar con _pool_lock tomado)."""
+    vivos = {t.ident for t in threading.enumerate()}
+    for ident in [i for i in _pool_conexiones if i not in vivos]:
+        try:
+            _pool_conexiones.pop(ident).close()
+        except sqlite3.Error:
+            pass
+        _pool_stats['cerradas'] += 1
+
+
+def get_db():
+    """Obtiene la conexión del hilo actual (se abre una sola vez y se reutiliza)."""
+    conn = getattr(_pool_local, 'conn', None)
+    if conn is not None:
+        with _pool_lock:   # con gthread, varios hilos suman a la vez
+            _pool_stats['hits'] += 1
+        return conn
+
+    conn = _abrir_conexion()
+    _pool_local.conn = conn
+    with _pool_lock:
+        _pool_stats['misses'] += 1
+        _purgar_hilos_muertos()
+        _pool_conexiones[threading.get_ident()] = conn
+    return conn
+
+
+def cerrar_pool():
+    """Cierra todas las conexiones del pool (al apagar el worker)."""
+    with _pool_lock:
+        for conn in _pool_conexiones.values():
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+            _pool_stats['cerradas'] += 1
+        _pool_conexiones.clear()
+    _pool_local.__dict__.pop('conn', None)
+
+
+def estado_pool():
+    """Contadores del pool de conexiones."""
+    with _pool_lock:
+        return dict(_pool_stats, abiertas=len(_pool_conexiones))
+
+
+@app.teardown_appcontext
+def liberar_db(exc):
+    """Al terminar cada request deja la conexión del hilo sin transacciones abiertas."""
+    conn = getattr(_pool_local, 'conn', None)
+    if conn is not None and conn.in_transaction:
+        conn.rollback()
+
+
+atexit.register(cerrar_pool)
+
+def crear_tablas(conn):
+    """Crea las tablas base si no existen"""
     cursor = conn.cursor()
     
     # Tabla de clientes
@@ -178,6 +1139,228 @@ def init_db():
     ''')
     
     conn.commit()
+
+
+# =====================================================
+# MIGRACIONES DE ESQUEMA
+# =====================================================
+# Cada entrada se aplica una sola vez y en orden; PRAGMA user_version guarda
+# el número de la última migración aplicada. Nunca editar una ya publicada:
+# agregar una nueva al final.
+
+MIGRACIONES = [
+    # 1 — Índices para los filtros de asistencias y unicidad por día/obra/empleado
+    [
+        # Quitar duplicados históricos (se conserva el registro más nuevo)
+        '''DELETE FROM asistencias WHERE id NOT IN (
+               SELECT MAX(id) FROM asistencias GROUP BY fecha, obra_id, empleado_id)''',
+        '''CREATE UNIQUE INDEX IF NOT EXISTS ux_asistencias_fecha_obra_empleado
+               ON asistencias (fecha, obra_id, empleado_id)''',
+        'CREATE INDEX IF NOT EXISTS idx_asistencias_obra_fecha ON asistencias (obra_id, fecha)',
+        'CREATE INDEX IF NOT EXISTS idx_asistencias_empleado_fecha ON asistencias (empleado_id, fecha)',
+        'CREATE INDEX IF NOT EXISTS idx_obras_cliente ON obras (cliente_id)',
+        'CREATE INDEX IF NOT EXISTS idx_obras_lider ON obras (lider_id)',
+        'CREATE INDEX IF NOT EXISTS idx_obra_empleados_empleado ON obra_empleados (empleado_id)',
+        'CREATE INDEX IF NOT EXISTS idx_empleados_estado ON empleados (estado, nombre, apellido)',
+    ],
+    # 2 — Orden (fecha, id) para la paginación por cursor de /api/asistencias
+    [
+        'CREATE INDEX IF NOT EXISTS idx_asistencias_fecha ON asistencias (fecha)',
+    ],
+    # 3 — Resúmenes precalculados por obra/día y por empleado/obra/mes
+    [
+        '''CREATE TABLE IF NOT EXISTS resumen_diario (
+               fecha DATE NOT NULL,
+               obra_id INTEGER NOT NULL,
+               total INTEGER NOT NULL,
+               presentes INTEGER NOT NULL,
+               ausentes INTEGER NOT NULL,
+               horas_extras REAL NOT NULL,
+               jornada_dia INTEGER NOT NULL,
+               jornada_noche INTEGER NOT NULL,
+               jornada_dia_noche INTEGER NOT NULL,
+               PRIMARY KEY (fecha, obra_id)
+           ) WITHOUT ROWID''',
+        '''CREATE TABLE IF NOT EXISTS resumen_mensual (
+               mes TEXT NOT NULL,
+               obra_id INTEGER NOT NULL,
+               empleado_id INTEGER NOT NULL,
+               total INTEGER NOT NULL,
+               presentes INTEGER NOT NULL,
+               ausentes INTEGER NOT NULL,
+               horas_extras REAL NOT NULL,
+               jornada_dia INTEGER NOT NULL,
+               jornada_noche INTEGER NOT NULL,
+               jornada_dia_noche INTEGER NOT NULL,
+               PRIMARY KEY (mes, obra_id, empleado_id)
+           ) WITHOUT ROWID''',
+        'CREATE INDEX IF NOT EXISTS idx_resumen_diario_obra ON resumen_diario (obra_id, fecha)',
+        'CREATE INDEX IF NOT EXISTS idx_resumen_mensual_obra ON resumen_mensual (obra_id, mes)',
+        'CREATE INDEX IF NOT EXISTS idx_resumen_mensual_empleado ON resumen_mensual (empleado_id, mes)',
+        lambda conn: reconstruir_resumenes(conn.cursor()),
+    ],
+    # 4 — Fotos de empleados fuera de la fila, en una tabla por hash de contenido
+    [
+        '''CREATE TABLE IF NOT EXISTS fotos (
+               hash TEXT PRIMARY KEY,
+               mime TEXT NOT NULL,
+               datos BLOB NOT NULL,
+               miniatura BLOB,
+               created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+           )''',
+        'ALTER TABLE empleados ADD COLUMN foto_hash TEXT REFERENCES fotos (hash)',
+        'CREATE INDEX IF NOT EXISTS idx_empleados_foto ON empleados (foto_hash)',
+        lambda conn: migrar_fotos(conn.cursor()),
+    ],
+    # 5 — Versión por tabla de datos maestros, para el ETag y la caché de los listados
+    [
+        '''CREATE TABLE IF NOT EXISTS versiones_tabla (
+               tabla TEXT PRIMARY KEY,
+               version INTEGER NOT NULL DEFAULT 0
+           ) WITHOUT ROWID''',
+        '''INSERT OR IGNORE INTO versiones_tabla (tabla)
+               VALUES ('clientes'), ('lideres'), ('empleados'), ('obras'), ('obra_empleados')''',
+        *(f'''CREATE TRIGGER IF NOT EXISTS trg_version_{tabla}_{evento.lower()}
+                  AFTER {evento} ON {tabla}
+              BEGIN
+                  UPDATE versiones_tabla SET version = version + 1 WHERE tabla = '{tabla}';
+              END'''
+          for tabla in ('clientes', 'lideres', 'empleados', 'obras', 'obra_empleados')
+          for evento in ('INSERT', 'UPDATE', 'DELETE')),
+    ],
+    # 6 — Última ejecución de cada tarea programada
+    [
+        '''CREATE TABLE IF NOT EXISTS tareas_estado (
+               tarea TEXT PRIMARY KEY,
+               cron TEXT NOT NULL,
+               ultimo_inicio TEXT NOT NULL,
+               duracion REAL NOT NULL,
+               resultado TEXT NOT NULL,
+               detalle TEXT,
+               proxima TEXT,
+               pid INTEGER
+           )''',
+    ],
+    # 7 — Ids de los cambios recibidos por /api/sync/asistencias (idempotencia)
+    [
+        '''CREATE TABLE IF NOT EXISTS sync_cambios (
+               id TEXT PRIMARY KEY,
+               recibido TEXT NOT NULL,
+               estado TEXT NOT NULL,
+               respuesta TEXT NOT NULL
+           ) WITHOUT ROWID''',
+        'CREATE INDEX IF NOT EXISTS idx_sync_cambios_recibido ON sync_cambios (recibido)',
+    ],
+    # 8 — Secuencia de cambios y marcas de borrado de los datos maestros (/api/sync).
+    # Las filas existentes quedan con seq 1: entran en la primera carga completa.
+    [
+        '''CREATE TABLE IF NOT EXISTS sync_seq (
+               id INTEGER PRIMARY KEY CHECK (id = 1),
+               seq INTEGER NOT NULL
+           )''',
+        'INSERT OR IGNORE INTO sync_seq (id, seq) VALUES (1, 1)',
+        '''CREATE TABLE IF NOT EXISTS sync_borrados (
+               tabla TEXT NOT NULL,
+               clave INTEGER NOT NULL,
+               seq INTEGER NOT NULL,
+               borrado TEXT NOT NULL,
+               PRIMARY KEY (tabla, clave)
+           ) WITHOUT ROWID''',
+        'CREATE INDEX IF NOT EXISTS idx_sync_borrados_seq ON sync_borrados (seq)',
+        *(sql for tabla in ('clientes', 'lideres', 'empleados', 'obras', 'obra_empleados') for sql in (
+            f'ALTER TABLE {tabla} ADD COLUMN seq INTEGER NOT NULL DEFAULT 1',
+            f'ALTER TABLE {tabla} ADD COLUMN updated_at TEXT',
+            f'CREATE INDEX IF NOT EXISTS idx_{tabla}_seq ON {tabla} (seq)',
+            f'''CREATE TRIGGER IF NOT EXISTS trg_seq_{tabla}_insert AFTER INSERT ON {tabla}
+                BEGIN
+                    UPDATE sync_seq SET seq = seq + 1;
+                    UPDATE {tabla} SET seq = (SELECT seq FROM sync_seq), updated_at = datetime('now')
+                     WHERE id = NEW.id;
+                END''',
+            # El WHEN evita que el UPDATE del propio trigger lo vuelva a disparar
+            f'''CREATE TRIGGER IF NOT EXISTS trg_seq_{tabla}_update AFTER UPDATE ON {tabla}
+                WHEN NEW.seq = OLD.seq
+                BEGIN
+                    UPDATE sync_seq SET seq = seq + 1;
+                    UPDATE {tabla} SET seq = (SELECT seq FROM sync_seq), updated_at = datetime('now')
+                     WHERE id = NEW.id;
+                END''',
+            f'''CREATE TRIGGER IF NOT EXISTS trg_seq_{tabla}_delete AFTER DELETE ON {tabla}
+                BEGIN
+                    UPDATE sync_seq SET seq = seq + 1;
+                    INSERT INTO sync_borrados (tabla, clave, seq, borrado)
+                    VALUES ('{tabla}', OLD.id, (SELECT seq FROM sync_seq), datetime('now'))
+                    ON CONFLICT (tabla, clave) DO UPDATE SET seq = excluded.seq, borrado = excluded.borrado;
+                END''',
+        )),
+    ],
+    # 9 — Versión por fecha de las asistencias, para el índice de ocupación de cada worker
+    [
+        '''CREATE TABLE IF NOT EXISTS ocupacion_version (
+               fecha TEXT PRIMARY KEY,
+               version INTEGER NOT NULL
+           ) WITHOUT ROWID''',
+        # Cada fila insertada, cambiada o borrada suma 1 a la versión de su fecha
+        *(f'''CREATE TRIGGER IF NOT EXISTS trg_ocupacion_{evento.lower()} AFTER {evento} ON asistencias
+              BEGIN
+                  INSERT INTO ocupacion_version (fecha, version) VALUES ({fila}.fecha, 1)
+                  ON CONFLICT (fecha) DO UPDATE SET version = version + 1;
+                  {extra}
+              END'''
+          for evento, fila, extra in (
+              ('INSERT', 'NEW', ''),
+              ('DELETE', 'OLD', ''),
+              # Si la fila cambió de fecha, también cambia la fecha anterior
+              ('UPDATE', 'NEW', '''INSERT INTO ocupacion_version (fecha, version)
+                  SELECT OLD.fecha, 1 WHERE OLD.fecha != NEW.fecha
+                  ON CONFLICT (fecha) DO UPDATE SET version = version + 1;'''),
+          )),
+    ],
+    # 10 — Trabajos de exportación en segundo plano (ver EXPORTACIONES)
+    [
+        '''CREATE TABLE IF NOT EXISTS exportaciones (
+               id TEXT PRIMARY KEY,
+               tipo TEXT NOT NULL,
+               filtros TEXT NOT NULL,
+               estado TEXT NOT NULL,
+               progreso REAL NOT NULL DEFAULT 0,
+               error TEXT,
+               bytes INTEGER,
+               creado TEXT NOT NULL,
+               actualizado TEXT NOT NULL,
+               terminado TEXT
+           )''',
+        'CREATE INDEX IF NOT EXISTS idx_exportaciones_creado ON exportaciones (creado)',
+    ],
+]
+
+
+def aplicar_migraciones(conn):
+    """Aplica las migraciones pendientes, cada una en su propia transacción."""
+    for numero, sentencias in enumerate(MIGRACIONES, start=1):
+        if conn.execute('PRAGMA user_version').fetchone()[0] >= numero:
+            continue
+        # BEGIN IMMEDIATE: si otro worker migra al mismo tiempo, esperamos y re-verificamos
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if conn.execute('PRAGMA user_version').fetchone()[0] < numero:
+                for sql in sentencias:
+                    # Una sentencia SQL o una función que recibe la conexión
+                    sql(conn) if callable(sql) else conn.execute(sql)
+                conn.execute(f'PRAGMA user_version = {numero}')
+                print(f'[DB] Migración {numero} aplicada')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+
+def init_db():
+    """Inicializa la base de datos con las tablas necesarias"""
+    conn = get_db()
+    crear_tablas(conn)
+    aplicar_migraciones(conn)
+    cursor = conn.cursor()
     
     # Insertar datos de ejemplo si no existen
     cursor.execute('SELECT COUNT(*) as count FROM clientes')
@@ -212,65 +1395,362 @@ def init_db():
         
         conn.commit()
     
-    conn.close()
+    # Actualizar estadísticas del planificador si hicieron falta
+    conn.execute('PRAGMA optimize')
+
+# =====================================================
+# CACHÉ DE LISTADOS (ETag POR VERSIÓN DE TABLA)
+# =====================================================
+# Los triggers de la migración 5 suben `versiones_tabla.version` con cada
+# cambio en los datos maestros. Los listados usan esas versiones como ETag y
+# guardan el JSON ya serializado: mientras no cambien, una recarga cuesta sólo
+# leer las versiones (o nada más que un 304 si el navegador ya lo tiene).
+
+CACHE_LISTADOS_MAX = 256   # respuestas guardadas (ruta + query string)
+
+# Parte del ETag: si cambia el código, cambia el formato de las respuestas
+with open(__file__, 'rb') as _f:
+    _VERSION_CODIGO = hashlib.sha256(_f.read()).hexdigest()[:8]
+
+_cache_listados = {}   # (ruta, query string) -> (etag, cuerpo JSON en bytes)
+_cache_lock = threading.Lock()
+
+
+def versiones_de(conn, tablas):
+    """Versión actual de cada tabla, en el mismo orden."""
+    placeholders = ','.join('?' * len(tablas))
+    filas = dict(conn.execute(
+        f'SELECT tabla, version FROM versiones_tabla WHERE tabla IN ({placeholders})', tablas
+    ).fetchall())
+    return [filas.get(tabla, 0) for tabla in tablas]
+
+
+def cache_por_version(*tablas):
+    """Decorador para GETs que devuelven datos que dependen sólo de `tablas`.
+
+    La función decorada devuelve los datos (lista o dict) o el JSON ya armado
+    (str, p. ej. de lista_json) y se llama sólo cuando alguna de las tablas
+    cambió desde la última vez.
+    """
+    def decorador(funcion):
+        @wraps(funcion)
+        def envoltura(*args, **kwargs):
+            conn = get_db()
+            # Versiones y datos desde la misma instantánea (WAL)
+            conn.execute('BEGIN')
+            try:
+                etag = '-'.join([_VERSION_CODIGO] + [str(v) for v in versiones_de(conn, tablas)])
+                clave = (request.path, request.query_string)
+                with _cache_lock:
+                    guardado = _cache_listados.get(clave)
+                if guardado is not None and guardado[0] == etag:
+                    cuerpo = guardado[1]
+                else:
+                    cuerpo = funcion(*args, **kwargs)
+                    if not isinstance(cuerpo, str):
+                        cuerpo = app.json.dumps(cuerpo)
+                    cuerpo = cuerpo.encode()   # se codifica una vez, no en cada respuesta
+                    with _cache_lock:
+                        if len(_cache_listados) >= CACHE_LISTADOS_MAX:
+                            _cache_listados.pop(next(iter(_cache_listados)))
+                        _cache_listados[clave] = (etag, cuerpo)
+            finally:
+                conn.rollback()
+            
+            if request.if_none_match.contains(etag):
+                respuesta = Response(status=304)
+            else:
+                respuesta = Response(cuerpo, mimetype='application/json')
+            respuesta.set_etag(etag)
+            # El navegador guarda la respuesta pero revalida siempre (barato: 304)
+            respuesta.headers['Cache-Control'] = 'no-cache'
+            return respuesta
+        return envoltura
+    return decorador
+
 
 # =====================================================
 # RUTAS - CLIENTES
 # =====================================================
 
 # =====================================================
-# RUTAS FRONTEND
+# RESPUESTAS JSON (PROYECCIÓN Y FILAS ARMADAS POR SQLITE)
 # =====================================================
+# Los listados no pasan las filas por dicts de Python: SQLite arma cada fila
+# como objeto JSON (json_object) y acá sólo se unen los textos. Con
+# `fields=id,nombre` se piden sólo esas columnas; la consulta original queda
+# como subconsulta y SQLite ni calcula las que no se piden (p. ej. las URLs
+# de foto). Los registros sueltos (/api/<tabla>/<id>) se arman igual y con
+# `embed=` traen sus relaciones en el mismo pedido. El resto de las respuestas
+# usa orjson si está instalado.
 
-@app.route('/')
-def index():
-    return send_from_directory('.', 'index.html')
 
-@app.route('/<path:filename>')
-def static_files(filename):
-    return send_from_directory('.', filename)
+class ProveedorJSON(DefaultJSONProvider):
+    """jsonify y app.json.dumps con orjson (mismo resultado, varias veces más rápido)."""
 
-# =====================================================
-# CLIENTES
-# =====================================================
+    def dumps(self, obj, **kwargs):
+        if orjson is None:
+            return super().dumps(obj, **kwargs)
+        opciones = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if kwargs.get('sort_keys', self.sort_keys):
+            opciones |= orjson.OPT_SORT_KEYS
+        if kwargs.get('indent'):
+            opciones |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=opciones).decode()
 
-@app.route('/api/clientes', methods=['GET'])
-def get_clientes():
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM clientes ORDER BY nombre')
-    clientes = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return jsonify(clientes)
+    def loads(self, s, **kwargs):
+        if orjson is None:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
 
-@app.route('/api/clientes', methods=['POST'])
-def create_cliente():
-    data = request.json
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO clientes (nombre, razon_social, ruc_dni, telefono, email, direccion)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (data['nombre'], data.get('razon_social'), data.get('ruc_dni'), 
-          data.get('telefono'), data.get('email'), data.get('direccion')))
-    conn.commit()
-    cliente_id = cursor.lastrowid
-    conn.close()
-    return jsonify({'id': cliente_id, 'message': 'Cliente creado exitosamente'}), 201
 
-@app.route('/api/clientes/<int:id>', methods=['PUT'])
-def update_cliente(id):
-    data = request.json
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('''
-        UPDATE clientes 
-        SET nombre = ?, razon_social = ?, ruc_dni = ?, telefono = ?, email = ?, direccion = ?
-        WHERE id = ?
-    ''', (data['nombre'], data.get('razon_social'), data.get('ruc_dni'),
-          data.get('telefono'), data.get('email'), data.get('direccion'), id))
+app.json = ProveedorJSON(app)
+
+
+class CampoDesconocido(ValueError):
+    """`fields=` nombra una columna que la consulta no devuelve."""
+
+
+@app.errorhandler(CampoDesconocido)
+def campo_desconocido(error):
+    return jsonify({'error': str(error)}), 400
+
+
+_columnas_consulta = {}   # texto SQL -> columnas que devuelve (el esquema no cambia en marcha)
+
+
+def columnas_de(sql, params=()):
+    """Columnas que devuelve `sql`, averiguadas una vez sin leer filas."""
+    if sql not in _columnas_consulta:
+        cursor = get_db().execute(f'SELECT * FROM ({sql}) LIMIT 0', params)
+        _columnas_consulta[sql] = tuple(columna[0] for columna in cursor.description)
+    return _columnas_consulta[sql]
+
+
+def campos_pedidos(sql, params=(), fields=None):
+    """Columnas de `fields` (por defecto, las de request.args) o todas si no vino."""
+    disponibles = columnas_de(sql, params)
+    if fields is None:
+        fields = request.args.get('fields', '')
+    pedidos = [campo for campo in fields.split(',') if campo]
+    for campo in pedidos:
+        if campo not in disponibles:
+            raise CampoDesconocido(f'Campo desconocido: {campo}')
+    return pedidos or list(disponibles)
+
+
+def sql_json(sql, columnas, extra=()):
+    """Envuelve `sql` para que la primera columna de cada fila sea su objeto JSON.
+
+    `extra` agrega columnas de la subconsulta tal cual, después del JSON.
+    """
+    pares = ', '.join(f"'{c}', \"{c}\"" for c in columnas)
+    return f'SELECT json_object({pares}){"".join(f", {c}" for c in extra)} FROM ({sql})'
+
+
+def lista_json(sql, params=(), fields=None):
+    """Array JSON (texto) con las filas de `sql`, en su orden, proyectado con `fields=`."""
+    cursor = get_db().execute(sql_json(sql, campos_pedidos(sql, params, fields)), params)
+    return '[' + ','.join(fila[0] for fila in cursor.fetchall()) + ']'
+
+
+def recurso_json(sql, params, no_encontrado, relaciones=None):
+    """Respuesta con un solo registro (`sql` devuelve una fila o ninguna), con ETag.
+
+    Acepta `fields=` como los listados y `embed=a,b` con nombres de
+    `relaciones` ({nombre: (sql, es_lista)}, con los mismos params): cada una
+    se agrega al objeto, completa, como lista de filas o como una fila (o null).
+    """
+    relaciones = relaciones or {}
+    embed = [nombre for nombre in request.args.get('embed', '').split(',') if nombre]
+    desconocidas = [nombre for nombre in embed if nombre not in relaciones]
+    if desconocidas:
+        return jsonify({'error': f'Relación desconocida: {", ".join(desconocidas)}'}), 400
+
+    conn = get_db()
+    conn.execute('BEGIN')   # el registro y sus relaciones desde la misma instantánea
+    try:
+        fila = conn.execute(sql_json(sql, campos_pedidos(sql, params)), params).fetchone()
+        if fila is None:
+            return jsonify({'error': no_encontrado}), 404
+        partes = [fila[0][1:-1]]
+        for nombre in embed:
+            sql_relacion, es_lista = relaciones[nombre]
+            if es_lista:
+                texto = lista_json(sql_relacion, params, '')
+            else:
+                relacionada = conn.execute(sql_json(sql_relacion, columnas_de(sql_relacion, params)),
+                                           params).fetchone()
+                texto = relacionada[0] if relacionada else 'null'
+            partes.append(f'"{nombre}":{texto}')
+    finally:
+        conn.rollback()
+
+    respuesta = Response('{' + ','.join(partes) + '}', mimetype='application/json')
+    respuesta.add_etag()
+    respuesta.headers['Cache-Control'] = 'no-cache'
+    return respuesta.make_conditional(request)
+
+
+# =====================================================
+# RUTAS FRONTEND (RECURSOS ESTÁTICOS)
+# =====================================================
+# Sólo se sirven los archivos de ESTATICOS. Al arrancar se leen a memoria, se
+# comprimen (gzip y, si está instalado el paquete brotli, br) y cada uno
+# recibe un nombre con la huella de su contenido: /estaticos/script.1a2b3c4d5e.js.
+# index.html se reescribe para usar esos nombres, así que pueden guardarse en
+# caché un año sin revalidar; index.html y los nombres originales se
+# revalidan siempre con ETag (304 si no cambiaron). sw.js se registra siempre
+# con su nombre original: el alcance de un service worker sale de su URL.
+
+ESTATICOS = ('index.html', 'script.js', 'cola.js', 'styles.css', 'logo-komei.jpg', 'sw.js')
+ESTATICOS_COMPRIMIR  = ('.html', '.js', '.css')   # las imágenes ya vienen comprimidas
+ESTATICOS_PREFIJO    = '/estaticos/'
+ESTATICO_CACHE_SEGUNDOS = 31536000                 # un año: el nombre cambia si cambia el archivo
+
+_estaticos = {}          # nombre (original o con huella) → recurso
+_estaticos_mtimes = {}   # para recompilar en modo debug si se edita un archivo
+
+
+def _comprimidos(datos):
+    """Variantes comprimidas que valen la pena: {'br': bytes, 'gzip': bytes}."""
+    variantes = {'gzip': gzip.compress(datos, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variantes['br'] = brotli.compress(datos, quality=11)
+    return {codificacion: cuerpo for codificacion, cuerpo in variantes.items()
+            if len(cuerpo) < len(datos)}
+
+
+def _recurso(nombre, datos, inmutable):
+    return {
+        'datos':      datos,
+        'mime':       mimetypes.guess_type(nombre)[0] or 'application/octet-stream',
+        'etag':       hashlib.sha256(datos).hexdigest()[:20],
+        'variantes':  _comprimidos(datos) if nombre.endswith(ESTATICOS_COMPRIMIR) else {},
+        'inmutable':  inmutable,
+    }
+
+
+def compilar_estaticos():
+    """Lee, huella y comprime los recursos de ESTATICOS; reescribe index.html."""
+    recursos = {}
+    huellas = {}
+    mtimes = {}
+    for nombre in ESTATICOS:
+        ruta = os.path.join(app.root_path, nombre)
+        if not os.path.exists(ruta):
+            continue
+        mtimes[nombre] = os.path.getmtime(ruta)
+        with open(ruta, 'rb') as archivo:
+            datos = archivo.read()
+        if nombre == 'index.html':
+            continue
+        base, extension = os.path.splitext(nombre)
+        con_huella = f'{base}.{hashlib.sha256(datos).hexdigest()[:10]}{extension}'
+        huellas[nombre] = ESTATICOS_PREFIJO + con_huella
+        recursos[nombre] = _recurso(nombre, datos, inmutable=False)
+        recursos[con_huella] = dict(recursos[nombre], inmutable=True)
+
+    if 'index.html' in mtimes:
+        with open(os.path.join(app.root_path, 'index.html'), encoding='utf-8') as archivo:
+            html = archivo.read()
+        html = re.sub(r'''\b(src|href)=(["'])([^"'?#]+)\2''',
+                      lambda m: f'{m[1]}={m[2]}{huellas.get(m[3], m[3])}{m[2]}', html)
+        recursos['index.html'] = _recurso('index.html', html.encode('utf-8'), inmutable=False)
+
+    _estaticos.clear()
+    _estaticos.update(recursos)
+    _estaticos_mtimes.clear()
+    _estaticos_mtimes.update(mtimes)
+
+
+def _servir_estatico(nombre):
+    if app.debug and any(os.path.getmtime(os.path.join(app.root_path, n)) != m
+                         for n, m in _estaticos_mtimes.items()):
+        compilar_estaticos()
+    recurso = _estaticos.get(nombre)
+    if recurso is None:
+        return jsonify({'error': 'No encontrado'}), 404
+
+    codificacion = None
+    for candidata in ('br', 'gzip'):
+        if candidata in recurso['variantes'] and request.accept_encodings[candidata]:
+            codificacion = candidata
+            break
+    cuerpo = recurso['variantes'][codificacion] if codificacion else recurso['datos']
+
+    respuesta = Response(cuerpo, mimetype=recurso['mime'])
+    respuesta.set_etag(recurso['etag'] + (f'-{codificacion}' if codificacion else ''))
+    if codificacion:
+        respuesta.headers['Content-Encoding'] = codificacion
+    if recurso['variantes']:
+        respuesta.vary.add('Accept-Encoding')
+    if recurso['inmutable']:
+        respuesta.headers['Cache-Control'] = f'public, max-age={ESTATICO_CACHE_SEGUNDOS}, immutable'
+    else:
+        respuesta.headers['Cache-Control'] = 'no-cache'
+    return respuesta.make_conditional(request)
+
+
+compilar_estaticos()
+
+
+@app.route('/')
+def index():
+    return _servir_estatico('index.html')
+
+
+@app.route(ESTATICOS_PREFIJO + '<nombre>')
+def estatico_con_huella(nombre):
+    return _servir_estatico(nombre)
+
+
+# Los nombres originales (p. ej. /script.js), revalidando siempre
+@app.route('/<any(' + ', '.join(repr(n) for n in ESTATICOS if n != 'index.html') + '):nombre>')
+def estatico(nombre):
+    return _servir_estatico(nombre)
+
+# =====================================================
+# CLIENTES
+# =====================================================
+
+@app.route('/api/clientes', methods=['GET'])
+@cache_por_version('clientes')
+def get_clientes():
+    return lista_json('SELECT * FROM clientes ORDER BY nombre')
+
+@app.route('/api/clientes/<int:id>', methods=['GET'])
+def get_cliente(id):
+    return recurso_json('SELECT * FROM clientes WHERE id = :id', {'id': id}, 'Cliente no encontrado', {
+        'obras': (SQL_OBRAS.format(where='WHERE o.cliente_id = :id') + ' ORDER BY o.nombre', True),
+    })
+
+@app.route('/api/clientes', methods=['POST'])
+def create_cliente():
+    data = request.json
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('''
+        INSERT INTO clientes (nombre, razon_social, ruc_dni, telefono, email, direccion)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (data['nombre'], data.get('razon_social'), data.get('ruc_dni'), 
+          data.get('telefono'), data.get('email'), data.get('direccion')))
+    conn.commit()
+    cliente_id = cursor.lastrowid
+    return jsonify({'id': cliente_id, 'message': 'Cliente creado exitosamente'}), 201
+
+@app.route('/api/clientes/<int:id>', methods=['PUT'])
+def update_cliente(id):
+    data = request.json
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('''
+        UPDATE clientes 
+        SET nombre = ?, razon_social = ?, ruc_dni = ?, telefono = ?, email = ?, direccion = ?
+        WHERE id = ?
+    ''', (data['nombre'], data.get('razon_social'), data.get('ruc_dni'),
+          data.get('telefono'), data.get('email'), data.get('direccion'), id))
     conn.commit()
-    conn.close()
     return jsonify({'message': 'Cliente actualizado exitosamente'})
 
 @app.route('/api/clientes/<int:id>', methods=['DELETE'])
@@ -279,7 +1759,6 @@ def delete_cliente(id):
     cursor = conn.cursor()
     cursor.execute('DELETE FROM clientes WHERE id = ?', (id,))
     conn.commit()
-    conn.close()
     return jsonify({'message': 'Cliente eliminado exitosamente'})
 
 # =====================================================
@@ -287,13 +1766,15 @@ def delete_cliente(id):
 # =====================================================
 
 @app.route('/api/lideres', methods=['GET'])
+@cache_por_version('lideres')
 def get_lideres():
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM lideres ORDER BY nombre, apellido')
-    lideres = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return jsonify(lideres)
+    return lista_json('SELECT * FROM lideres ORDER BY nombre, apellido')
+
+@app.route('/api/lideres/<int:id>', methods=['GET'])
+def get_lider(id):
+    return recurso_json('SELECT * FROM lideres WHERE id = :id', {'id': id}, 'Líder no encontrado', {
+        'obras': (SQL_OBRAS.format(where='WHERE o.lider_id = :id') + ' ORDER BY o.nombre', True),
+    })
 
 @app.route('/api/lideres', methods=['POST'])
 def create_lider():
@@ -306,7 +1787,6 @@ def create_lider():
     ''', (data['nombre'], data['apellido'], data.get('telefono'), data.get('email')))
     conn.commit()
     lider_id = cursor.lastrowid
-    conn.close()
     return jsonify({'id': lider_id, 'message': 'Líder creado exitosamente'}), 201
 
 @app.route('/api/lideres/<int:id>', methods=['PUT'])
@@ -320,7 +1800,6 @@ def update_lider(id):
         WHERE id = ?
     ''', (data['nombre'], data['apellido'], data.get('telefono'), data.get('email'), id))
     conn.commit()
-    conn.close()
     return jsonify({'message': 'Líder actualizado exitosamente'})
 
 @app.route('/api/lideres/<int:id>', methods=['DELETE'])
@@ -329,295 +1808,1968 @@ def delete_lider(id):
     cursor = conn.cursor()
     cursor.execute('DELETE FROM lideres WHERE id = ?', (id,))
     conn.commit()
-    conn.close()
     return jsonify({'message': 'Líder eliminado exitosamente'})
 
+# =====================================================
+# FOTOS DE EMPLEADOS
+# =====================================================
+# Cada foto se guarda una sola vez en la tabla `fotos`, identificada por el
+# SHA-256 de su contenido, y `empleados.foto_hash` apunta a ella. Quedan dentro
+# de la misma base para que los backups sigan siendo un único archivo completo.
+
+FOTO_MAX_BYTES      = 5 * 1024 * 1024   # mismo límite que valida el frontend
+FOTO_MINIATURA      = 128               # lado máximo de la miniatura (px)
+FOTO_CACHE_SEGUNDOS = 31536000          # las URLs con ?v=<hash> nunca cambian de contenido
+
+# Columnas de empleados que devuelve la API (alias `e`): la foto va como URL
+# de /api/empleados/<id>/foto, con `v` = inicio del hash para que cambie con ella
+SQL_URL_FOTO = '''CASE WHEN e.foto_hash IS NOT NULL
+        THEN '/api/empleados/' || e.id || '/foto?{tam}v=' || substr(e.foto_hash, 1, 16) END'''
+
+COLUMNAS_EMPLEADO = f'''
+    e.id, e.nombre, e.apellido, e.dni, e.telefono, e.cargo, e.fecha_ingreso, e.estado, e.created_at,
+    {SQL_URL_FOTO.format(tam='')} AS foto,
+    {SQL_URL_FOTO.format(tam='tam=mini&')} AS foto_miniatura
+'''
+
+
+def _decodificar_data_url(valor):
+    """(mime, bytes) de un data URL de imagen en base64, o None si no lo es."""
+    cabecera, separador, datos = valor.partition(',')
+    if not separador or not cabecera.startswith('data:image/') or not cabecera.endswith(';base64'):
+        return None
+    try:
+        return cabecera[len('data:'):-len(';base64')], base64.b64decode(datos, validate=True)
+    except binascii.Error:
+        return None
+
+
+def _generar_miniatura(datos):
+    """JPEG de como máximo FOTO_MINIATURA px de lado; None sin Pillow o si no se puede leer."""
+    if Image is None:
+        return None
+    try:
+        with Image.open(io.BytesIO(datos)) as original:
+            imagen = ImageOps.exif_transpose(original)
+            imagen.thumbnail((FOTO_MINIATURA, FOTO_MINIATURA))
+            if imagen.mode != 'RGB':
+                # Fondo blanco para las imágenes con transparencia
+                fondo = Image.new('RGB', imagen.size, 'white')
+                rgba = imagen.convert('RGBA')
+                fondo.paste(rgba, mask=rgba.getchannel('A'))
+                imagen = fondo
+            salida = io.BytesIO()
+            imagen.save(salida, 'JPEG', quality=85, optimize=True)
+            return salida.getvalue()
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+
+
+def guardar_foto(cursor, mime, datos):
+    """Guarda la foto (si no estaba ya) y devuelve su hash."""
+    foto_hash = hashlib.sha256(datos).hexdigest()
+    # Dos subidas simultáneas de la misma imagen: la segunda no inserta nada
+    cursor.execute('INSERT OR IGNORE INTO fotos (hash, mime, datos, miniatura) VALUES (?, ?, ?, ?)',
+                   (foto_hash, mime, datos, _generar_miniatura(datos)))
+    return foto_hash
+
+
+def liberar_foto(cursor, foto_hash):
+    """Borra la foto si ya ningún empleado la usa."""
+    if foto_hash:
+        cursor.execute('''
+            DELETE FROM fotos
+            WHERE hash = ? AND NOT EXISTS (SELECT 1 FROM empleados WHERE foto_hash = ?)
+        ''', (foto_hash, foto_hash))
+
+
+def foto_del_pedido(cursor, valor, actual=None):
+    """Hash a guardar según el campo `foto` recibido.
+
+    Un data URL es una foto nueva, un valor vacío la quita y cualquier otro
+    valor (la URL que devolvió la API) conserva la actual. Lanza ValueError si
+    la foto nueva no es válida.
+    """
+    if not valor:
+        return None
+    if not valor.startswith('data:'):
+        return actual
+    imagen = _decodificar_data_url(valor)
+    if imagen is None:
+        raise ValueError('La foto no es una imagen válida')
+    if len(imagen[1]) > FOTO_MAX_BYTES:
+        raise ValueError('La foto supera el máximo de 5MB')
+    return guardar_foto(cursor, *imagen)
+
+
+def migrar_fotos(cursor):
+    """Pasa las fotos en base64 de `empleados.foto` a la tabla `fotos`."""
+    cursor.execute("SELECT id, foto FROM empleados WHERE foto IS NOT NULL AND foto != ''")
+    for row in cursor.fetchall():
+        imagen = _decodificar_data_url(row['foto'])
+        # Un valor que no es un data URL de imagen no se podía mostrar: se descarta
+        foto_hash = guardar_foto(cursor, *imagen) if imagen else None
+        cursor.execute('UPDATE empleados SET foto_hash = ?, foto = NULL WHERE id = ?',
+                       (foto_hash, row['id']))
+
+
 # =====================================================
 # RUTAS - EMPLEADOS
 # =====================================================
 
 @app.route('/api/empleados', methods=['GET'])
+@cache_por_version('empleados')
 def get_empleados():
     estado = request.args.get('estado')
-    conn = get_db()
-    cursor = conn.cursor()
-    
     if estado:
-        cursor.execute('SELECT * FROM empleados WHERE estado = ? ORDER BY nombre, apellido', (estado,))
-    else:
-        cursor.execute('SELECT * FROM empleados ORDER BY nombre, apellido')
-    
-    empleados = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return jsonify(empleados)
+        return lista_json(f'SELECT {COLUMNAS_EMPLEADO} FROM empleados e WHERE e.estado = ? '
+                          'ORDER BY e.nombre, e.apellido', (estado,))
+    return lista_json(f'SELECT {COLUMNAS_EMPLEADO} FROM empleados e ORDER BY e.nombre, e.apellido')
+
+@app.route('/api/empleados/<int:id>', methods=['GET'])
+def get_empleado(id):
+    # embed=obras: las obras a las que está asignado
+    obras = SQL_OBRAS.format(where='WHERE o.id IN (SELECT obra_id FROM obra_empleados WHERE empleado_id = :id)')
+    return recurso_json(f'SELECT {COLUMNAS_EMPLEADO} FROM empleados e WHERE e.id = :id', {'id': id},
+                        'Empleado no encontrado', {'obras': (obras + ' ORDER BY o.nombre', True)})
 
 @app.route('/api/empleados', methods=['POST'])
 def create_empleado():
     data = request.json
     conn = get_db()
     cursor = conn.cursor()
+    try:
+        foto_hash = foto_del_pedido(cursor, data.get('foto'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     cursor.execute('''
-        INSERT INTO empleados (nombre, apellido, dni, telefono, cargo, fecha_ingreso, estado, foto)
+        INSERT INTO empleados (nombre, apellido, dni, telefono, cargo, fecha_ingreso, estado, foto_hash)
         VALUES (?, ?, ?, ?, ?, ?, ?, ?)
     ''', (data['nombre'], data['apellido'], data.get('dni'), data.get('telefono'),
-          data.get('cargo'), data.get('fecha_ingreso'), data.get('estado', 'activo'), data.get('foto')))
+          data.get('cargo'), data.get('fecha_ingreso'), data.get('estado', 'activo'), foto_hash))
     conn.commit()
     empleado_id = cursor.lastrowid
-    conn.close()
     return jsonify({'id': empleado_id, 'message': 'Empleado creado exitosamente'}), 201
 
-@app.route('/api/empleados/<int:id>', methods=['PUT'])
-def update_empleado(id):
-    data = request.json
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('''
-        UPDATE empleados 
-        SET nombre = ?, apellido = ?, dni = ?, telefono = ?, cargo = ?, 
-            fecha_ingreso = ?, estado = ?, foto = ?
-        WHERE id = ?
-    ''', (data['nombre'], data['apellido'], data.get('dni'), data.get('telefono'),
-          data.get('cargo'), data.get('fecha_ingreso'), data.get('estado'), data.get('foto'), id))
-    conn.commit()
-    conn.close()
-    return jsonify({'message': 'Empleado actualizado exitosamente'})
+@app.route('/api/empleados/<int:id>', methods=['PUT'])
+def update_empleado(id):
+    data = request.json
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('SELECT foto_hash FROM empleados WHERE id = ?', (id,))
+    fila = cursor.fetchone()
+    if fila is None:
+        return jsonify({'error': 'Empleado no encontrado'}), 404
+    foto_anterior = fila['foto_hash']
+    try:
+        foto_hash = foto_del_pedido(cursor, data.get('foto'), foto_anterior)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    cursor.execute('''
+        UPDATE empleados 
+        SET nombre = ?, apellido = ?, dni = ?, telefono = ?, cargo = ?, 
+            fecha_ingreso = ?, estado = ?, foto_hash = ?
+        WHERE id = ?
+    ''', (data['nombre'], data['apellido'], data.get('dni'), data.get('telefono'),
+          data.get('cargo'), data.get('fecha_ingreso'), data.get('estado'), foto_hash, id))
+    if foto_anterior != foto_hash:
+        liberar_foto(cursor, foto_anterior)
+    conn.commit()
+    return jsonify({'message': 'Empleado actualizado exitosamente'})
+
+@app.route('/api/empleados/<int:id>', methods=['DELETE'])
+def delete_empleado(id):
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('SELECT foto_hash FROM empleados WHERE id = ?', (id,))
+    fila = cursor.fetchone()
+    cursor.execute('DELETE FROM empleados WHERE id = ?', (id,))
+    if fila:
+        liberar_foto(cursor, fila['foto_hash'])
+    quitar_empleado_de_resumenes(cursor, id)
+    conn.commit()
+    return jsonify({'message': 'Empleado eliminado exitosamente'})
+
+
+@app.route('/api/empleados/<int:id>/foto', methods=['GET'])
+def get_foto_empleado(id):
+    """Foto del empleado (`tam=mini` para la miniatura), con ETag = hash del contenido.
+
+    Pedida con el `v` que trae /api/empleados se cachea como inmutable; sin él
+    el navegador revalida y recibe 304 si la foto no cambió.
+    """
+    miniatura = request.args.get('tam') == 'mini'
+    conn = get_db()
+    fila = conn.execute('''
+        SELECT e.foto_hash, f.mime, f.miniatura IS NOT NULL AS tiene_miniatura
+        FROM empleados e
+        INNER JOIN fotos f ON f.hash = e.foto_hash
+        WHERE e.id = ?
+    ''', (id,)).fetchone()
+    if fila is None:
+        return jsonify({'error': 'Foto no encontrada'}), 404
+    
+    miniatura = miniatura and fila['tiene_miniatura']
+    etag = fila['foto_hash'] + ('-mini' if miniatura else '')
+    version = request.args.get('v')
+    if version and fila['foto_hash'].startswith(version):
+        cache = f'public, max-age={FOTO_CACHE_SEGUNDOS}, immutable'
+    else:
+        cache = 'no-cache'
+    
+    if request.if_none_match.contains(etag):
+        respuesta = Response(status=304)
+    else:
+        columna = 'miniatura' if miniatura else 'datos'
+        datos = conn.execute(f'SELECT {columna} FROM fotos WHERE hash = ?',
+                             (fila['foto_hash'],)).fetchone()[0]
+        respuesta = Response(datos, mimetype='image/jpeg' if miniatura else fila['mime'])
+    respuesta.set_etag(etag)
+    respuesta.headers['Cache-Control'] = cache
+    return respuesta
+
+# =====================================================
+# RUTAS - OBRAS
+# =====================================================
+
+SQL_OBRAS = '''
+    SELECT o.*, c.nombre as cliente_nombre,
+           l.nombre || ' ' || l.apellido as lider_nombre
+    FROM obras o
+    LEFT JOIN clientes c ON o.cliente_id = c.id
+    LEFT JOIN lideres l ON o.lider_id = l.id
+    {where}
+'''
+
+
+@app.route('/api/obras', methods=['GET'])
+@cache_por_version('obras', 'clientes', 'lideres')
+def get_obras():
+    return lista_json(SQL_OBRAS.format(where='') + ' ORDER BY o.nombre')
+
+@app.route('/api/obras/<int:id>', methods=['GET'])
+def get_obra(id):
+    return recurso_json(SQL_OBRAS.format(where='WHERE o.id = :id'), {'id': id}, 'Obra no encontrada', {
+        'cliente':   ('SELECT * FROM clientes WHERE id = (SELECT cliente_id FROM obras WHERE id = :id)', False),
+        'lider':     ('SELECT * FROM lideres WHERE id = (SELECT lider_id FROM obras WHERE id = :id)', False),
+        # Los mismos que /api/obras/<id>/empleados
+        'empleados': (f'''SELECT {COLUMNAS_EMPLEADO}
+                          FROM empleados e
+                          INNER JOIN obra_empleados oe ON e.id = oe.empleado_id
+                          WHERE oe.obra_id = :id AND e.estado = 'activo'
+                          ORDER BY e.nombre, e.apellido''', True),
+    })
+
+@app.route('/api/obras', methods=['POST'])
+def create_obra():
+    data = request.json
+    conn = get_db()
+    cursor = conn.cursor()
+    
+    cursor.execute('''
+        INSERT INTO obras (nombre, cliente_id, lider_id, direccion, fecha_inicio, fecha_fin, estado)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (data['nombre'], data.get('cliente_id'), data.get('lider_id'), data.get('direccion'),
+          data.get('fecha_inicio'), data.get('fecha_fin'), data.get('estado', 'activa')))
+    
+    obra_id = cursor.lastrowid
+    
+    # Asignar empleados a la obra
+    if 'empleados_ids' in data and data['empleados_ids']:
+        for empleado_id in data['empleados_ids']:
+            cursor.execute('INSERT INTO obra_empleados (obra_id, empleado_id) VALUES (?, ?)',
+                         (obra_id, empleado_id))
+    
+    conn.commit()
+    return jsonify({'id': obra_id, 'message': 'Obra creada exitosamente'}), 201
+
+@app.route('/api/obras/<int:id>', methods=['PUT'])
+def update_obra(id):
+    data = request.json
+    conn = get_db()
+    cursor = conn.cursor()
+    
+    cursor.execute('''
+        UPDATE obras 
+        SET nombre = ?, cliente_id = ?, lider_id = ?, direccion = ?, 
+            fecha_inicio = ?, fecha_fin = ?, estado = ?
+        WHERE id = ?
+    ''', (data['nombre'], data.get('cliente_id'), data.get('lider_id'), data.get('direccion'),
+          data.get('fecha_inicio'), data.get('fecha_fin'), data.get('estado'), id))
+    
+    # Actualizar empleados asignados
+    cursor.execute('DELETE FROM obra_empleados WHERE obra_id = ?', (id,))
+    if 'empleados_ids' in data and data['empleados_ids']:
+        for empleado_id in data['empleados_ids']:
+            cursor.execute('INSERT INTO obra_empleados (obra_id, empleado_id) VALUES (?, ?)',
+                         (id, empleado_id))
+    
+    conn.commit()
+    return jsonify({'message': 'Obra actualizada exitosamente'})
+
+@app.route('/api/obras/<int:id>', methods=['DELETE'])
+def delete_obra(id):
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('DELETE FROM obras WHERE id = ?', (id,))
+    conn.commit()
+    return jsonify({'message': 'Obra eliminada exitosamente'})
+
+@app.route('/api/obras/<int:id>/empleados', methods=['GET'])
+@cache_por_version('empleados', 'obra_empleados')
+def get_obra_empleados(id):
+    return lista_json(f'''
+        SELECT {COLUMNAS_EMPLEADO}
+        FROM empleados e
+        INNER JOIN obra_empleados oe ON e.id = oe.empleado_id
+        WHERE oe.obra_id = ? AND e.estado = 'activo'
+        ORDER BY e.nombre, e.apellido
+    ''', (id,))
+
+# =====================================================
+# SINCRONIZACIÓN DE DATOS MAESTROS (DELTAS POR SECUENCIA)
+# =====================================================
+# Cada alta o cambio en las tablas de TABLAS_SYNC toma el siguiente número de
+# sync_seq y lo guarda en la columna `seq` de la fila; cada baja deja una
+# marca en sync_borrados con su número (triggers de la migración 8). Con el
+# último `seq` que recibió, un cliente pide sólo lo que cambió desde entonces.
+
+TABLAS_SYNC = ('clientes', 'lideres', 'empleados', 'obras', 'obra_empleados')
+
+# Mismas columnas que los listados de cada tabla, filtradas por seq
+SQL_SYNC = {
+    'clientes':       'SELECT * FROM clientes WHERE seq > :desde',
+    'lideres':        'SELECT * FROM lideres WHERE seq > :desde',
+    'empleados':      f'SELECT {COLUMNAS_EMPLEADO}, e.seq FROM empleados e WHERE e.seq > :desde',
+    # Renombrar un cliente o un líder cambia cliente_nombre / lider_nombre de sus obras
+    'obras':          SQL_OBRAS.format(where='WHERE o.seq > :desde OR c.seq > :desde OR l.seq > :desde'),
+    'obra_empleados': 'SELECT id, obra_id, empleado_id, seq FROM obra_empleados WHERE seq > :desde',
+}
+
+
+@app.route('/api/sync', methods=['GET'])
+def sync_maestros():
+    """Clientes, líderes, empleados, obras y asignaciones cambiados desde `since`.
+
+    Devuelve {"seq", "completo", "cambios": {tabla: [filas]}, "borrados":
+    {tabla: [ids]}}. El cliente guarda `seq` y lo manda como `since` la
+    próxima vez. Con since=0 (o un since que esta base no conoce, p. ej.
+    después de restaurar un backup) viene todo y `completo` es true: el
+    cliente debe reemplazar lo que tenía en lugar de aplicar los cambios.
+    """
+    desde = request.args.get('since', 0, type=int)
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('BEGIN')   # todas las tablas desde la misma foto de la base
+    try:
+        cursor.execute('SELECT seq FROM sync_seq')
+        seq = cursor.fetchone()['seq']
+        completo = desde <= 0 or desde > seq
+        if completo:
+            desde = 0
+
+        cambios = {}
+        for tabla in TABLAS_SYNC:
+            cursor.execute(SQL_SYNC[tabla], {'desde': desde})
+            cambios[tabla] = [dict(row) for row in cursor.fetchall()]
+
+        borrados = {tabla: [] for tabla in TABLAS_SYNC}
+        if not completo:
+            cursor.execute('SELECT tabla, clave FROM sync_borrados WHERE seq > ? ORDER BY seq', (desde,))
+            for row in cursor.fetchall():
+                borrados[row['tabla']].append(row['clave'])
+    finally:
+        conn.rollback()
+    return jsonify({'seq': seq, 'completo': completo, 'cambios': cambios, 'borrados': borrados})
+
+# =====================================================
+# CARGA INICIAL (BOOTSTRAP)
+# =====================================================
+# Todo lo que la interfaz necesita al abrir, en un solo pedido: los listados
+# de TABLAS_SYNC leídos de la misma instantánea, serializados una vez y
+# guardados con el ETag de cache_por_version. `seq` permite seguir después
+# con /api/sync sin volver a pedir todo.
+
+# Orden de cada listado (el mismo que las rutas GET de cada tabla)
+ORDEN_BOOTSTRAP = {
+    'clientes':       'nombre',
+    'lideres':        'nombre, apellido',
+    'empleados':      'nombre, apellido',
+    'obras':          'nombre',
+    'obra_empleados': 'id',
+}
+
+@app.route('/api/bootstrap', methods=['GET'])
+def bootstrap():
+    """Listados iniciales de la interfaz en una sola respuesta.
+
+    `incluir=clientes,obras` elige los listados (por defecto, todos los de
+    TABLAS_SYNC). `fields=empleados.id,empleados.nombre,...` deja sólo esas
+    columnas en las tablas nombradas; las demás tablas van completas.
+    """
+    incluir = [t for t in request.args.get('incluir', ','.join(TABLAS_SYNC)).split(',') if t]
+    desconocidas = [t for t in incluir if t not in TABLAS_SYNC]
+    if desconocidas:
+        return jsonify({'error': f'Tabla desconocida: {", ".join(desconocidas)}'}), 400
+
+    campos = {}
+    for campo in filter(None, request.args.get('fields', '').split(',')):
+        tabla, _, columna = campo.partition('.')
+        if tabla not in incluir or columna not in columnas_de(SQL_SYNC[tabla], {'desde': 0}):
+            return jsonify({'error': f'Campo desconocido: {campo}'}), 400
+        campos.setdefault(tabla, []).append(columna)
+
+    return _bootstrap(tuple(incluir), campos)
+
+
+@cache_por_version(*TABLAS_SYNC)
+def _bootstrap(incluir, campos):
+    # Corre dentro de la transacción de cache_por_version: una sola instantánea
+    seq = get_db().execute('SELECT seq FROM sync_seq').fetchone()['seq']
+    partes = [f'"seq":{seq}']
+    for tabla in incluir:
+        sql = f'SELECT * FROM ({SQL_SYNC[tabla]}) ORDER BY {ORDEN_BOOTSTRAP[tabla]}'
+        partes.append(f'"{tabla}":' + lista_json(sql, {'desde': 0}, ','.join(campos.get(tabla, ()))))
+    return '{' + ','.join(partes) + '}'
+
+# =====================================================
+# RUTAS - ASISTENCIAS
+# =====================================================
+
+# Consultas compartidas por las rutas y por `flask verificar-planes`
+SQL_ESTADO_DIA = '''
+    SELECT empleado_id, presente, tipo_jornada, horas_extras
+    FROM asistencias
+    WHERE fecha = ? AND obra_id = ?
+'''
+
+SQL_UPSERT_ASISTENCIA = '''
+    INSERT INTO asistencias (fecha, obra_id, empleado_id, presente, tipo_jornada, horas_extras)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (fecha, obra_id, empleado_id) DO UPDATE SET
+        presente     = excluded.presente,
+        tipo_jornada = excluded.tipo_jornada,
+        horas_extras = excluded.horas_extras
+'''
+
+SQL_ELIMINAR_ASISTENCIA = 'DELETE FROM asistencias WHERE fecha = ? AND obra_id = ? AND empleado_id = ?'
+
+SQL_VERIFICAR = '''
+    SELECT a.*, e.nombre, e.apellido
+    FROM asistencias a
+    INNER JOIN empleados e ON a.empleado_id = e.id
+    WHERE a.fecha = ? AND a.obra_id = ?
+'''
+
+# Plantel activo de una obra para la pantalla de registro: sin la foto, sólo la miniatura
+SQL_PLANTEL_OBRA = f'''
+    SELECT e.id, e.nombre, e.apellido, e.cargo, e.telefono,
+           {SQL_URL_FOTO.format(tam='tam=mini&')} AS foto_miniatura
+    FROM obra_empleados oe
+    INNER JOIN empleados e ON e.id = oe.empleado_id
+    WHERE oe.obra_id = ? AND e.estado = 'activo'
+    ORDER BY e.nombre, e.apellido
+'''
+
+
+FROM_ASISTENCIAS = '''
+        FROM asistencias a
+        INNER JOIN obras o ON a.obra_id = o.id
+        LEFT JOIN clientes c ON o.cliente_id = c.id
+        LEFT JOIN lideres l ON o.lider_id = l.id
+        INNER JOIN empleados e ON a.empleado_id = e.id
+'''
+
+
+def filtrar_asistencias(filtros, columna_fecha='a.fecha'):
+    """Condiciones WHERE (y sus parámetros) para los filtros de consultas y reportes."""
+    where = ' WHERE 1=1'
+    params = []
+    
+    if filtros.get('fecha_desde'):
+        where += f' AND {columna_fecha} >= ?'
+        params.append(filtros.get('fecha_desde'))
+    
+    if filtros.get('fecha_hasta'):
+        where += f' AND {columna_fecha} <= ?'
+        params.append(filtros.get('fecha_hasta'))
+    
+    if filtros.get('cliente_id'):
+        where += ' AND c.id = ?'
+        params.append(filtros.get('cliente_id'))
+    
+    if filtros.get('obra_id'):
+        where += ' AND a.obra_id = ?'
+        params.append(filtros.get('obra_id'))
+    
+    if filtros.get('empleado_id'):
+        where += ' AND a.empleado_id = ?'
+        params.append(filtros.get('empleado_id'))
+    
+    if filtros.get('lider_id'):
+        where += ' AND l.id = ?'
+        params.append(filtros.get('lider_id'))
+    
+    return where, params
+
+
+def construir_consulta_asistencias(filtros, despues_de=None, limite=None):
+    """Arma el SELECT de asistencias con los filtros recibidos (dict o request.args).
+
+    Con `limite` (y opcionalmente `despues_de=(fecha, id)`) ordena por (fecha, id)
+    descendente y devuelve solo la página siguiente a ese cursor.
+    """
+    where, params = filtrar_asistencias(filtros)
+    query = '''
+        SELECT a.*, 
+               o.nombre as obra_nombre,
+               c.id as cliente_id, c.nombre as cliente_nombre,
+               l.id as lider_id, l.nombre as lider_nombre, l.apellido as lider_apellido,
+               e.nombre as empleado_nombre, e.apellido as empleado_apellido, e.cargo
+    ''' + FROM_ASISTENCIAS + where
+    
+    if limite is None:
+        query += ' ORDER BY a.fecha DESC, e.nombre'
+        return query, params
+    
+    if despues_de:
+        query += ' AND (a.fecha, a.id) < (?, ?)'
+        params.extend(despues_de)
+    query += ' ORDER BY a.fecha DESC, a.id DESC LIMIT ?'
+    params.append(limite)
+    return query, params
+
+
+# Agrupaciones de /api/asistencias/resumen: nombre → (columnas, expresión GROUP BY)
+AGRUPACIONES_RESUMEN = {
+    'dia':      (['a.fecha AS fecha'], 'a.fecha'),
+    'mes':      (['substr(a.fecha, 1, 7) AS mes'], 'substr(a.fecha, 1, 7)'),
+    'obra':     (['a.obra_id', 'o.nombre AS obra_nombre'], 'a.obra_id'),
+    'cliente':  (['c.id AS cliente_id', 'c.nombre AS cliente_nombre'], 'c.id'),
+    'lider':    (['l.id AS lider_id', 'l.nombre AS lider_nombre', 'l.apellido AS lider_apellido'], 'l.id'),
+    'empleado': (['a.empleado_id', 'e.nombre AS empleado_nombre', 'e.apellido AS empleado_apellido'],
+                 'a.empleado_id'),
+}
+
+JORNADAS = ('dia', 'noche', 'dia_noche')
+
+SQL_TOTALES_RESUMEN = '''
+    COUNT(*) AS total,
+    COALESCE(SUM(a.presente = 1), 0) AS presentes,
+    COALESCE(SUM(a.presente = 0), 0) AS ausentes,
+    ROUND(COALESCE(SUM(a.horas_extras), 0), 2) AS horas_extras,
+    COALESCE(SUM(a.presente = 1 AND a.tipo_jornada = 'dia'), 0) AS jornada_dia,
+    COALESCE(SUM(a.presente = 1 AND a.tipo_jornada = 'noche'), 0) AS jornada_noche,
+    COALESCE(SUM(a.presente = 1 AND a.tipo_jornada = 'dia_noche'), 0) AS jornada_dia_noche
+'''
+
+
+# Los resúmenes precalculados ya traen las sumas: se agregan sumándolas
+SQL_SUMAS_RESUMEN = '''
+    COALESCE(SUM(a.total), 0) AS total,
+    COALESCE(SUM(a.presentes), 0) AS presentes,
+    COALESCE(SUM(a.ausentes), 0) AS ausentes,
+    ROUND(COALESCE(SUM(a.horas_extras), 0), 2) AS horas_extras,
+    COALESCE(SUM(a.jornada_dia), 0) AS jornada_dia,
+    COALESCE(SUM(a.jornada_noche), 0) AS jornada_noche,
+    COALESCE(SUM(a.jornada_dia_noche), 0) AS jornada_dia_noche
+'''
+
+FROM_RESUMEN_DIARIO = '''
+        FROM resumen_diario a
+        INNER JOIN obras o ON a.obra_id = o.id
+        LEFT JOIN clientes c ON o.cliente_id = c.id
+        LEFT JOIN lideres l ON o.lider_id = l.id
+'''
+
+FROM_RESUMEN_MENSUAL = '''
+        FROM resumen_mensual a
+        INNER JOIN obras o ON a.obra_id = o.id
+        LEFT JOIN clientes c ON o.cliente_id = c.id
+        LEFT JOIN lideres l ON o.lider_id = l.id
+        INNER JOIN empleados e ON a.empleado_id = e.id
+'''
+
+
+def _rango_meses_completos(filtros):
+    """True si fecha_desde/fecha_hasta (si vienen) caen en inicio y fin de mes."""
+    try:
+        if filtros.get('fecha_desde'):
+            if datetime.strptime(filtros['fecha_desde'], '%Y-%m-%d').day != 1:
+                return False
+        if filtros.get('fecha_hasta'):
+            hasta = datetime.strptime(filtros['fecha_hasta'], '%Y-%m-%d')
+            if hasta.day != calendar.monthrange(hasta.year, hasta.month)[1]:
+                return False
+    except ValueError:
+        return False
+    return True
+
+
+def elegir_fuente_resumen(filtros, agrupar):
+    """Tabla más barata que responde exactamente: resumen_diario, resumen_mensual o asistencias."""
+    por_empleado = 'empleado' in agrupar or bool(filtros.get('empleado_id'))
+    if not por_empleado:
+        return 'resumen_diario'
+    if 'dia' not in agrupar and _rango_meses_completos(filtros):
+        return 'resumen_mensual'
+    return 'asistencias'
+
+
+def construir_consulta_resumen(filtros, agrupar, fuente='asistencias'):
+    """SELECT agregado agrupado por las claves de AGRUPACIONES_RESUMEN.
+
+    `fuente` elige de dónde leer (ver elegir_fuente_resumen); el resultado es el mismo.
+    """
+    agrupaciones = dict(AGRUPACIONES_RESUMEN)
+    if fuente == 'asistencias':
+        where, params = filtrar_asistencias(filtros)
+        desde, totales = FROM_ASISTENCIAS, SQL_TOTALES_RESUMEN
+    elif fuente == 'resumen_diario':
+        where, params = filtrar_asistencias(filtros)
+        desde, totales = FROM_RESUMEN_DIARIO, SQL_SUMAS_RESUMEN
+    else:
+        # resumen_mensual: las fechas se comparan como 'YYYY-MM'
+        filtros_mes = {k: filtros.get(k) for k in ('cliente_id', 'obra_id', 'empleado_id', 'lider_id')}
+        for clave in ('fecha_desde', 'fecha_hasta'):
+            if filtros.get(clave):
+                filtros_mes[clave] = filtros[clave][:7]
+        where, params = filtrar_asistencias(filtros_mes, columna_fecha='a.mes')
+        desde, totales = FROM_RESUMEN_MENSUAL, SQL_SUMAS_RESUMEN
+        agrupaciones['mes'] = (['a.mes AS mes'], 'a.mes')
+    
+    columnas = [col for clave in agrupar for col in agrupaciones[clave][0]]
+    grupo = [agrupaciones[clave][1] for clave in agrupar]
+    query = 'SELECT ' + ', '.join(columnas + [totales]) + desde + where
+    if grupo:
+        query += ' GROUP BY ' + ', '.join(grupo) + ' ORDER BY ' + ', '.join(grupo)
+    return query, params
+
+
+def _fila_resumen(row):
+    """Convierte una fila agregada al formato de respuesta (jornadas anidadas)."""
+    fila = dict(row)
+    fila['jornadas'] = {j: fila.pop(f'jornada_{j}') for j in JORNADAS}
+    return fila
+
+
+# =====================================================
+# RESÚMENES PRECALCULADOS
+# =====================================================
+# resumen_diario (obra/día) y resumen_mensual (empleado/obra/mes) se mantienen
+# dentro de la misma transacción que modifica asistencias. Solo cuentan
+# asistencias de empleados existentes, igual que las consultas directas.
+
+COLUMNAS_RESUMEN = (
+    'total, presentes, ausentes, horas_extras, jornada_dia, jornada_noche, jornada_dia_noche'
+)
+
+SQL_INSERTAR_DIARIO = f'''
+    INSERT INTO resumen_diario (fecha, obra_id, {COLUMNAS_RESUMEN})
+    SELECT a.fecha, a.obra_id, {SQL_TOTALES_RESUMEN}
+    FROM asistencias a
+    INNER JOIN empleados e ON a.empleado_id = e.id
+    {{where}}
+    GROUP BY a.fecha, a.obra_id
+'''
+
+SQL_INSERTAR_MENSUAL = f'''
+    INSERT INTO resumen_mensual (mes, obra_id, empleado_id, {COLUMNAS_RESUMEN})
+    SELECT substr(a.fecha, 1, 7), a.obra_id, a.empleado_id, {SQL_TOTALES_RESUMEN}
+    FROM asistencias a
+    INNER JOIN empleados e ON a.empleado_id = e.id
+    {{where}}
+    GROUP BY substr(a.fecha, 1, 7), a.obra_id, a.empleado_id
+'''
+
+
+def actualizar_resumenes(cursor, fecha, obra_id, empleado_ids):
+    """Recalcula el día de la obra y el mes de los empleados tocados por un guardado."""
+    cursor.execute('DELETE FROM resumen_diario WHERE fecha = ? AND obra_id = ?', (fecha, obra_id))
+    cursor.execute(SQL_INSERTAR_DIARIO.format(where='WHERE a.fecha = ? AND a.obra_id = ?'),
+                   (fecha, obra_id))
+    
+    if not empleado_ids:
+        return
+    mes = fecha[:7]
+    ids = list(empleado_ids)
+    placeholders = ','.join('?' * len(ids))
+    cursor.execute(f'''
+        DELETE FROM resumen_mensual
+        WHERE mes = ? AND obra_id = ? AND empleado_id IN ({placeholders})
+    ''', [mes, obra_id] + ids)
+    cursor.execute(SQL_INSERTAR_MENSUAL.format(where=f'''
+        WHERE a.empleado_id IN ({placeholders}) AND a.obra_id = ?
+          AND a.fecha >= ? AND a.fecha <= ?
+    '''), ids + [obra_id, mes + '-01', mes + '-31'])
+
+
+def quitar_empleado_de_resumenes(cursor, empleado_id):
+    """Recalcula los días en que trabajó un empleado recién eliminado."""
+    cursor.execute('DELETE FROM resumen_mensual WHERE empleado_id = ?', (empleado_id,))
+    dias = '''(SELECT DISTINCT fecha, obra_id FROM asistencias WHERE empleado_id = ?)'''
+    cursor.execute(f'DELETE FROM resumen_diario WHERE (fecha, obra_id) IN {dias}', (empleado_id,))
+    cursor.execute(SQL_INSERTAR_DIARIO.format(where=f'WHERE (a.fecha, a.obra_id) IN {dias}'),
+                   (empleado_id,))
+
+
+def reconstruir_resumenes(cursor):
+    """Vacía y vuelve a calcular ambos resúmenes desde todo el historial."""
+    cursor.execute('DELETE FROM resumen_diario')
+    cursor.execute('DELETE FROM resumen_mensual')
+    cursor.execute(SQL_INSERTAR_DIARIO.format(where=''))
+    cursor.execute(SQL_INSERTAR_MENSUAL.format(where=''))
+
+
+
+REGISTRO_LOTE_MAX_DIAS = 62     # días (fecha, obra) por pedido de /registrar/lote
+
+
+def _normalizar_dia(dia):
+    """Convierte un día del pedido en (fecha, obra_id, {empleado_id: valores}).
+    
+    Si un empleado llega repetido, vale el último registro. Los ids se pasan a
+    int (pueden llegar como texto): las claves tienen que coincidir con las que
+    devuelve SQLite al comparar con lo guardado. Lanza KeyError, TypeError,
+    ValueError o AttributeError si el día no tiene el formato esperado.
+    """
+    registros = {}
+    for r in dia['registros']:
+        registros[int(r['empleado_id'])] = (1 if r.get('presente') else 0,
+                                            r.get('tipo_jornada'),
+                                            float(r.get('horas_extras') or 0))
+    return dia['fecha'], int(dia['obra_id']), registros
+
+
+def _nombres(cursor, tabla, columna, ids):
+    placeholders = ','.join('?' * len(ids))
+    cursor.execute(f'SELECT id, {columna} AS nombre FROM {tabla} WHERE id IN ({placeholders})',
+                   list(ids))
+    return {row['id']: row['nombre'] for row in cursor.fetchall()}
+
+
+# ── Índice de ocupación: quién está PRESENTE en qué obra cada día ──
+# Cada worker guarda en memoria, por fecha, {empleado_id: obra_id} de los
+# presentes, leído de SQLite la primera vez que se consulta esa fecha. Los
+# triggers de la migración 9 suben ocupacion_version con cada fila de
+# asistencias que cambia; antes de usar un día se compara esa versión (una
+# lectura por clave primaria), así se notan los guardados de otros workers.
+# Los guardados del propio worker actualizan el índice sin volver a leerlo.
+# La validación corre dentro del BEGIN IMMEDIATE del guardado: con el lock de
+# escritura tomado, ningún otro worker puede mover la versión entre la
+# comprobación y el commit.
+
+OCUPACION_DIAS_MAX = 400   # fechas en memoria por worker (se descartan las menos usadas)
+
+# Versión de la fecha y suma de las de empleados y obras: sólo cuentan los
+# presentes de empleados y obras que existen, así que borrar uno vacía el índice
+SQL_OCUPACION_VERSION = '''
+    SELECT COALESCE((SELECT version FROM ocupacion_version WHERE fecha = ?), 0),
+           (SELECT SUM(version) FROM versiones_tabla WHERE tabla IN ('empleados', 'obras'))
+'''
+
+SQL_OCUPACION_DIA = '''
+    SELECT a.empleado_id, a.obra_id
+    FROM asistencias a
+    INNER JOIN empleados e ON a.empleado_id = e.id
+    INNER JOIN obras o ON a.obra_id = o.id
+    WHERE a.fecha = ? AND a.presente = 1
+'''
+
+
+class IndiceOcupacion:
+    """Presentes por fecha {empleado_id: obra_id}, validados contra la versión en SQLite.
+
+    Los dicts que devuelve no se modifican nunca (cada cambio arma uno nuevo),
+    así que se pueden leer sin el lock.
+    """
+
+    def __init__(self, max_dias):
+        self.max_dias = max_dias
+        self._dias = OrderedDict()    # fecha -> (versión, {empleado_id: obra_id})
+        self._maestros = None         # versión de empleados + obras de lo guardado
+        self._lock = threading.Lock()
+        self.aciertos = 0             # fechas respondidas desde memoria
+        self.cargas = 0               # fechas leídas de SQLite
+
+    def dia(self, cursor, fecha):
+        """(versión, {empleado_id: obra_id}) de los presentes de `fecha`."""
+        version, maestros = cursor.execute(SQL_OCUPACION_VERSION, (fecha,)).fetchone()
+        with self._lock:
+            if maestros != self._maestros:
+                self._dias.clear()
+                self._maestros = maestros
+            guardado = self._dias.get(fecha)
+            if guardado is not None and guardado[0] == version:
+                self._dias.move_to_end(fecha)
+                self.aciertos += 1
+                return guardado
+
+        # Si alguien guarda entre las dos lecturas, los datos quedan más nuevos
+        # que la versión y la próxima consulta simplemente los vuelve a leer
+        cursor.execute(SQL_OCUPACION_DIA, (fecha,))
+        guardado = (version, {row['empleado_id']: row['obra_id'] for row in cursor.fetchall()})
+        with self._lock:
+            self.cargas += 1
+            if maestros == self._maestros:
+                self._dias[fecha] = guardado
+                self._dias.move_to_end(fecha)
+                while len(self._dias) > self.max_dias:
+                    self._dias.popitem(last=False)
+        return guardado
+
+    def anotar(self, cursor, fecha, obra_id, registros, cambios):
+        """Lo que un guardado cambió, leído dentro de su transacción (o None).
+
+        Se aplica con `confirmados` después del commit.
+        """
+        tocadas = cambios['insertados'] + cambios['actualizados'] + cambios['eliminados']
+        if not tocadas:
+            return None
+        version, maestros = cursor.execute(SQL_OCUPACION_VERSION, (fecha,)).fetchone()
+        presentes = [e for e, valores in registros.items() if valores[0]]
+        # Cada fila tocada subió la versión en 1: antes del guardado era version - tocadas
+        return fecha, obra_id, presentes, version - tocadas, version, maestros
+
+    def confirmados(self, anotaciones):
+        """Aplica los guardados ya confirmados por este worker."""
+        with self._lock:
+            for anotacion in filter(None, anotaciones):
+                fecha, obra_id, presentes, antes, despues, maestros = anotacion
+                guardado = self._dias.get(fecha)
+                if guardado is None:
+                    continue
+                if maestros != self._maestros or guardado[0] != antes:
+                    # Otro worker guardó esa fecha en el medio: se vuelve a leer al usarla
+                    del self._dias[fecha]
+                    continue
+                nuevo = {e: o for e, o in guardado[1].items() if o != obra_id}
+                nuevo.update(dict.fromkeys(presentes, obra_id))
+                self._dias[fecha] = (despues, nuevo)
+
+
+ocupacion = IndiceOcupacion(OCUPACION_DIAS_MAX)
+
+
+def _validar_conflictos(cursor, dias):
+    """Conflictos de presencia de todos los días del pedido, con el índice de ocupación.
+    
+    Un empleado no puede quedar PRESENTE en dos obras la misma fecha: ni contra
+    lo ya guardado en otros días (fecha, obra) ni entre días del mismo pedido.
+    Lo guardado en los (fecha, obra) que el pedido reescribe no cuenta.
+    Se llama con BEGIN IMMEDIATE ya ejecutado en la conexión del cursor.
+    """
+    if not cursor.connection.in_transaction:
+        raise RuntimeError('Validar conflictos fuera de la transacción del guardado')
+    presentes = [(fecha, obra_id, empleado_id)
+                 for fecha, obra_id, registros in dias
+                 for empleado_id, valores in registros.items() if valores[0]]
+    
+    # Dentro del mismo pedido
+    conflictos = []
+    primera_obra = {}
+    for fecha, obra_id, empleado_id in presentes:
+        otra = primera_obra.setdefault((fecha, empleado_id), obra_id)
+        if otra != obra_id:
+            conflictos.append({'fecha': fecha, 'empleado_id': empleado_id, 'otra_obra': otra})
+    
+    # Contra lo guardado
+    reescritos = {(fecha, obra_id) for fecha, obra_id, _ in dias}
+    ocupados = {}
+    for fecha, obra_id, empleado_id in presentes:
+        if fecha not in ocupados:
+            ocupados[fecha] = ocupacion.dia(cursor, fecha)[1]
+        otra = ocupados[fecha].get(empleado_id)
+        if otra is not None and otra != obra_id and (fecha, otra) not in reescritos:
+            conflictos.append({'fecha': fecha, 'empleado_id': empleado_id, 'otra_obra': otra})
+    
+    if conflictos:
+        empleados = _nombres(cursor, 'empleados', "nombre || '　' || apellido",
+                             {c['empleado_id'] for c in conflictos})
+        obras = _nombres(cursor, 'obras', 'nombre', {c['otra_obra'] for c in conflictos})
+        for c in conflictos:
+            c['nombre_completo'] = empleados.get(c['empleado_id'], str(c['empleado_id']))
+            c['otra_obra'] = obras.get(c['otra_obra'], str(c['otra_obra']))
+    return conflictos
+
+
+def _mensaje_conflictos(conflictos):
+    # Armar mensaje en japonés con cada conflicto
+    detalles = ', '.join(
+        f"{c['nombre_completo']}（{c['otra_obra']}）" for c in conflictos
+    )
+    return f'以下の作業員は既に別の現場で出勤済みです：{detalles}'
+
+
+def _respuesta_conflictos(conflictos):
+    return jsonify({
+        'error': 'conflict',
+        'message': _mensaje_conflictos(conflictos),
+        'conflictos': conflictos
+    }), 409
+
+
+def _aplicar_registro_dia(cursor, fecha, obra_id, registros):
+    """Lleva el día (fecha, obra) al estado pedido tocando sólo las filas que cambian.
+    
+    Los empleados guardados que no vienen en el pedido se eliminan, igual que
+    al reescribir el día completo. Devuelve los contadores del cambio.
+    """
+    cursor.execute(SQL_ESTADO_DIA, (fecha, obra_id))
+    guardados = {row['empleado_id']: (row['presente'], row['tipo_jornada'],
+                                      float(row['horas_extras'] or 0))
+                 for row in cursor.fetchall()}
+    
+    nuevos     = [e for e in registros if e not in guardados]
+    cambiados  = [e for e in registros if e in guardados and registros[e] != guardados[e]]
+    eliminados = [e for e in guardados if e not in registros]
+    
+    # Primero los borrados: nunca pueden llevarse una fila recién escrita
+    cursor.executemany(SQL_ELIMINAR_ASISTENCIA, [(fecha, obra_id, e) for e in eliminados])
+    cursor.executemany(SQL_UPSERT_ASISTENCIA,
+                       [(fecha, obra_id, e) + registros[e] for e in nuevos + cambiados])
+    
+    tocados = nuevos + cambiados + eliminados
+    if tocados:
+        actualizar_resumenes(cursor, fecha, obra_id, tocados)
+    return {
+        'insertados': len(nuevos),
+        'actualizados': len(cambiados),
+        'eliminados': len(eliminados),
+        'sin_cambios': len(registros) - len(nuevos) - len(cambiados),
+    }
+
+
+@app.route('/api/asistencias/registrar', methods=['POST'])
+def registrar_asistencias():
+    """Guarda las asistencias de un día y una obra aplicando sólo las diferencias."""
+    data = request.json
+    conn = get_db()
+    cursor = conn.cursor()
+    
+    try:
+        fecha, obra_id, registros = _normalizar_dia(data)
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return jsonify({'error': 'Se requieren fecha, obra_id y registros con empleado_id numérico'}), 400
+    
+    # Lock de escritura desde ya: la validación y el estado guardado que se
+    # compara son los mismos que ve el commit
+    conn.execute('BEGIN IMMEDIATE')
+    
+    # ── Validar conflictos: empleados que ya marcaron PRESENTE en otra obra ese día ──
+    conflictos = _validar_conflictos(cursor, [(fecha, obra_id, registros)])
+    if conflictos:
+        conn.rollback()
+        return _respuesta_conflictos(conflictos)
+    
+    # ── Sin conflictos: guardar ──────────────────────────────────
+    cambios = _aplicar_registro_dia(cursor, fecha, obra_id, registros)
+    anotacion = ocupacion.anotar(cursor, fecha, obra_id, registros, cambios)
+    conn.commit()
+    ocupacion.confirmados([anotacion])
+    return jsonify({'message': f'{len(registros)} asistencias guardadas exitosamente',
+                    **cambios}), 201
+
+
+@app.route('/api/asistencias/registrar/lote', methods=['POST'])
+def registrar_asistencias_lote():
+    """Guarda varios días (y obras) en una sola transacción: se guarda todo o nada.
+    
+    Cuerpo: {"dias": [{"fecha", "obra_id", "registros": [...]}, ...]}, cada día
+    con el mismo formato que /api/asistencias/registrar.
+    """
+    data = request.json or {}
+    dias_pedido = data.get('dias')
+    if not isinstance(dias_pedido, list) or not dias_pedido:
+        return jsonify({'error': 'dias debe ser una lista no vacía'}), 400
+    if len(dias_pedido) > REGISTRO_LOTE_MAX_DIAS:
+        return jsonify({'error': f'Máximo {REGISTRO_LOTE_MAX_DIAS} días por pedido'}), 400
+    
+    normalizados = []
+    for i, dia in enumerate(dias_pedido):
+        try:
+            normalizados.append(_normalizar_dia(dia))
+        except (KeyError, TypeError, ValueError, AttributeError):
+            return jsonify({'error': f'El día {i} debe tener fecha, obra_id y registros'}), 400
+    # Si un mismo (fecha, obra) llega repetido, vale el último
+    dias = list({(f, o): (f, o, r) for f, o, r in normalizados}.values())
+    
+    conn = get_db()
+    cursor = conn.cursor()
+    conn.execute('BEGIN IMMEDIATE')
+    conflictos = _validar_conflictos(cursor, dias)
+    if conflictos:
+        conn.rollback()
+        return _respuesta_conflictos(conflictos)
+    
+    resultado = []
+    anotaciones = []
+    totales = dict.fromkeys(('insertados', 'actualizados', 'eliminados', 'sin_cambios'), 0)
+    for fecha, obra_id, registros in dias:
+        cambios = _aplicar_registro_dia(cursor, fecha, obra_id, registros)
+        anotaciones.append(ocupacion.anotar(cursor, fecha, obra_id, registros, cambios))
+        for clave, valor in cambios.items():
+            totales[clave] += valor
+        resultado.append({'fecha': fecha, 'obra_id': obra_id, **cambios})
+    conn.commit()
+    ocupacion.confirmados(anotaciones)
+    return jsonify({'message': f'{len(dias)} días guardados exitosamente',
+                    'dias': resultado, 'totales': totales}), 201
+
+# ── Sincronización de registros hechos sin conexión ─────────────
+# El frontend encola cada guardado en IndexedDB (cola.js) con un id propio y
+# los envía de a lotes. Los ids recibidos quedan en sync_cambios con la
+# respuesta que se dio, así un reenvío (p. ej. tras un corte a mitad de la
+# respuesta) no vuelve a aplicar nada.
+
+SYNC_LOTE_MAX       = 100   # cambios por pedido de /api/sync/asistencias
+SYNC_ID_MAX         = 64    # largo máximo del id generado por el cliente
+SYNC_RETENCION_DIAS = 30    # días que se recuerda un id ya recibido
+
+
+def _aplicar_cambio_sync(cursor, id_cambio, cambio, anotaciones):
+    """Aplica un cambio de la cola; devuelve el resultado que se le informa al cliente.
+
+    Agrega a `anotaciones` lo que hay que pasarle al índice de ocupación al confirmar.
+    """
+    try:
+        fecha, obra_id, registros = _normalizar_dia(cambio)
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return {'id': id_cambio, 'estado': 'invalido',
+                'error': 'El cambio debe tener fecha, obra_id y registros'}
+
+    conflictos = _validar_conflictos(cursor, [(fecha, obra_id, registros)])
+    if conflictos:
+        return {'id': id_cambio, 'estado': 'conflicto', 'fecha': fecha, 'obra_id': obra_id,
+                'message': _mensaje_conflictos(conflictos), 'conflictos': conflictos}
+    cambios = _aplicar_registro_dia(cursor, fecha, obra_id, registros)
+    anotaciones.append(ocupacion.anotar(cursor, fecha, obra_id, registros, cambios))
+    return {'id': id_cambio, 'estado': 'aplicado', 'fecha': fecha, 'obra_id': obra_id, **cambios}
+
+
+@app.route('/api/sync/asistencias', methods=['POST'])
+def sync_asistencias():
+    """Recibe los días guardados sin conexión por el frontend, en lotes.
+
+    Cuerpo: {"cambios": [{"id", "fecha", "obra_id", "registros": [...]}, ...]},
+    cada día con el formato de /api/asistencias/registrar y un id generado por
+    el cliente. Se aplican en orden y por separado: un conflicto (empleado ya
+    PRESENTE en otra obra) no frena a los demás. Un id ya recibido no se vuelve
+    a aplicar; se devuelve el resultado de la primera vez con `repetido`.
+    """
+    data = request.get_json(silent=True) or {}
+    cambios = data.get('cambios')
+    if not isinstance(cambios, list) or not cambios:
+        return jsonify({'error': 'cambios debe ser una lista no vacía'}), 400
+    if len(cambios) > SYNC_LOTE_MAX:
+        return jsonify({'error': f'Máximo {SYNC_LOTE_MAX} cambios por pedido'}), 400
+
+    conn = get_db()
+    cursor = conn.cursor()
+    conn.execute('BEGIN IMMEDIATE')
+    resultados = []
+    anotaciones = []
+    for cambio in cambios:
+        id_cambio = cambio.get('id') if isinstance(cambio, dict) else None
+        if not isinstance(id_cambio, str) or not 0 < len(id_cambio) <= SYNC_ID_MAX:
+            resultados.append({'id': id_cambio, 'estado': 'invalido', 'error': 'id inválido'})
+            continue
+
+        cursor.execute('SELECT respuesta FROM sync_cambios WHERE id = ?', (id_cambio,))
+        guardado = cursor.fetchone()
+        if guardado is not None:
+            resultados.append({**json.loads(guardado['respuesta']), 'repetido': True})
+            continue
+
+        # Cada cambio en su savepoint: si falla, se descarta sólo ese
+        cursor.execute('SAVEPOINT cambio')
+        try:
+            resultado = _aplicar_cambio_sync(cursor, id_cambio, cambio, anotaciones)
+        except sqlite3.Error as e:
+            cursor.execute('ROLLBACK TO cambio')
+            resultado = {'id': id_cambio, 'estado': 'invalido', 'error': str(e)}
+        cursor.execute('RELEASE cambio')
+        cursor.execute('''INSERT INTO sync_cambios (id, recibido, estado, respuesta)
+                          VALUES (?, datetime('now'), ?, ?)''',
+                       (id_cambio, resultado['estado'], json.dumps(resultado, ensure_ascii=False)))
+        resultados.append(resultado)
+    conn.commit()
+    ocupacion.confirmados(anotaciones)
+    return jsonify({'resultados': resultados})
+
+
+def limpiar_sync_cambios():
+    """Olvida los ids de sync recibidos hace más de SYNC_RETENCION_DIAS."""
+    conn = get_db()
+    cursor = conn.execute("DELETE FROM sync_cambios WHERE recibido < datetime('now', ?)",
+                          (f'-{SYNC_RETENCION_DIAS} days',))
+    conn.commit()
+    return f'{cursor.rowcount} id(s) de sync olvidados'
+
+
+TAREAS['limpieza_sync'] = ('45 3 * * *', limpiar_sync_cambios)   # todas las noches, 03:45
+
+ASISTENCIAS_LIMITE_MAX = 5000   # filas máximas por página
+ASISTENCIAS_LOTE       = 500    # filas leídas del cursor por vez al transmitir
+
+
+def _lotes_serializados(cursor):
+    """Genera los objetos JSON de un cursor de sql_json, una lista por lote leído."""
+    while True:
+        filas = cursor.fetchmany(ASISTENCIAS_LOTE)
+        if not filas:
+            break
+        yield [fila[0] for fila in filas]
+
+
+@app.route('/api/asistencias', methods=['GET'])
+def get_asistencias():
+    """Consulta de asistencias.
+
+    Sin `limit` devuelve todo el rango como array JSON transmitido fila por fila.
+    Con `limit` (y `after=<fecha>,<id>`) devuelve una página ordenada por
+    (fecha, id) descendente y el cursor `siguiente`. `formato=ndjson` transmite
+    una fila JSON por línea en cualquiera de los dos modos. `fields=` elige
+    las columnas de cada fila.
+    """
+    formato = request.args.get('formato', 'json')
+    if formato not in ('json', 'ndjson'):
+        return jsonify({'error': 'formato debe ser json o ndjson'}), 400
+    
+    limite = request.args.get('limit', type=int)
+    despues_de = None
+    if request.args.get('after'):
+        fecha, _, ultimo_id = request.args['after'].rpartition(',')
+        if not fecha or not ultimo_id.isdigit():
+            return jsonify({'error': 'after debe tener el formato <fecha>,<id>'}), 400
+        despues_de = (fecha, int(ultimo_id))
+        limite = limite or ASISTENCIAS_LIMITE_MAX
+    if limite is not None:
+        limite = max(1, min(limite, ASISTENCIAS_LIMITE_MAX))
+    
+    # Construir query con filtros; SQLite devuelve cada fila ya en JSON
+    query, params = construir_consulta_asistencias(request.args, despues_de, limite)
+    cursor = get_db().execute(sql_json(query, campos_pedidos(query, params), extra=('fecha', 'id')),
+                              params)
+    
+    if formato == 'ndjson':
+        # Un bloque por lote: pocas escrituras al socket y poco costo fijo por fila
+        lineas = (''.join(fila + '\n' for fila in lote) for lote in _lotes_serializados(cursor))
+        return Response(stream_with_context(lineas), mimetype='application/x-ndjson')
+    
+    if limite is not None:
+        filas = cursor.fetchall()
+        siguiente = None
+        if len(filas) == limite:
+            siguiente = f"{filas[-1]['fecha']},{filas[-1]['id']}"
+        cuerpo = ('{"asistencias":[' + ','.join(fila[0] for fila in filas) +
+                  '],"siguiente":' + app.json.dumps(siguiente) + '}')
+        return Response(cuerpo, mimetype='application/json')
+    
+    def array_json():
+        separador = '['
+        for lote in _lotes_serializados(cursor):
+            yield separador + ','.join(lote)
+            separador = ','
+        yield ']' if separador == ',' else '[]'
+    
+    return Response(stream_with_context(array_json()), mimetype='application/json')
+
+@app.route('/api/asistencias/verificar', methods=['GET'])
+def verificar_asistencia():
+    fecha = request.args.get('fecha')
+    obra_id = request.args.get('obra_id')
+    
+    return Response(lista_json(SQL_VERIFICAR, (fecha, obra_id)), mimetype='application/json')
+
+@app.route('/api/asistencias/ocupacion', methods=['GET'])
+def ocupacion_asistencias():
+    """Empleados ya PRESENTES en otra obra en `fecha`: {"fecha", "ocupados": {empleado_id: obra_id}}.
+
+    Sale del índice de ocupación, sin consultar asistencias mientras la fecha
+    no cambie. Con `obra_id` se omiten los presentes en esa obra. Responde con
+    ETag: mientras no cambie nada, la pantalla de registro recibe un 304.
+    """
+    fecha = request.args.get('fecha')
+    if not fecha:
+        return jsonify({'error': 'fecha es obligatoria'}), 400
+    obra_id = request.args.get('obra_id', type=int)
+    
+    _, presentes = ocupacion.dia(get_db().cursor(), fecha)
+    respuesta = jsonify({'fecha': fecha,
+                         'ocupados': {e: o for e, o in presentes.items() if o != obra_id}})
+    respuesta.add_etag()
+    respuesta.headers['Cache-Control'] = 'no-cache'
+    return respuesta.make_conditional(request)
+
+@app.route('/api/registro/contexto', methods=['GET'])
+def contexto_registro():
+    """Todo lo que la pantalla de registro necesita de una obra y una fecha, en un pedido.
+
+    Devuelve {"fecha", "obra", "empleados", "asistencias", "ocupados"}: la obra
+    (como en /api/obras), su plantel activo sin fotos, lo ya registrado ese
+    día en la obra y los empleados PRESENTES ese día en otra obra (como
+    /api/asistencias/ocupacion). Sin `fecha`, asistencias y ocupados vienen
+    vacíos. Responde con ETag, así que revalidar cuesta un 304.
+    """
+    obra_id = request.args.get('obra_id', type=int)
+    if obra_id is None:
+        return jsonify({'error': 'obra_id es obligatorio'}), 400
+    fecha = request.args.get('fecha')
+    
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('BEGIN')   # todo desde la misma instantánea
+    try:
+        sql_obra = SQL_OBRAS.format(where='WHERE o.id = ?')
+        obra = cursor.execute(sql_json(sql_obra, columnas_de(sql_obra, (obra_id,))), (obra_id,)).fetchone()
+        if obra is None:
+            return jsonify({'error': 'Obra no encontrada'}), 404
+        partes = [f'"fecha":{app.json.dumps(fecha)}', f'"obra":{obra[0]}',
+                  f'"empleados":{lista_json(SQL_PLANTEL_OBRA, (obra_id,), "")}']
+        if fecha:
+            _, presentes = ocupacion.dia(cursor, fecha)
+            ocupados = {e: o for e, o in presentes.items() if o != obra_id}
+            partes += [f'"asistencias":{lista_json(SQL_ESTADO_DIA, (fecha, obra_id), "")}',
+                       f'"ocupados":{app.json.dumps(ocupados)}']
+        else:
+            partes += ['"asistencias":[]', '"ocupados":{}']
+    finally:
+        conn.rollback()
+    
+    respuesta = Response('{' + ','.join(partes) + '}', mimetype='application/json')
+    respuesta.add_etag()
+    respuesta.headers['Cache-Control'] = 'no-cache'
+    return respuesta.make_conditional(request)
+
+@app.route('/api/asistencias/resumen', methods=['GET'])
+def resumen_asistencias():
+    """Totales de presentes/ausentes/horas extras calculados en SQL.
+
+    Acepta los mismos filtros que /api/asistencias y `agrupar` con una o más
+    claves separadas por coma: dia, mes, obra, cliente, lider, empleado.
+    """
+    agrupar = [c for c in request.args.get('agrupar', '').split(',') if c]
+    invalidas = [c for c in agrupar if c not in AGRUPACIONES_RESUMEN]
+    if invalidas:
+        return jsonify(_error_agrupar(invalidas)), 400
+    return jsonify(calcular_resumen(get_db().cursor(), request.args, agrupar))
+
+
+def _error_agrupar(invalidas):
+    return {'error': f"agrupar no válido: {', '.join(invalidas)}", 'opciones': list(AGRUPACIONES_RESUMEN)}
+
+
+def calcular_resumen(cursor, filtros, agrupar):
+    """{totales, grupos, fuente} de /api/asistencias/resumen (`agrupar` ya validado)."""
+    agrupar = list(dict.fromkeys(agrupar))
+    fuente = elegir_fuente_resumen(filtros, agrupar)
+    query, params = construir_consulta_resumen(filtros, agrupar, fuente)
+    cursor.execute(query, params)
+    grupos = [_fila_resumen(row) for row in cursor.fetchall()]
+    
+    if not agrupar:
+        return {'totales': grupos[0], 'grupos': [], 'fuente': fuente}
+    
+    totales = {'total': 0, 'presentes': 0, 'ausentes': 0, 'horas_extras': 0,
+               'jornadas': dict.fromkeys(JORNADAS, 0)}
+    for g in grupos:
+        for clave in ('total', 'presentes', 'ausentes', 'horas_extras'):
+            totales[clave] += g[clave]
+        for j in JORNADAS:
+            totales['jornadas'][j] += g['jornadas'][j]
+    totales['horas_extras'] = round(totales['horas_extras'], 2)
+    return {'totales': totales, 'grupos': grupos, 'fuente': fuente}
+
+# =====================================================
+# EXPORTAR EXCEL 出勤表 (FORMATO KOMEI DENSETSU)
+# =====================================================
+# El .xlsx se escribe en streaming: cada hoja se arma fila por fila dentro del
+# zip y los bytes salen al cliente a medida que se comprimen. Ver el formato en
+# FORMATO_KOMEI_DETALLADO.md.
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+XLSX_MAX_DIAS = 16000       # Excel admite 16384 columnas
+XLSX_BLOQUE   = 65536       # bytes acumulados antes de enviar un fragmento
+
+DIAS_SEMANA = '月火水木金土日'   # índice = date.weekday()
+
+# Estilos (índice en cellXfs de styles.xml)
+XF_NORMAL, XF_NEGRITA, XF_CENTRO, XF_NEGRITA_CENTRO, XF_DERECHA = range(5)
+
+XLSX_ESTILOS = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">
+<fonts count="2"><font><sz val="11"/><name val="MS PGothic"/></font><font><b/><sz val="11"/><name val="MS PGothic"/></font></fonts>
+<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>
+<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>
+<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>
+<cellXfs count="5">
+<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>
+<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/>
+<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0" applyAlignment="1"><alignment horizontal="center" vertical="center"/></xf>
+<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1" applyAlignment="1"><alignment horizontal="center" vertical="center"/></xf>
+<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0" applyAlignment="1"><alignment horizontal="right"/></xf>
+</cellXfs>
+<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>
+</styleSheet>'''
+
+
+class _SalidaStream:
+    """Archivo de solo escritura que acumula bytes hasta que el generador los envía."""
+
+    def __init__(self):
+        self._partes = []
+        self.pendiente = 0
+
+    def write(self, datos):
+        self._partes.append(bytes(datos))
+        self.pendiente += len(datos)
+        return len(datos)
+
+    def flush(self):
+        pass
+
+    def vaciar(self):
+        datos = b''.join(self._partes)
+        self._partes = []
+        self.pendiente = 0
+        return datos
+
+
+def columna_excel(idx):
+    """Índice base 0 → letras de columna de Excel (0 → A, 26 → AA)."""
+    letras = ''
+    idx += 1
+    while idx:
+        idx, resto = divmod(idx - 1, 26)
+        letras = chr(65 + resto) + letras
+    return letras
+
+
+class Formula(str):
+    """Texto que se escribe en la celda como fórmula y no como valor."""
+
+
+def _xml_fila(numero, celdas, alto=None):
+    """<row> con las celdas {columna: valor | (valor, estilo)} escritas en orden de columna."""
+    partes = [f'<row r="{numero}"' + (f' ht="{alto}" customHeight="1"' if alto else '') + '>']
+    for col in sorted(celdas):
+        valor, estilo = celdas[col] if isinstance(celdas[col], tuple) else (celdas[col], XF_NORMAL)
+        ref = f'{columna_excel(col)}{numero}'
+        s = f' s="{estilo}"' if estilo else ''
+        if isinstance(valor, Formula):
+            partes.append(f'<c r="{ref}"{s}><f>{xml_escape(valor)}</f></c>')
+        elif isinstance(valor, (int, float)):
+            partes.append(f'<c r="{ref}"{s}><v>{valor:g}</v></c>')
+        else:
+            partes.append(f'<c r="{ref}"{s} t="inlineStr"><is><t>{xml_escape(str(valor))}</t></is></c>')
+    partes.append('</row>')
+    return ''.join(partes)
+
+
+def _fecha_reiwa(fecha):
+    return f'令和　{fecha.year - 2018}年　{fecha.month}月 {fecha.day}日'
+
+
+def _xml_hoja_komei(nombre_obra, dias, empleados):
+    """Genera el XML de una hoja 出勤表 de a fragmentos.
+
+    `empleados` es un iterable de (nombre, {fecha: presente}, {fecha: horas_extras}).
+    """
+    total_dias = len(dias)
+    col_total = 2 + total_dias          # 定時小計
+    col_resumen = col_total + 1         # 残業小計
+    col_ini, col_fin = columna_excel(2), columna_excel(2 + total_dias - 1)
+    letra_total, letra_resumen = columna_excel(col_total), columna_excel(col_resumen)
+
+    yield ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+           '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+           '<sheetViews><sheetView workbookViewId="0"><pane xSplit="2" ySplit="5" topLeftCell="C6" '
+           'activePane="bottomRight" state="frozen"/></sheetView></sheetViews>'
+           '<cols><col min="1" max="1" width="9.71" customWidth="1"/>'
+           '<col min="2" max="2" width="17.14" customWidth="1"/>'
+           f'<col min="3" max="{2 + total_dias}" width="3.57" customWidth="1"/>'
+           f'<col min="{col_total + 1}" max="{col_resumen + 1}" width="11" customWidth="1"/></cols>'
+           '<sheetData>')
+
+    # Filas 1 y 2 — empresa/obra y período
+    yield _xml_fila(1, {0: ('会社名', XF_CENTRO), 1: 'Komei Densetsu',
+                        16: ('出　　　勤　　　表', XF_NEGRITA),
+                        col_total - 1: ('自', XF_DERECHA), col_total: (_fecha_reiwa(dias[0]), XF_DERECHA)},
+                    alto=13.5)
+    yield _xml_fila(2, {0: ('現場名', XF_CENTRO), 1: nombre_obra,
+                        col_total - 1: ('至', XF_DERECHA), col_total: (_fecha_reiwa(dias[-1]), XF_DERECHA)},
+                    alto=14.25)
+
+    # Fila 3 — etiqueta de cada mes; filas 4 y 5 — día y día de la semana (domingos en negrita)
+    f3 = {0: '１', col_total: ('定時小計', XF_CENTRO), col_resumen: ('残業小計', XF_CENTRO)}
+    f4 = {0: ('No', XF_NEGRITA_CENTRO), 1: ('氏　名', XF_NEGRITA_CENTRO)}
+    f5 = {}
+    mes_actual = None
+    for i, dia in enumerate(dias):
+        if dia.month != mes_actual:
+            f3[2 + i] = (f'（ {dia.month}月 ）', XF_NEGRITA)
+            mes_actual = dia.month
+        estilo = XF_NEGRITA_CENTRO if dia.weekday() == 6 else XF_CENTRO
+        f4[2 + i] = (dia.day, estilo)
+        f5[2 + i] = (DIAS_SEMANA[dia.weekday()], estilo)
+    yield _xml_fila(3, f3, alto=12)
+    yield _xml_fila(4, f4, alto=11.25)
+    yield _xml_fila(5, f5, alto=11.25)
+
+    # Dos filas por empleado: asistencia (出) y horas extras
+    fila = 5
+    for idx, (nombre, asistencias, horas_extras) in enumerate(empleados):
+        fila += 1
+        fa = {0: idx + 1, 1: nombre,
+              col_total: Formula(f'COUNTIF({col_ini}{fila}:{col_fin}{fila},"出")')}
+        for i, dia in enumerate(dias):
+            if asistencias.get(dia):
+                fa[2 + i] = '出'
+        yield _xml_fila(fila, fa, alto=15)
+
+        fila += 1
+        fhe = {1: '残業時間', col_resumen: Formula(f'SUM({col_ini}{fila}:{col_fin}{fila})')}
+        for i, dia in enumerate(dias):
+            if horas_extras.get(dia, 0) > 0:
+                fhe[2 + i] = horas_extras[dia]
+        yield _xml_fila(fila, fhe, alto=13.5)
+
+    # Gran total: la columna de totales solo tiene valores en las filas de cada empleado
+    ultima = max(fila, 6)
+    yield _xml_fila(fila + 1, {col_total - 1: '合　計',
+                               col_total: Formula(f'SUM({letra_total}6:{letra_total}{ultima})')})
+    yield _xml_fila(fila + 2, {col_total - 1: '残業合計',
+                               col_resumen: Formula(f'SUM({letra_resumen}6:{letra_resumen}{ultima})')})
+
+    merges = ['B1:D1', 'B2:D2', 'Q1:X1',
+              f'{letra_total}1:{letra_resumen}1', f'{letra_total}2:{letra_resumen}2',
+              f'{letra_total}3:{letra_total}5', f'{letra_resumen}3:{letra_resumen}5']
+    yield (f'</sheetData><mergeCells count="{len(merges)}">'
+           + ''.join(f'<mergeCell ref="{m}"/>' for m in merges)
+           + '</mergeCells><pageSetup paperSize="8" orientation="landscape"/></worksheet>')
+
+
+def _nombre_hoja(nombre, usados):
+    """Nombre de hoja válido para Excel (sin caracteres prohibidos, máx. 31) y sin repetir."""
+    base = re.sub(r'[:\\/?*\[\]]', '', nombre or '').strip()[:31] or 'Sheet'
+    candidato, n = base, 2
+    while candidato.lower() in usados:
+        sufijo = f' ({n})'
+        candidato, n = base[:31 - len(sufijo)] + sufijo, n + 1
+    usados.add(candidato.lower())
+    return candidato
+
+
+def generar_xlsx(hojas):
+    """Genera los bytes de un .xlsx a partir de [(nombre, generador de XML de la hoja)]."""
+    salida = _SalidaStream()
+    nombres = []
+    usados = set()
+    with zipfile.ZipFile(salida, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for i, (nombre, xml) in enumerate(hojas, start=1):
+            nombres.append(_nombre_hoja(nombre, usados))
+            with zf.open(f'xl/worksheets/sheet{i}.xml', 'w') as hoja:
+                for fragmento in xml:
+                    hoja.write(fragmento.encode('utf-8'))
+                    if salida.pendiente >= XLSX_BLOQUE:
+                        yield salida.vaciar()
+
+        zf.writestr('xl/styles.xml', XLSX_ESTILOS)
+        zf.writestr('xl/workbook.xml', (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"><sheets>'
+            + ''.join(f'<sheet name="{xml_escape(n, {chr(34): "&quot;"})}" sheetId="{i}" r:id="rId{i}"/>'
+                      for i, n in enumerate(nombres, start=1))
+            + '</sheets><calcPr fullCalcOnLoad="1"/></workbook>'))
+        zf.writestr('xl/_rels/workbook.xml.rels', (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            + ''.join(f'<Relationship Id="rId{i}" Type="http://schemas.openxmlformats.org/officeDocument/'
+                      f'2006/relationships/worksheet" Target="worksheets/sheet{i}.xml"/>'
+                      for i in range(1, len(nombres) + 1))
+            + f'<Relationship Id="rId{len(nombres) + 1}" Type="http://schemas.openxmlformats.org/'
+              'officeDocument/2006/relationships/styles" Target="styles.xml"/></Relationships>'))
+        zf.writestr('_rels/.rels', (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/'
+            'relationships/officeDocument" Target="xl/workbook.xml"/></Relationships>'))
+        zf.writestr('[Content_Types].xml', (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-'
+            'officedocument.spreadsheetml.sheet.main+xml"/>'
+            '<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-'
+            'officedocument.spreadsheetml.styles+xml"/>'
+            + ''.join(f'<Override PartName="/xl/worksheets/sheet{i}.xml" ContentType="application/'
+                      'vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+                      for i in range(1, len(nombres) + 1))
+            + '</Types>'))
+    yield salida.vaciar()
+
+
+def _empleados_hoja_komei(cursor, filtros, obra_id, desde, hasta):
+    """Empleados de una obra en el rango, cada uno leído por índice y de a uno."""
+    where, params = filtrar_asistencias(filtros)
+    cursor.execute(f'''
+        SELECT a.empleado_id, e.nombre, e.apellido
+        {FROM_ASISTENCIAS} {where} AND a.obra_id = ?
+        GROUP BY a.empleado_id
+        ORDER BY e.nombre, e.apellido, a.empleado_id
+    ''', params + [obra_id])
+    empleados = cursor.fetchall()
+    for emp in empleados:
+        asistencias, horas_extras = {}, {}
+        for row in cursor.execute('''
+            SELECT fecha, presente, horas_extras FROM asistencias
+            WHERE empleado_id = ? AND obra_id = ? AND fecha >= ? AND fecha <= ?
+        ''', (emp['empleado_id'], obra_id, desde.isoformat(), hasta.isoformat())).fetchall():
+            dia = datetime.strptime(row['fecha'], '%Y-%m-%d').date()
+            asistencias[dia] = bool(row['presente'])
+            horas_extras[dia] = float(row['horas_extras'] or 0)
+        yield f"{emp['nombre']}　{emp['apellido']}", asistencias, horas_extras
+
+
+def obras_komei(cursor, filtros):
+    """Obras con asistencias que cumplen los filtros, con su primera y última fecha."""
+    where, params = filtrar_asistencias(filtros)
+    cursor.execute(f'''
+        SELECT a.obra_id, o.nombre AS obra_nombre, MIN(a.fecha) AS primera, MAX(a.fecha) AS ultima
+        {FROM_ASISTENCIAS} {where}
+        GROUP BY a.obra_id
+        ORDER BY o.nombre, a.obra_id
+    ''', params)
+    return cursor.fetchall()
+
+
+def dias_komei(filtros, obras):
+    """Días del 出勤表: el rango de los filtros o, sin él, el de los datos de `obras`.
+
+    ValueError si las fechas no son válidas o el rango es demasiado largo.
+    """
+    try:
+        desde = datetime.strptime(filtros.get('fecha_desde') or min(o['primera'] for o in obras),
+                                  '%Y-%m-%d').date()
+        hasta = datetime.strptime(filtros.get('fecha_hasta') or max(o['ultima'] for o in obras),
+                                  '%Y-%m-%d').date()
+    except ValueError:
+        raise ValueError('Fechas no válidas (formato YYYY-MM-DD)')
+    total_dias = (hasta - desde).days + 1
+    if total_dias < 1 or total_dias > XLSX_MAX_DIAS:
+        raise ValueError(f'El rango debe tener entre 1 y {XLSX_MAX_DIAS} días')
+    return [desde + timedelta(days=i) for i in range(total_dias)]
+
+
+def hojas_komei(conn, filtros, obras, dias):
+    """(nombre, generador de XML) de cada hoja, para generar_xlsx."""
+    filtros = dict(filtros)
+    for obra in obras:
+        yield (obra['obra_nombre'],
+               _xml_hoja_komei(obra['obra_nombre'], dias,
+                               _empleados_hoja_komei(conn.cursor(), filtros, obra['obra_id'],
+                                                     dias[0], dias[-1])))
+
+
+@app.route('/api/asistencias/exportar/komei', methods=['GET'])
+def exportar_komei():
+    """Descarga el 出勤表 en .xlsx (una hoja por obra) con los filtros de consultas/reportes.
+
+    Sin fecha_desde/fecha_hasta se usa el rango de fechas de los datos filtrados.
+    Genera el archivo mientras lo envía, ocupando el worker; para rangos largos
+    o muchas obras conviene POST /api/exportaciones.
+    """
+    conn = get_db()
+    obras = obras_komei(conn.cursor(), request.args)
+    if not obras:
+        return jsonify({'error': 'No hay asistencias para exportar'}), 404
+    try:
+        dias = dias_komei(request.args, obras)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    hojas = hojas_komei(conn, request.args.to_dict(), obras, dias)
+    nombre = f'出勤表_{datetime.now().strftime("%Y%m%d")}.xlsx'
+    return Response(stream_with_context(generar_xlsx(hojas)), mimetype=XLSX_MIMETYPE, headers={
+        'Content-Disposition': f"attachment; filename*=UTF-8''{quote(nombre)}"
+    })
+
+# =====================================================
+# EXPORTACIONES EN SEGUNDO PLANO (TRABAJOS)
+# =====================================================
+# Los reportes pesados (el 出勤表 de muchas obras, el resumen de un año) no se
+# generan en el worker que atiende el pedido: POST /api/exportaciones anota el
+# trabajo y lo pasa a un pool de procesos acotado, y el worker queda libre para
+# los pedidos interactivos. El proceso lee por una conexión de sólo lectura,
+# todo desde una misma instantánea, escribe el archivo en EXPORTACIONES_DIR y
+# deja su avance en la tabla `exportaciones`, que cualquier worker responde.
+# El id del trabajo es la huella del tipo, los filtros y la versión de los
+# datos: pedir lo mismo sin que nada haya cambiado devuelve el archivo ya hecho.
+
+EXPORTACIONES_DIR           = 'exportaciones'
+EXPORTACION_PROCESOS        = int(os.environ.get('EXPORTACION_PROCESOS', '1'))   # por worker
+EXPORTACION_COLA_MAX        = 4     # trabajos esperando o en curso por worker; más → 503
+EXPORTACION_NICE            = 10    # prioridad baja: la CPU es primero de los pedidos interactivos
+EXPORTACION_AVANCE_SEGUNDOS = 1     # cada cuánto como máximo se guarda el avance
+EXPORTACION_VENCIDA_MINUTOS = 15    # sin avances en este tiempo, el trabajo se da por perdido
+EXPORTACION_RETENCION_HORAS = 24
+
+# tipo: (extensión, mimetype, nombre del archivo descargado)
+TIPOS_EXPORTACION = {
+    'komei':   ('.xlsx', XLSX_MIMETYPE, '出勤表'),
+    'resumen': ('.json', 'application/json', 'resumen'),
+}
+
+SQL_EXPORTACION = '''
+    SELECT *, estado IN ('pendiente', 'en_curso') AND actualizado < datetime('now', ?) AS vencida
+    FROM exportaciones WHERE id = ?
+'''
+
+_exportaciones = {'pid': None, 'pool': None, 'en_cola': 0}
+_exportaciones_lock = threading.Lock()
+
+
+def _ruta_exportacion(id, tipo):
+    return os.path.join(EXPORTACIONES_DIR, id + TIPOS_EXPORTACION[tipo][0])
+
+
+def _agrupar_de(filtros):
+    return [c for c in filtros.get('agrupar', '').split(',') if c]
+
+
+def clave_exportacion(conn, tipo, filtros):
+    """Id del trabajo: huella del tipo, los filtros y la versión de los datos que lee.
+
+    Cada cambio en asistencias sube la versión de su fecha (migración 9), así
+    que la suma de ocupacion_version sólo crece; los nombres salen de las
+    tablas maestras, con su propia versión.
+    """
+    asistencias = conn.execute('SELECT COALESCE(SUM(version), 0) FROM ocupacion_version').fetchone()[0]
+    maestros = versiones_de(conn, ('clientes', 'lideres', 'empleados', 'obras'))
+    texto = json.dumps([_VERSION_CODIGO, tipo, filtros, asistencias, maestros], sort_keys=True)
+    return hashlib.sha256(texto.encode()).hexdigest()[:24]
+
+
+def _anotar_exportacion(conn, id, terminado=False, **campos):
+    """Actualiza columnas del trabajo `id` (y `actualizado`) y confirma."""
+    asignaciones = ''.join(f'{campo} = ?, ' for campo in campos)
+    fin = ", terminado = datetime('now')" if terminado else ''
+    conn.execute(f"UPDATE exportaciones SET {asignaciones}actualizado = datetime('now'){fin} WHERE id = ?",
+                 [*campos.values(), id])
+    conn.commit()
+
+
+# ── En los procesos del pool ──
+
+def _iniciar_proceso_exportacion():
+    if hasattr(os, 'nice'):
+        os.nice(EXPORTACION_NICE)
+
+
+def generar_exportacion(id, tipo, filtros, ruta_db):
+    """Genera el archivo del trabajo `id` y deja el resultado en la tabla."""
+    escritura = sqlite3.connect(ruta_db, timeout=DB_BUSY_TIMEOUT / 1000)
+    lectura = sqlite3.connect(f'file:{quote(ruta_db)}?mode=ro', uri=True)
+    lectura.row_factory = sqlite3.Row
+    destino = _ruta_exportacion(id, tipo)
+    temporal = f'{destino}.{os.getpid()}.tmp'
+    ultimo_avance = 0
+
+    def avance(progreso):
+        nonlocal ultimo_avance
+        if time.monotonic() - ultimo_avance >= EXPORTACION_AVANCE_SEGUNDOS:
+            ultimo_avance = time.monotonic()
+            _anotar_exportacion(escritura, id, progreso=round(progreso, 3))
+
+    try:
+        _anotar_exportacion(escritura, id, estado='en_curso')
+        os.makedirs(EXPORTACIONES_DIR, exist_ok=True)
+        lectura.execute('BEGIN')   # todas las lecturas desde la misma instantánea
+        if tipo == 'komei':
+            obras = obras_komei(lectura.cursor(), filtros)
+            if not obras:
+                raise ValueError('No hay asistencias para exportar')
+            dias = dias_komei(filtros, obras)
+
+            def hojas():
+                for i, hoja in enumerate(hojas_komei(lectura, filtros, obras, dias)):
+                    avance(i / len(obras))
+                    yield hoja
+
+            with open(temporal, 'wb') as archivo:
+                for parte in generar_xlsx(hojas()):
+                    archivo.write(parte)
+        else:
+            resumen = calcular_resumen(lectura.cursor(), filtros, _agrupar_de(filtros))
+            with open(temporal, 'w', encoding='utf-8') as archivo:
+                json.dump(resumen, archivo, ensure_ascii=False)
+        os.replace(temporal, destino)
+        _anotar_exportacion(escritura, id, terminado=True, estado='listo', progreso=1,
+                            bytes=os.path.getsize(destino))
+    except Exception as e:
+        with contextlib.suppress(OSError):
+            os.remove(temporal)
+        _anotar_exportacion(escritura, id, terminado=True, estado='error', error=str(e) or type(e).__name__)
+    finally:
+        lectura.close()
+        escritura.close()
+
+
+# ── En el worker ──
+
+def _pool_exportaciones():
+    """Pool de procesos de este worker (uno nuevo después de un fork)."""
+    with _exportaciones_lock:
+        if _exportaciones['pid'] != os.getpid():
+            # 'spawn': procesos limpios, sin los hilos ni las conexiones abiertas del worker
+            _exportaciones.update(pid=os.getpid(), en_cola=0, pool=ProcessPoolExecutor(
+                max_workers=EXPORTACION_PROCESOS, mp_context=multiprocessing.get_context('spawn'),
+                initializer=_iniciar_proceso_exportacion))
+        return _exportaciones['pool']
+
+
+def _reservar_exportacion():
+    """Toma un lugar en la cola de este worker; False si ya hay EXPORTACION_COLA_MAX."""
+    _pool_exportaciones()
+    with _exportaciones_lock:
+        if _exportaciones['en_cola'] >= EXPORTACION_COLA_MAX:
+            return False
+        _exportaciones['en_cola'] += 1
+        return True
+
+
+def _exportacion_terminada(id, pool, futuro):
+    error = futuro.exception()
+    with _exportaciones_lock:
+        if _exportaciones['pool'] is pool:
+            _exportaciones['en_cola'] -= 1
+            if isinstance(error, BrokenProcessPool):
+                # Un proceso murió (p. ej. sin memoria): el pool no sirve más y se arma otro
+                pool.shutdown(wait=False)
+                _exportaciones.update(pid=None, pool=None)
+    if error is not None:
+        _anotar_exportacion(get_db(), id, terminado=True, estado='error',
+                            error=f'{type(error).__name__}: {error}')
+
+
+def _encolar_exportacion(id, tipo, filtros):
+    """Manda el trabajo al pool. Si no se puede, devuelve el lugar, deja el trabajo en error y da False."""
+    pool = None
+    try:
+        pool = _pool_exportaciones()
+        futuro = pool.submit(generar_exportacion, id, tipo, filtros, os.path.abspath(DATABASE))
+    except Exception as e:
+        with _exportaciones_lock:
+            _exportaciones['en_cola'] = max(0, _exportaciones['en_cola'] - 1)
+            if pool is not None and _exportaciones['pool'] is pool:
+                # Un pool que no acepta trabajos (p. ej. roto) no se reusa: el próximo pedido arma otro
+                pool.shutdown(wait=False)
+                _exportaciones.update(pid=None, pool=None)
+        _anotar_exportacion(get_db(), id, terminado=True, estado='error',
+                            error=f'{type(e).__name__}: {e}')
+        return False
+    futuro.add_done_callback(partial(_exportacion_terminada, id, pool))
+    return True
+
+
+def _leer_exportacion(conn, id):
+    return conn.execute(SQL_EXPORTACION, (f'-{EXPORTACION_VENCIDA_MINUTOS} minutes', id)).fetchone()
+
+
+def _estado_exportacion(fila):
+    estado, error = fila['estado'], fila['error']
+    if fila['vencida']:
+        estado, error = 'error', 'La exportación se interrumpió; vuelva a pedirla'
+    datos = {
+        'id':        fila['id'],
+        'tipo':      fila['tipo'],
+        'filtros':   json.loads(fila['filtros']),
+        'estado':    estado,
+        'progreso':  fila['progreso'],
+        'error':     error,
+        'bytes':     fila['bytes'],
+        'creado':    fila['creado'],
+        'terminado': fila['terminado'],
+    }
+    if estado == 'listo':
+        datos['descarga'] = f'/api/exportaciones/{fila["id"]}/descarga'
+    return datos
+
 
-@app.route('/api/empleados/<int:id>', methods=['DELETE'])
-def delete_empleado(id):
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM empleados WHERE id = ?', (id,))
-    conn.commit()
-    conn.close()
-    return jsonify({'message': 'Empleado eliminado exitosamente'})
+@app.route('/api/exportaciones', methods=['POST'])
+def crear_exportacion():
+    """Pide una exportación: {"tipo": "komei" | "resumen", "filtros": {...}}.
 
-# =====================================================
-# RUTAS - OBRAS
-# =====================================================
+    Los filtros son los de /api/asistencias/exportar/komei o los de
+    /api/asistencias/resumen (con `agrupar`). Responde 202 con el estado del
+    trabajo, o 200 si ese mismo archivo ya estaba generado; `Location` es la
+    URL para consultarlo.
+    """
+    data = request.json or {}
+    tipo = data.get('tipo')
+    if tipo not in TIPOS_EXPORTACION:
+        return jsonify({'error': 'tipo no válido', 'opciones': list(TIPOS_EXPORTACION)}), 400
+    filtros = data.get('filtros') or {}
+    if not isinstance(filtros, dict):
+        return jsonify({'error': 'filtros debe ser un objeto'}), 400
+    filtros = {clave: str(valor) for clave, valor in filtros.items() if valor not in (None, '')}
+    if tipo == 'resumen':
+        invalidas = [c for c in _agrupar_de(filtros) if c not in AGRUPACIONES_RESUMEN]
+        if invalidas:
+            return jsonify(_error_agrupar(invalidas)), 400
 
-@app.route('/api/obras', methods=['GET'])
-def get_obras():
     conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT o.*, c.nombre as cliente_nombre, 
-               l.nombre || ' ' || l.apellido as lider_nombre
-        FROM obras o
-        LEFT JOIN clientes c ON o.cliente_id = c.id
-        LEFT JOIN lideres l ON o.lider_id = l.id
-        ORDER BY o.nombre
-    ''')
-    obras = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return jsonify(obras)
+    conn.execute('BEGIN IMMEDIATE')   # dos pedidos iguales a la vez: un solo trabajo
+    try:
+        id = clave_exportacion(conn, tipo, filtros)
+        fila = _leer_exportacion(conn, id)
+        nuevo = fila is None or fila['vencida'] or fila['estado'] == 'error' or (
+            fila['estado'] == 'listo' and not os.path.exists(_ruta_exportacion(id, tipo)))
+        if nuevo:
+            if not _reservar_exportacion():
+                conn.rollback()
+                return jsonify({'error': 'Hay demasiadas exportaciones en curso; reintente en unos minutos'}), \
+                    503, {'Retry-After': '30'}
+            conn.execute('''INSERT OR REPLACE INTO exportaciones (id, tipo, filtros, estado, creado, actualizado)
+                            VALUES (?, ?, ?, 'pendiente', datetime('now'), datetime('now'))''',
+                         (id, tipo, json.dumps(filtros, ensure_ascii=False, sort_keys=True)))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    if nuevo:
+        if not _encolar_exportacion(id, tipo, filtros):
+            return jsonify({'error': 'No se pudo iniciar la exportación; reintente en unos minutos'}), \
+                503, {'Retry-After': '30'}
+        fila = _leer_exportacion(conn, id)
 
-@app.route('/api/obras', methods=['POST'])
-def create_obra():
-    data = request.json
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        INSERT INTO obras (nombre, cliente_id, lider_id, direccion, fecha_inicio, fecha_fin, estado)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    ''', (data['nombre'], data.get('cliente_id'), data.get('lider_id'), data.get('direccion'),
-          data.get('fecha_inicio'), data.get('fecha_fin'), data.get('estado', 'activa')))
-    
-    obra_id = cursor.lastrowid
-    
-    # Asignar empleados a la obra
-    if 'empleados_ids' in data and data['empleados_ids']:
-        for empleado_id in data['empleados_ids']:
-            cursor.execute('INSERT INTO obra_empleados (obra_id, empleado_id) VALUES (?, ?)',
-                         (obra_id, empleado_id))
-    
-    conn.commit()
-    conn.close()
-    return jsonify({'id': obra_id, 'message': 'Obra creada exitosamente'}), 201
+    estado = _estado_exportacion(fila)
+    return jsonify(estado), 200 if estado['estado'] == 'listo' else 202, {'Location': f'/api/exportaciones/{id}'}
 
-@app.route('/api/obras/<int:id>', methods=['PUT'])
-def update_obra(id):
-    data = request.json
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        UPDATE obras 
-        SET nombre = ?, cliente_id = ?, lider_id = ?, direccion = ?, 
-            fecha_inicio = ?, fecha_fin = ?, estado = ?
-        WHERE id = ?
-    ''', (data['nombre'], data.get('cliente_id'), data.get('lider_id'), data.get('direccion'),
-          data.get('fecha_inicio'), data.get('fecha_fin'), data.get('estado'), id))
-    
-    # Actualizar empleados asignados
-    cursor.execute('DELETE FROM obra_empleados WHERE obra_id = ?', (id,))
-    if 'empleados_ids' in data and data['empleados_ids']:
-        for empleado_id in data['empleados_ids']:
-            cursor.execute('INSERT INTO obra_empleados (obra_id, empleado_id) VALUES (?, ?)',
-                         (id, empleado_id))
-    
-    conn.commit()
-    conn.close()
-    return jsonify({'message': 'Obra actualizada exitosamente'})
 
-@app.route('/api/obras/<int:id>', methods=['DELETE'])
-def delete_obra(id):
+@app.route('/api/exportaciones/<id>', methods=['GET'])
+def estado_exportacion(id):
+    """Estado de un trabajo: pendiente, en_curso (con `progreso` de 0 a 1), listo o error."""
+    fila = _leer_exportacion(get_db(), id)
+    if fila is None:
+        return jsonify({'error': 'Exportación no encontrada'}), 404
+    return jsonify(_estado_exportacion(fila))
+
+
+@app.route('/api/exportaciones/<id>/descarga', methods=['GET'])
+def descargar_exportacion(id):
+    fila = _leer_exportacion(get_db(), id)
+    if fila is None:
+        return jsonify({'error': 'Exportación no encontrada'}), 404
+    if fila['estado'] != 'listo':
+        return jsonify({'error': 'La exportación todavía no está lista',
+                        'estado': _estado_exportacion(fila)['estado']}), 409
+    ruta = _ruta_exportacion(id, fila['tipo'])
+    if not os.path.exists(ruta):
+        return jsonify({'error': 'El archivo ya no está disponible; vuelva a pedir la exportación'}), 404
+    extension, mimetype, nombre = TIPOS_EXPORTACION[fila['tipo']]
+    return send_file(os.path.abspath(ruta), mimetype=mimetype, as_attachment=True,
+                     download_name=f'{nombre}_{fila["terminado"][:10].replace("-", "")}{extension}')
+
+
+def limpiar_exportaciones():
+    """Borra los trabajos y los archivos de hace más de EXPORTACION_RETENCION_HORAS."""
     conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM obras WHERE id = ?', (id,))
+    cursor = conn.execute("DELETE FROM exportaciones WHERE creado < datetime('now', ?)",
+                          (f'-{EXPORTACION_RETENCION_HORAS} hours',))
     conn.commit()
-    conn.close()
-    return jsonify({'message': 'Obra eliminada exitosamente'})
+    archivos = 0
+    if os.path.isdir(EXPORTACIONES_DIR):
+        limite = time.time() - EXPORTACION_RETENCION_HORAS * 3600
+        for nombre in os.listdir(EXPORTACIONES_DIR):
+            ruta = os.path.join(EXPORTACIONES_DIR, nombre)
+            if os.path.getmtime(ruta) < limite:
+                os.remove(ruta)
+                archivos += 1
+    return f'{cursor.rowcount} trabajo(s) y {archivos} archivo(s) eliminados'
 
-@app.route('/api/obras/<int:id>/empleados', methods=['GET'])
-def get_obra_empleados(id):
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT e.*
-        FROM empleados e
-        INNER JOIN obra_empleados oe ON e.id = oe.empleado_id
-        WHERE oe.obra_id = ? AND e.estado = 'activo'
-        ORDER BY e.nombre, e.apellido
-    ''', (id,))
-    empleados = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return jsonify(empleados)
+
+TAREAS['limpieza_exportaciones'] = ('15 4 * * *', limpiar_exportaciones)   # todas las noches, 04:15
 
 # =====================================================
-# RUTAS - ASISTENCIAS
+# ESTADO DEL SISTEMA
 # =====================================================
 
-@app.route('/api/asistencias/registrar', methods=['POST'])
-def registrar_asistencias():
-    data = request.json
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    fecha    = data['fecha']
-    obra_id  = data['obra_id']
-    lider_id = data['lider_id']
-    registros = data['registros']
-    
-    # ── Validar conflictos: empleados que ya marcaron PRESENTE en otra obra ese día ──
-    empleados_presentes = [
-        r['empleado_id'] for r in registros if r.get('presente') == True
-    ]
-    
-    conflictos = []
-    if empleados_presentes:
-        placeholders = ','.join('?' * len(empleados_presentes))
-        cursor.execute(f'''
-            SELECT a.empleado_id,
-                   e.nombre || '　' || e.apellido AS nombre_completo,
-                   o.nombre AS otra_obra
-            FROM asistencias a
-            INNER JOIN empleados e ON a.empleado_id = e.id
-            INNER JOIN obras o ON a.obra_id = o.id
-            WHERE a.fecha = ?
-              AND a.obra_id != ?
-              AND a.presente = 1
-              AND a.empleado_id IN ({placeholders})
-        ''', [fecha, obra_id] + empleados_presentes)
-        conflictos = [dict(row) for row in cursor.fetchall()]
-    
-    if conflictos:
-        conn.close()
-        # Armar mensaje en japonés con cada conflicto
-        detalles = ', '.join(
-            f"{c['nombre_completo']}（{c['otra_obra']}）" for c in conflictos
-        )
-        return jsonify({
-            'error': 'conflict',
-            'message': f'以下の作業員は既に別の現場で出勤済みです：{detalles}',
-            'conflictos': conflictos
-        }), 409
+@app.route('/api/sistema/db', methods=['GET'])
+def sistema_db():
+    """Contadores del pool de conexiones de este worker."""
+    return jsonify({'pid': os.getpid(), 'pool': estado_pool()})
 
-    # ── Sin conflictos: guardar ──────────────────────────────────
-    # Eliminar asistencias existentes para esa fecha y obra
-    cursor.execute('DELETE FROM asistencias WHERE fecha = ? AND obra_id = ?', (fecha, obra_id))
-    
-    # Insertar nuevas asistencias
-    for registro in registros:
-        cursor.execute('''
-            INSERT INTO asistencias (fecha, obra_id, empleado_id, presente, tipo_jornada, horas_extras)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (fecha, obra_id, registro['empleado_id'], registro['presente'],
-              registro['tipo_jornada'], registro.get('horas_extras', 0)))
-    
-    conn.commit()
-    conn.close()
-    return jsonify({'message': f'{len(registros)} asistencias guardadas exitosamente'}), 201
 
-@app.route('/api/asistencias', methods=['GET'])
-def get_asistencias():
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    # Construir query con filtros
-    query = '''
-        SELECT a.*, 
-               o.nombre as obra_nombre,
-               c.id as cliente_id, c.nombre as cliente_nombre,
-               l.id as lider_id, l.nombre as lider_nombre, l.apellido as lider_apellido,
-               e.nombre as empleado_nombre, e.apellido as empleado_apellido, e.cargo
-        FROM asistencias a
-        INNER JOIN obras o ON a.obra_id = o.id
-        LEFT JOIN clientes c ON o.cliente_id = c.id
-        LEFT JOIN lideres l ON o.lider_id = l.id
-        INNER JOIN empleados e ON a.empleado_id = e.id
-        WHERE 1=1
-    '''
-    params = []
-    
-    if request.args.get('fecha_desde'):
-        query += ' AND a.fecha >= ?'
-        params.append(request.args.get('fecha_desde'))
-    
-    if request.args.get('fecha_hasta'):
-        query += ' AND a.fecha <= ?'
-        params.append(request.args.get('fecha_hasta'))
-    
-    if request.args.get('cliente_id'):
-        query += ' AND c.id = ?'
-        params.append(request.args.get('cliente_id'))
-    
-    if request.args.get('obra_id'):
-        query += ' AND a.obra_id = ?'
-        params.append(request.args.get('obra_id'))
-    
-    if request.args.get('empleado_id'):
-        query += ' AND a.empleado_id = ?'
-        params.append(request.args.get('empleado_id'))
-    
-    if request.args.get('lider_id'):
-        query += ' AND l.id = ?'
-        params.append(request.args.get('lider_id'))
-    
-    query += ' ORDER BY a.fecha DESC, e.nombre'
-    
-    cursor.execute(query, params)
-    asistencias = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return jsonify(asistencias)
+@app.route('/api/sistema/tareas', methods=['GET'])
+def sistema_tareas():
+    """Horario, última ejecución (inicio, duración, resultado) y próxima de cada tarea."""
+    cursor = get_db().cursor()
+    cursor.execute('SELECT * FROM tareas_estado')
+    estados = {row['tarea']: dict(row) for row in cursor.fetchall()}
+    tareas = []
+    for nombre, (cron, _) in TAREAS.items():
+        estado = estados.get(nombre, {})
+        tareas.append({
+            'tarea':         nombre,
+            'cron':          cron,
+            'ultimo_inicio': estado.get('ultimo_inicio'),
+            'duracion':      estado.get('duracion'),
+            'resultado':     estado.get('resultado'),
+            'detalle':       estado.get('detalle'),
+            'proxima':       estado.get('proxima') or 'pendiente',
+            'pid':           estado.get('pid'),
+        })
+    return jsonify({
+        'pid':       os.getpid(),
+        'ejecutor':  _programador['ejecutor'],   # si este worker es el que corre las tareas
+        'zona':      str(ZONA_TAREAS),
+        'tareas':    tareas,
+    })
 
-@app.route('/api/asistencias/verificar', methods=['GET'])
-def verificar_asistencia():
-    fecha = request.args.get('fecha')
-    obra_id = request.args.get('obra_id')
-    
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT a.*, e.nombre, e.apellido
-        FROM asistencias a
-        INNER JOIN empleados e ON a.empleado_id = e.id
-        WHERE a.fecha = ? AND a.obra_id = ?
-    ''', (fecha, obra_id))
-    
-    asistencias = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return jsonify(asistencias)
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Métricas de este worker en formato de texto de Prometheus."""
+    pool = estado_pool()
+    cursor = get_db().cursor()
+    cursor.execute('SELECT tarea, duracion, resultado FROM tareas_estado')
+    tareas = cursor.fetchall()
+    extra = [
+        ('nippos_db_pool_connections', 'gauge', 'Conexiones SQLite abiertas en el pool',
+         [({}, pool['abiertas'])]),
+        ('nippos_db_pool_total', 'counter', 'Pedidos de conexión al pool (hit/miss) y cierres',
+         [({'evento': evento}, pool[evento]) for evento in ('hits', 'misses', 'cerradas')]),
+        ('nippos_cache_listados_entries', 'gauge', 'Cuerpos guardados en la caché de listados',
+         [({}, len(_cache_listados))]),
+        ('nippos_ocupacion_dias', 'gauge', 'Fechas en memoria en el índice de ocupación',
+         [({}, len(ocupacion._dias))]),
+        ('nippos_ocupacion_consultas_total', 'counter', 'Fechas pedidas al índice de ocupación',
+         [({'resultado': 'memoria'}, ocupacion.aciertos), ({'resultado': 'sqlite'}, ocupacion.cargas)]),
+        ('nippos_exportaciones_en_cola', 'gauge', 'Exportaciones esperando o en curso en el pool del worker',
+         [({}, _exportaciones['en_cola'] if _exportaciones['pid'] == os.getpid() else 0)]),
+        ('nippos_carril_activos', 'gauge', 'Pedidos de este worker atendiéndose, por carril',
+         [({'clase': c.clase}, c.activos) for c in carriles.values()]),
+        ('nippos_carril_en_espera', 'gauge', 'Pedidos de este worker esperando lugar, por carril',
+         [({'clase': c.clase}, c.esperando) for c in carriles.values()]),
+        ('nippos_carril_admitidos_total', 'counter', 'Pedidos admitidos por carril',
+         [({'clase': c.clase}, c.admitidos) for c in carriles.values()]),
+        ('nippos_carril_rechazados_total', 'counter', 'Pedidos rechazados por carril (cola llena o espera agotada)',
+         [({'clase': c.clase, 'motivo': motivo}, cantidad)
+          for c in carriles.values() for motivo, cantidad in c.rechazados.items()]),
+        ('nippos_carril_espera_seconds_total', 'counter', 'Segundos esperando lugar, por carril',
+         [({'clase': c.clase}, f'{c.espera_segundos:.6f}') for c in carriles.values()]),
+        ('nippos_programador_ejecutor', 'gauge', '1 si este worker corre las tareas programadas',
+         [({}, int(_programador['ejecutor']))]),
+        ('nippos_tarea_duracion_seconds', 'gauge', 'Duración de la última ejecución de cada tarea',
+         [({'tarea': t['tarea']}, t['duracion']) for t in tareas]),
+        ('nippos_tarea_ok', 'gauge', '1 si la última ejecución de la tarea terminó bien',
+         [({'tarea': t['tarea']}, int(t['resultado'] == 'ok')) for t in tareas]),
+    ]
+    return Response(texto_metricas(extra), mimetype='text/plain; version=0.0.4')
 
 # =====================================================
 # DESCARGA DE BASE DE DATOS (URL PRIVADA + PIN)
@@ -727,6 +3879,9 @@ PAGE_BACKUP = '''<!DOCTYPE html>
             border-radius: 4px;
             margin-left: 6px;
         }
+        .estado-ok { color: #4caf50; }
+        .estado-ng { color: #e94560; font-weight: bold; }
+        .estado-na { color: #888; }
     </style>
 </head>
 <body>
@@ -758,6 +3913,12 @@ PAGE_BACKUP = '''<!DOCTYPE html>
 
 <script>
 let pinOk = '';
+const ESTADOS = {
+    verificado:    '<span class="estado-ok" title="integrity_check OK">✔ 検証済み</span>',
+    alterado:      '<span class="estado-ng">✖ 不一致</span>',
+    incompleto:    '<span class="estado-ng">✖ 欠落あり</span>',
+    sin_verificar: '<span class="estado-na">未検証</span>'
+};
 
 async function verificar() {
     const pin = document.getElementById('pinInput').value;
@@ -791,7 +3952,7 @@ async function verificar() {
                 <div>
                     <span class="file-name">${f.nombre}</span>
                     ${isLatest ? '<span class="tag-current">最新</span>' : ''}
-                    <div class="file-date">${f.fecha} &nbsp;|&nbsp; ${f.tamaño}</div>
+                    <div class="file-date">${f.fecha} &nbsp;|&nbsp; ${f.tamaño}${f.comprimido ? ' (gz ' + f.comprimido + ')' : ''}${f.estado ? ' &nbsp;|&nbsp; ' + ESTADOS[f.estado] : ''}</div>
                 </div>
                 <a class="btn-download" href="/backup/descargar/${encodeURIComponent(f.key)}?pin=${encodeURIComponent(pinOk)}">
                     ⬇ DL
@@ -825,16 +3986,35 @@ def backup_lista():
         return jsonify({'error': 'PIN incorrecto'}), 403
 
     archivos = []
+    for manifiesto in reversed(listar_puntos()):
+        descarga = manifiesto.get('descarga')
+        tipo = '完全' if manifiesto['tipo'] == 'completo' else '差分'
+        archivos.append({
+            'nombre':     f"{manifiesto['punto']}.db ({tipo})",
+            'key':        manifiesto['punto'],   # clave para la URL de descarga
+            'fecha':      datetime.fromisoformat(manifiesto['creado']).strftime('%Y/%m/%d %H:%M'),
+            'tamaño':     f"{manifiesto['bytes']/1024:.1f} KB",
+            'tipo':       manifiesto['tipo'],
+            'estado':     estado_punto(manifiesto['punto']),   # verificado | alterado | incompleto
+            'sha256_db':  manifiesto['sha256'],
+            # Lo que se descarga (.db.gz), si ya se calculó
+            'comprimido': f"{descarga['bytes']/1024:.1f} KB" if descarga else None,
+            'sha256':     descarga['sha256'] if descarga else None
+        })
+    # Copias completas del formato anterior
     if os.path.exists(BACKUP_DIR):
         for nombre in sorted(os.listdir(BACKUP_DIR), reverse=True):
             if nombre.startswith('asistencias_') and nombre.endswith('.db'):
                 ruta = os.path.join(BACKUP_DIR, nombre)
                 stat = os.stat(ruta)
+                estado, manifiesto = estado_backup(ruta)
                 archivos.append({
                     'nombre': nombre,
-                    'key':    nombre,          # clave para la URL de descarga
+                    'key':    nombre,
                     'fecha':  datetime.fromtimestamp(stat.st_mtime).strftime('%Y/%m/%d %H:%M'),
-                    'tamaño': f'{stat.st_size/1024:.1f} KB'
+                    'tamaño': f'{stat.st_size/1024:.1f} KB',
+                    'estado': estado,
+                    'sha256': manifiesto.get('sha256') if manifiesto else None
                 })
 
     # DB activa — usa key especial 'current'
@@ -850,6 +4030,87 @@ def backup_lista():
     return jsonify({'archivos': archivos})
 
 
+BACKUP_DESCARGA_BLOQUE = 262144   # bytes comprimidos por envío al cliente
+
+
+def generar_punto_gz(punto):
+    """El .db de un punto de restauración, comprimido con gzip al vuelo.
+
+    No escribe nada en disco: recorre el completo de la cadena página por
+    página, reemplazando las que cambiaron en los incrementales (que se leen a
+    memoria; son pocas). Con el mismo punto produce siempre los mismos bytes,
+    por eso se puede reanudar una descarga con Range volviendo a generarla.
+    """
+    cadena = cadena_de(punto)
+    final = cadena[-1]
+    tam = final['page_size']
+    cambios = {}
+    for manifiesto in cadena[1:]:
+        with gzip.open(_ruta_backup(manifiesto['archivo']), 'rb') as gz:
+            while cabecera := gz.read(4):
+                cambios[int.from_bytes(cabecera, 'big')] = gz.read(tam)
+
+    salida = _SalidaStream()
+    with gzip.open(_ruta_backup(cadena[0]['archivo']), 'rb') as completo, \
+         gzip.GzipFile(fileobj=salida, mode='wb', compresslevel=6, mtime=0) as gz:
+        for numero in range(1, final['paginas'] + 1):
+            pagina = completo.read(tam)
+            gz.write(cambios.get(numero, pagina))
+            if salida.pendiente >= BACKUP_DESCARGA_BLOQUE:
+                yield salida.vaciar()
+    yield salida.vaciar()
+
+
+def _guardar_descarga(punto, total, sha256):
+    # Con el lock de la cadena: no pisar un manifiesto que se está creando o borrando
+    with _backup_lock, bloqueo_archivo(_ruta_backup('.cadena.lock')):
+        manifiesto = leer_manifiesto(punto)
+        if manifiesto is None:   # el punto se borró durante la descarga
+            return
+        manifiesto['descarga'] = {'bytes': total, 'sha256': sha256}
+        _escribir_atomico(_ruta_backup(punto + '.json'), json.dumps(manifiesto, indent=2).encode())
+
+
+def precalcular_descarga(punto):
+    """Guarda en el manifiesto el tamaño y el SHA-256 del .db.gz que se descarga."""
+    sha256 = hashlib.sha256()
+    total = 0
+    for bloque in generar_punto_gz(punto):
+        sha256.update(bloque)
+        total += len(bloque)
+    _guardar_descarga(punto, total, sha256.hexdigest())
+
+
+def _registrando_descarga(punto, bloques):
+    """Pasa los bloques tal cual y, si se enviaron todos, guarda tamaño y hash."""
+    sha256 = hashlib.sha256()
+    total = 0
+    for bloque in bloques:
+        sha256.update(bloque)
+        total += len(bloque)
+        yield bloque
+    _guardar_descarga(punto, total, sha256.hexdigest())
+
+
+def respuesta_descarga_punto(punto):
+    """Respuesta con el .db.gz del punto: con tamaño, ETag y Range si ya se conocen."""
+    descarga = leer_manifiesto(punto).get('descarga')
+    nombre = f'{punto}.db.gz'
+    if descarga is None:
+        # Primera descarga (p. ej. un punto recién creado): sin largo conocido
+        respuesta = Response(_registrando_descarga(punto, generar_punto_gz(punto)),
+                             mimetype='application/gzip')
+    else:
+        respuesta = Response(generar_punto_gz(punto), mimetype='application/gzip')
+        respuesta.set_etag(descarga['sha256'])
+        # Range: Werkzeug genera de nuevo y descarta los bytes anteriores al pedido
+        respuesta.make_conditional(request, accept_ranges=True, complete_length=descarga['bytes'])
+        if respuesta.status_code == 200:
+            respuesta.content_length = descarga['bytes']
+    respuesta.headers['Content-Disposition'] = f'attachment; filename="{nombre}"'
+    return respuesta
+
+
 @app.route('/backup/descargar/<key>')
 def backup_descargar(key):
     """Descarga un archivo de backup (requiere PIN)."""
@@ -857,14 +4118,26 @@ def backup_descargar(key):
     if pin != BACKUP_PIN:
         return jsonify({'error': 'PIN incorrecto'}), 403
 
-    # DB activa
+    # DB activa: se agrega un punto a la cadena (un incremental, chico) y se
+    # redirige a él, así una descarga cortada se reanuda contra algo que no cambia
     if key == 'current':
         if not os.path.exists(DATABASE):
             return jsonify({'error': 'Archivo no encontrado'}), 404
-        nombre_descarga = f'asistencias_actual_{datetime.now().strftime("%Y%m%d_%H%M")}.db'
-        return send_file(os.path.abspath(DATABASE), as_attachment=True, download_name=nombre_descarga)
+        try:
+            punto = crear_punto_backup(f'asistencias_{datetime.now().strftime("%Y%m%d_%H%M%S")}')['punto']
+        except RuntimeError as e:
+            return jsonify({'error': str(e)}), 500
+        return redirect(f'/backup/descargar/{punto}?pin={quote(pin)}', code=303)
+
+    # Punto de la cadena incremental: .db.gz generado al vuelo, reanudable con Range
+    if PATRON_PUNTO.match(key):
+        if leer_manifiesto(key) is None:
+            return jsonify({'error': 'Archivo no encontrado'}), 404
+        if estado_punto(key) != 'verificado':
+            return jsonify({'error': f'El respaldo {key} está dañado o incompleto'}), 500
+        return respuesta_descarga_punto(key)
 
-    # Backup diario — validar que sea un nombre seguro
+    # Copia completa del formato anterior — validar que sea un nombre seguro
     if not key.endswith('.db') or '/' in key or '\\' in key or '..' in key or '(' in key:
         return jsonify({'error': 'Archivo no válido'}), 400
 
@@ -875,26 +4148,383 @@ def backup_descargar(key):
     return send_file(os.path.abspath(ruta), as_attachment=True, download_name=key)
 
 
+# =====================================================
+# MANTENIMIENTO (comandos `flask --app app ...`)
+# =====================================================
+
+@contextlib.contextmanager
+def carga_masiva_asistencias(cursor):
+    """Quita los índices y triggers de asistencias mientras se cargan muchas filas.
+
+    Ordenar una vez al final es mucho más rápido que mantener los índices fila
+    por fila, y las versiones de ocupación no hacen falta en una base que nadie
+    consulta todavía. Al salir se vuelven a crear tal como estaban.
+    """
+    objetos = cursor.execute('''SELECT type, name, sql FROM sqlite_master
+                                WHERE type IN ('index', 'trigger') AND tbl_name = 'asistencias'
+                                  AND sql IS NOT NULL''').fetchall()
+    for objeto in objetos:
+        cursor.execute(f'DROP {objeto["type"].upper()} {objeto["name"]}')
+    yield
+    for objeto in objetos:
+        cursor.execute(objeto['sql'])
+
+
+def poblar_datos_sinteticos(conn, filas, empleados=2000, obras=300):
+    """Llena una base vacía con datos ficticios: `filas` asistencias, una por empleado y día."""
+    cursor = conn.cursor()
+    clientes = max(1, obras // 8)
+    lideres = max(1, obras // 5)
+    cursor.execute('''
+        WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < ?)
+        INSERT INTO clientes (nombre, razon_social) SELECT 'Cliente ' || i, 'Cliente ' || i || ' SA' FROM n
+    ''', (clientes,))
+    cursor.execute('''
+        WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < ?)
+        INSERT INTO lideres (nombre, apellido) SELECT 'Lider', 'N' || i FROM n
+    ''', (lideres,))
+    cursor.execute('''
+        WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < ?)
+        INSERT INTO empleados (nombre, apellido, cargo, estado)
+        SELECT 'Empleado', 'N' || i, 'Cargo ' || (i % 7), CASE WHEN i % 20 = 0 THEN 'inactivo' ELSE 'activo' END
+        FROM n
+    ''', (empleados,))
+    cursor.execute('''
+        WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < ?)
+        INSERT INTO obras (nombre, cliente_id, lider_id, estado)
+        SELECT 'Obra ' || i, (i % ?) + 1, (i % ?) + 1, 'activa' FROM n
+    ''', (obras, clientes, lideres))
+    # Cada empleado trabaja siempre en la misma obra (cuadrilla fija)
+    cursor.execute('''
+        INSERT INTO obra_empleados (obra_id, empleado_id)
+        SELECT (id % ?) + 1, id FROM empleados
+    ''', (obras,))
+    with carga_masiva_asistencias(cursor):
+        cursor.execute('''
+            WITH RECURSIVE n(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM n WHERE i < ? - 1)
+            INSERT INTO asistencias (fecha, obra_id, empleado_id, presente, tipo_jornada, horas_extras)
+            SELECT date('2015-01-01', '+' || (i / :emp) || ' days'),
+                   ((i % :emp) + 1) % :obras + 1,
+                   (i % :emp) + 1,
+                   (i % 11) != 0,
+                   CASE i % 4 WHEN 0 THEN 'noche' WHEN 1 THEN 'dia_noche' ELSE 'dia' END,
+                   (i % 5) * 0.5
+            FROM n
+        '''.replace(':emp', str(empleados)).replace(':obras', str(obras)), (filas,))
+    conn.commit()
+
+
+APELLIDOS_DATOS = ('佐藤', '鈴木', '高橋', '田中', '伊藤', '渡辺', '山本', '中村', '小林', '加藤',
+                   '吉田', '山田', '佐々木', '山口', '松本', '井上', '木村', '林', '清水', '斎藤')
+NOMBRES_DATOS   = ('翔太', '大輔', '健太', '拓也', '直樹', '誠', '隆', '浩二', '和也', '亮',
+                   '勇気', '剛', '修', '哲也', '悟', '学', '豊', '茂', '進', '実')
+CARGOS_DATOS    = (('土工', 30), ('鳶', 15), ('大工', 15), ('電工', 12), ('配管工', 10),
+                   ('左官', 8), ('内装', 6), ('重機オペ', 4))
+BARRIOS_DATOS   = ('新宿', '渋谷', '品川', '川崎', '横浜', '大宮', '千葉', '船橋', '立川', '町田')
+
+
+def generar_datos_realistas(conn, empleados=3000, obras=300, anios=3, hasta=None, semilla=1):
+    """Llena una base vacía con años de operación ficticia pero con forma real.
+
+    Las obras duran de 2 a 18 meses y se reparten en el período; cada empleado
+    entra en una fecha, a veces se va, y trabaja en una sola obra por vez,
+    cambiando de obra cada algunos meses o cuando la suya termina. Se trabaja
+    de lunes a sábado con ~8 % de ausencias, algo de turno noche y horas extras.
+    Con la misma semilla se generan siempre los mismos datos. Devuelve la
+    cantidad de asistencias.
+    """
+    rnd = random.Random(semilla)
+    hasta = hasta or date(2025, 12, 31)
+    desde = hasta - timedelta(days=365 * anios)
+    dias_periodo = (hasta - desde).days
+    cursor = conn.cursor()
+
+    clientes = max(1, obras // 6)
+    lideres = max(1, obras // 4)
+    cursor.executemany('INSERT INTO clientes (nombre, razon_social, telefono, direccion) VALUES (?, ?, ?, ?)',
+                       [(f'{rnd.choice(APELLIDOS_DATOS)}建設 {i}', f'株式会社{rnd.choice(APELLIDOS_DATOS)}建設 {i}',
+                         f'03-{rnd.randint(1000, 9999)}-{rnd.randint(1000, 9999)}',
+                         f'{rnd.choice(BARRIOS_DATOS)} {i}-{rnd.randint(1, 30)}')
+                        for i in range(1, clientes + 1)])
+    cursor.executemany('INSERT INTO lideres (nombre, apellido, telefono) VALUES (?, ?, ?)',
+                       [(rnd.choice(NOMBRES_DATOS), rnd.choice(APELLIDOS_DATOS),
+                         f'090-{rnd.randint(1000, 9999)}-{rnd.randint(1000, 9999)}')
+                        for _ in range(lideres)])
+
+    # Obras: (id, inicio, fin)
+    periodos_obra = []
+    filas_obras = []
+    for i in range(1, obras + 1):
+        inicio = desde + timedelta(days=rnd.randint(-120, dias_periodo - 30))
+        fin = inicio + timedelta(days=rnd.randint(60, 540))
+        estado = 'finalizada' if fin < hasta else rnd.choice(('activa',) * 9 + ('pausada',))
+        periodos_obra.append((i, inicio, fin))
+        filas_obras.append((f'{rnd.choice(BARRIOS_DATOS)}{rnd.choice(("マンション", "ビル", "倉庫", "病院", "学校"))} {i}',
+                            rnd.randint(1, clientes), rnd.randint(1, lideres),
+                            f'{rnd.choice(BARRIOS_DATOS)} {rnd.randint(1, 9)}-{rnd.randint(1, 30)}',
+                            inicio.isoformat(), fin.isoformat(), estado))
+    cursor.executemany('''INSERT INTO obras (nombre, cliente_id, lider_id, direccion, fecha_inicio, fecha_fin, estado)
+                          VALUES (?, ?, ?, ?, ?, ?, ?)''', filas_obras)
+
+    # Empleados: (id, ingreso, salida o None)
+    cargos, pesos = zip(*CARGOS_DATOS)
+    personal = []
+    filas_empleados = []
+    for i in range(1, empleados + 1):
+        # Dos tercios ya estaban al empezar el período; el resto entra durante
+        ingreso = desde - timedelta(days=rnd.randint(0, 2000)) if rnd.random() < 0.66 \
+            else desde + timedelta(days=rnd.randint(0, dias_periodo))
+        salida = ingreso + timedelta(days=rnd.randint(90, 2500)) if rnd.random() < 0.15 else None
+        if salida is not None and salida >= hasta:
+            salida = None
+        personal.append((i, ingreso, salida))
+        filas_empleados.append((rnd.choice(NOMBRES_DATOS), rnd.choice(APELLIDOS_DATOS), f'{rnd.randint(10**7, 10**8 - 1)}',
+                                f'080-{rnd.randint(1000, 9999)}-{rnd.randint(1000, 9999)}',
+                                rnd.choices(cargos, pesos)[0], ingreso.isoformat(),
+                                'inactivo' if salida else 'activo'))
+    cursor.executemany('''INSERT INTO empleados (nombre, apellido, dni, telefono, cargo, fecha_ingreso, estado)
+                          VALUES (?, ?, ?, ?, ?, ?, ?)''', filas_empleados)
+
+    # Día por día: cada empleado activo va a su obra; al terminar la obra (o con
+    # ~0,5 % de probabilidad por día) pasa a otra obra en curso
+    obra_de = {}
+    asignaciones = set()
+    total = 0
+    lote = []
+    dia = desde
+    with carga_masiva_asistencias(cursor):
+        while dia <= hasta:
+            en_curso = [o for o, inicio, fin in periodos_obra if inicio <= dia <= fin]
+            vigentes = set(en_curso)
+            fecha = dia.isoformat()
+            if dia.weekday() != 6 and en_curso:       # domingo no se trabaja
+                for empleado_id, ingreso, salida in personal:
+                    if ingreso > dia or (salida is not None and salida <= dia):
+                        continue
+                    obra_id = obra_de.get(empleado_id)
+                    if obra_id not in vigentes or rnd.random() < 0.005:
+                        obra_id = obra_de[empleado_id] = rnd.choice(en_curso)
+                        asignaciones.add((obra_id, empleado_id))
+                    azar = rnd.random()
+                    lote.append((fecha, obra_id, empleado_id, azar >= 0.08,
+                                 'noche' if azar < 0.18 else 'dia_noche' if azar < 0.21 else 'dia',
+                                 rnd.choice((0, 0, 0, 0, 0.5, 1, 1.5, 2, 3))))
+                if len(lote) >= 50000:
+                    cursor.executemany('''INSERT INTO asistencias (fecha, obra_id, empleado_id, presente, tipo_jornada, horas_extras)
+                                          VALUES (?, ?, ?, ?, ?, ?)''', lote)
+                    total += len(lote)
+                    lote = []
+            dia += timedelta(days=1)
+        cursor.executemany('''INSERT INTO asistencias (fecha, obra_id, empleado_id, presente, tipo_jornada, horas_extras)
+                              VALUES (?, ?, ?, ?, ?, ?)''', lote)
+        total += len(lote)
+    cursor.executemany('INSERT INTO obra_empleados (obra_id, empleado_id) VALUES (?, ?)', sorted(asignaciones))
+
+    reconstruir_resumenes(cursor)
+    conn.commit()
+    return total
+
+
+def _consultas_a_verificar():
+    """(nombre, sql, params) de cada consulta de las rutas que debe usar índices."""
+    dia, desde, hasta = '2018-03-01', '2018-01-01', '2018-12-31'
+    consultas = [
+        ('verificar_asistencia', SQL_VERIFICAR, (dia, 7)),
+        ('contexto_registro: plantel', SQL_PLANTEL_OBRA, (7,)),
+        ('registrar_asistencias: ocupación del día', SQL_OCUPACION_DIA, (dia,)),
+        ('registrar_asistencias: estado del día', SQL_ESTADO_DIA, (dia, 7)),
+    ]
+    filtros = [
+        {'fecha_desde': desde, 'fecha_hasta': hasta},
+        {'fecha_desde': desde, 'fecha_hasta': hasta, 'obra_id': 7},
+        {'fecha_desde': desde, 'fecha_hasta': hasta, 'empleado_id': 42},
+        {'fecha_desde': desde, 'fecha_hasta': hasta, 'cliente_id': 3},
+        {'fecha_desde': desde, 'fecha_hasta': hasta, 'lider_id': 5},
+        {'obra_id': 7},
+        {'empleado_id': 42},
+    ]
+    for f in filtros:
+        query, params = construir_consulta_asistencias(f)
+        consultas.append((f'get_asistencias {sorted(f)}', query, params))
+    for f, agrupar in [({'fecha_desde': desde, 'fecha_hasta': hasta}, ['mes', 'obra']),
+                       ({'fecha_desde': desde, 'fecha_hasta': hasta, 'obra_id': 7}, ['dia']),
+                       ({'fecha_desde': desde, 'fecha_hasta': hasta, 'cliente_id': 3}, ['empleado'])]:
+        fuente = elegir_fuente_resumen(f, agrupar)
+        query, params = construir_consulta_resumen(f, agrupar, fuente)
+        consultas.append((f'resumen_asistencias {agrupar} {sorted(f)} ({fuente})', query, params))
+    consultas.append(('registrar_asistencias: resumen mensual',
+                      SQL_INSERTAR_MENSUAL.format(where='''
+                          WHERE a.empleado_id IN (?,?) AND a.obra_id = ?
+                            AND a.fecha >= ? AND a.fecha <= ?'''),
+                      (1, 2, 7, '2018-03-01', '2018-03-31')))
+    consultas.append(('delete_empleado: resumen diario',
+                      SQL_INSERTAR_DIARIO.format(where='''WHERE (a.fecha, a.obra_id) IN
+                          (SELECT DISTINCT fecha, obra_id FROM asistencias WHERE empleado_id = ?)'''),
+                      (42,)))
+    for f in [{}, {'obra_id': 7}, {'empleado_id': 42}]:
+        query, params = construir_consulta_asistencias(f, despues_de=(dia, 123456), limite=500)
+        consultas.append((f'get_asistencias página {sorted(f)}', query, params))
+    return consultas
+
+
+@app.cli.command('verificar-planes')
+@click.option('--filas', default=3000000, show_default=True,
+              help='Cantidad de asistencias sintéticas a generar.')
+def verificar_planes(filas):
+    """Falla si alguna consulta de las rutas recorre asistencias completa (EXPLAIN QUERY PLAN)."""
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(os.path.join(tmp, 'planes.db'))
+        conn.row_factory = sqlite3.Row
+        crear_tablas(conn)
+        aplicar_migraciones(conn)
+        print(f'Generando {filas} asistencias sintéticas...')
+        poblar_datos_sinteticos(conn, filas)
+        conn.execute('ANALYZE')
+
+        fallos = 0
+        for nombre, sql, params in _consultas_a_verificar():
+            plan = [row['detail'] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+            # Las tablas maestras son chicas; lo que no puede recorrerse entero es asistencias
+            scans = [p for p in plan if re.match(r'SCAN (a|asistencias)\b', p)]
+            print(f"{'FALLA' if scans else 'ok   '} {nombre}")
+            for paso in plan:
+                print(f'        {paso}')
+            fallos += bool(scans)
+        conn.close()
+
+    if fallos:
+        raise SystemExit(f'{fallos} consulta(s) recorren asistencias completa')
+    print('Todas las consultas usan índices')
+
+
+@app.cli.command('reconstruir-resumenes')
+def reconstruir_resumenes_cmd():
+    """Recalcula resumen_diario y resumen_mensual desde todo el historial de asistencias."""
+    init_db()
+    conn = get_db()
+    conn.execute('BEGIN IMMEDIATE')
+    reconstruir_resumenes(conn.cursor())
+    conn.commit()
+    dias = conn.execute('SELECT COUNT(*) FROM resumen_diario').fetchone()[0]
+    meses = conn.execute('SELECT COUNT(*) FROM resumen_mensual').fetchone()[0]
+    print(f'Resúmenes reconstruidos: {dias} obra/día, {meses} empleado/obra/mes')
+
+
+@app.cli.command('generar-datos')
+@click.argument('destino')
+@click.option('--empleados', default=3000, show_default=True, help='Empleados a lo largo del período.')
+@click.option('--obras', default=300, show_default=True, help='Obras a lo largo del período.')
+@click.option('--anios', default=3, show_default=True, help='Años de asistencias diarias.')
+@click.option('--hasta', default='2025-12-31', show_default=True, help='Último día con asistencias.')
+@click.option('--semilla', default=1, show_default=True, help='Misma semilla, mismos datos.')
+def generar_datos_cmd(destino, empleados, obras, anios, hasta, semilla):
+    """Crea DESTINO (.db) con datos ficticios a escala real, para pruebas de carga.
+
+    Para usarlo con el servidor, copiarlo como asistencias.db (ver benchmark.py).
+    """
+    if os.path.exists(destino):
+        raise SystemExit(f'{destino} ya existe')
+    t0 = time.monotonic()
+    conn = sqlite3.connect(destino)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.execute(f'PRAGMA cache_size = {DB_CACHE_SIZE * 16}')
+    crear_tablas(conn)
+    aplicar_migraciones(conn)
+    total = generar_datos_realistas(conn, empleados, obras, anios,
+                                    datetime.strptime(hasta, '%Y-%m-%d').date(), semilla)
+    conn.execute('ANALYZE')
+    conn.close()
+    print(f'{destino}: {empleados} empleados, {obras} obras, {total} asistencias '
+          f'en {time.monotonic() - t0:.1f}s')
+
+
+@app.cli.command('crear-backup')
+def crear_backup_cmd():
+    """Agrega ahora mismo un punto de restauración a la cadena de backups."""
+    init_db()
+    m = crear_punto_backup(f'asistencias_{datetime.now().strftime("%Y%m%d_%H%M%S")}')
+    precalcular_descarga(m['punto'])
+    print(f'{m["punto"]}: {m["tipo"]}, {m["guardadas"]}/{m["paginas"]} páginas, '
+          f'{m["comprimido"]/1024:.1f} KB comprimido')
+
+
+@app.cli.command('restaurar-backup')
+@click.argument('punto')
+@click.option('--destino', help='Archivo .db a crear (por defecto <punto>.db).')
+def restaurar_backup_cmd(punto, destino):
+    """Reconstruye un punto de restauración (p. ej. asistencias_20250131) en un archivo .db.
+
+    Para volver a usarlo en producción: detener el servidor y reemplazar
+    asistencias.db (y borrar asistencias.db-wal / -shm) por el archivo creado.
+    """
+    destino = destino or f'{punto}.db'
+    if os.path.exists(destino):
+        raise SystemExit(f'{destino} ya existe')
+    try:
+        with open(destino + '.tmp', 'w+b') as archivo:
+            reconstruir_punto(punto, archivo)
+        integridad = verificar_integridad(destino + '.tmp')
+        if integridad != 'ok':
+            raise RuntimeError(f'integrity_check falló: {integridad}')
+    except (ValueError, RuntimeError) as e:
+        if os.path.exists(destino + '.tmp'):
+            os.remove(destino + '.tmp')
+        raise SystemExit(str(e))
+    os.replace(destino + '.tmp', destino)
+    cadena = cadena_de(punto)
+    print(f'{destino} restaurado desde {len(cadena)} archivo(s) '
+          f'({cadena[0]["punto"]} … {punto}); SHA-256 e integrity_check ok')
+
+
 # =====================================================
 # INICIALIZACIÓN Y ARRANQUE
 # =====================================================
 
-if __name__ == '__main__':
-    # Crear la base de datos si no existe
-    if not os.path.exists(DATABASE):
+# Un error en un horario tiene que aparecer al arrancar, no a las 02:30
+# (acá, cuando ya se registraron todas las tareas)
+for _cron, _ in TAREAS.values():
+    siguiente_ejecucion(_cron, datetime.now(ZONA_TAREAS))
+
+
+
+def create_app():
+    """La app lista para servir: esquema y migraciones aplicados (una vez, al arrancar).
+
+    Con gunicorn (ver gunicorn.conf.py) corre en el master antes del fork, así
+    los workers arrancan sin tocar el esquema; lo de cada worker lo abre
+    `iniciar_worker`.
+    """
+    nueva = not os.path.exists(DATABASE)
+    if nueva:
         print('Creando base de datos...')
-        init_db()
+    init_db()
+    if nueva:
         print('Base de datos creada exitosamente!')
-    else:
-        # Verificar que existan las tablas
-        init_db()
-    
-    # Iniciar backup automático diario y limpieza semanal
-    realizar_backup()
-    limpiar_backups_viejos()
-    print(f'[Backup] Respaldo diario activado → carpeta /{BACKUP_DIR}/')
-    print(f'[Backup] Limpieza semanal activada → conserva los últimos {BACKUP_KEEP_COUNT} respaldos')
-    
+    # La conexión del arranque no pasa a los workers: cada uno abre las suyas
+    cerrar_pool()
+    for nombre, (cron, _) in TAREAS.items():
+        print(f'[Tareas] {nombre}: "{cron}" ({ZONA_TAREAS})')
+    print(f'[Backup] Respaldos en /{BACKUP_DIR}/, se conservan {BACKUP_RETENCION_DIAS} días')
+    return app
+
+
+def iniciar_worker():
+    """Después del fork (post_fork de gunicorn): métricas desde cero y programador de tareas."""
+    global _proceso_inicio
+    _proceso_inicio = time.time()
+    with _metricas_lock:
+        # Las consultas del arranque las hizo el master
+        _sql_metricas.clear()
+    with _pool_lock:
+        _pool_stats.update(hits=0, misses=0, cerradas=0)
+    # Sin esperar al primer request: el backup nocturno corre aunque nadie use la app
+    iniciar_programador()
+
+
+if __name__ == '__main__':
+    create_app()
     print('Servidor iniciado en http://localhost:5000')
     print('Presiona CTRL+C para detener')
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,493 @@
+"""Prueba de carga reproducible del sistema de asistencias.
+
+Corre una mezcla fija de tráfico típico (registro de asistencias, consultas
+con filtros, reportes, carga de datos maestros) contra la app real, sobre una
+copia de una base generada con `flask --app app generar-datos`, y devuelve en
+JSON el throughput, la latencia p50/p95/p99, los bytes por respuesta y el
+tiempo de CPU por pedido de cada endpoint. También mide el arranque en frío:
+cuánto tarda en responder el primer pedido y el ritmo del calentamiento, frente
+al ritmo estable de la medición.
+
+    python benchmark.py                              # test client y gunicorn
+    python benchmark.py --modo gunicorn --workers 4 --hilos 8 --concurrencia 16
+    python benchmark.py --salida v2.json
+    python benchmark.py --comparar v1.json v2.json   # diferencias entre dos corridas
+
+Con la misma semilla y la misma base, la secuencia de pedidos es siempre la misma.
+"""
+import contextlib
+import http.client
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+from urllib.parse import urlencode
+
+import click
+
+RAIZ = os.path.dirname(os.path.abspath(__file__))
+
+# nombre del endpoint → peso en la mezcla de tráfico
+MEZCLA = {
+    'GET /api/obras':                      10,
+    'GET /api/empleados?estado=activo':     8,
+    'GET /api/clientes':                    4,
+    'GET /api/lideres':                     4,
+    'GET /api/bootstrap':                   2,
+    'GET /api/obras/<id>/empleados':        8,
+    'GET /api/asistencias/verificar':      10,
+    'POST /api/asistencias/registrar':     10,
+    'GET /api/asistencias (mes, cliente)':  6,
+    'GET /api/asistencias (mes, obra)':     6,
+    'GET /api/asistencias (año, empleado)': 4,
+    'GET /api/asistencias/resumen':         6,
+    'GET /api/asistencias/resumen?agrupar=obra': 3,
+    'GET /api/asistencias/exportar/komei':  2,
+}
+
+
+# =====================================================
+# DATOS Y PEDIDOS
+# =====================================================
+
+def preparar_datos(datos, empleados, obras, anios, semilla):
+    """Genera la base de prueba si todavía no existe."""
+    if os.path.exists(datos):
+        return
+    click.echo(f'Generando {datos}...', err=True)
+    subprocess.run([sys.executable, '-m', 'flask', '--app', os.path.join(RAIZ, 'app.py'),
+                    'generar-datos', datos, '--empleados', str(empleados), '--obras', str(obras),
+                    '--anios', str(anios), '--semilla', str(semilla)], check=True)
+
+
+def leer_contexto(datos):
+    """Lo que hace falta de la base para armar pedidos válidos."""
+    conn = sqlite3.connect(datos)
+    ultimo = conn.execute('SELECT MAX(fecha) FROM asistencias').fetchone()[0]
+    # Cuadrillas actuales: quién trabajó en cada obra el último día
+    cuadrillas = {}
+    for obra_id, empleado_id in conn.execute(
+            'SELECT obra_id, empleado_id FROM asistencias WHERE fecha = ?', (ultimo,)):
+        cuadrillas.setdefault(obra_id, []).append(empleado_id)
+    contexto = {
+        'ultimo': date.fromisoformat(ultimo),
+        'cuadrillas': cuadrillas,
+        'obras': sorted(cuadrillas),
+        'empleados': [fila[0] for fila in conn.execute("SELECT id FROM empleados WHERE estado = 'activo'")],
+        'clientes': [fila[0] for fila in conn.execute('SELECT id FROM clientes')],
+        'resumen': {
+            'asistencias': conn.execute('SELECT COUNT(*) FROM asistencias').fetchone()[0],
+            'empleados': conn.execute('SELECT COUNT(*) FROM empleados').fetchone()[0],
+            'obras': conn.execute('SELECT COUNT(*) FROM obras').fetchone()[0],
+            'bytes': os.path.getsize(datos),
+        },
+    }
+    conn.close()
+    return contexto
+
+
+# Las columnas que pide la pantalla de consultas (CAMPOS_CONSULTA en script.js)
+CAMPOS_CONSULTA = ('fecha,cliente_nombre,obra_nombre,empleado_nombre,empleado_apellido,cargo,'
+                   'lider_nombre,lider_apellido,presente,tipo_jornada,horas_extras')
+
+
+def _mes(rnd, ultimo):
+    """Un mes al azar de los últimos 12: (primer día, último día)."""
+    fin = ultimo.replace(day=1) - timedelta(days=1)
+    for _ in range(rnd.randint(0, 11)):
+        fin = fin.replace(day=1) - timedelta(days=1)
+    return fin.replace(day=1).isoformat(), fin.isoformat()
+
+
+def armar_pedidos(rnd, contexto, cantidad):
+    """Lista de (endpoint, método, url, cuerpo JSON o None) según MEZCLA."""
+    nombres, pesos = zip(*MEZCLA.items())
+    ultimo = contexto['ultimo']
+    pedidos = []
+    for nombre in rnd.choices(nombres, pesos, k=cantidad):
+        obra_id = rnd.choice(contexto['obras'])
+        desde, hasta = _mes(rnd, ultimo)
+        cuerpo = None
+        if nombre == 'GET /api/obras/<id>/empleados':
+            url = f'/api/obras/{obra_id}/empleados'
+        elif nombre == 'GET /api/asistencias/verificar':
+            fecha = ultimo - timedelta(days=rnd.randint(0, 30))
+            url = (f'/api/asistencias/verificar?fecha={fecha}&obra_id={obra_id}'
+                   '&fields=empleado_id,presente,tipo_jornada,horas_extras')
+        elif nombre == 'POST /api/asistencias/registrar':
+            # Días posteriores a los datos, con las cuadrillas del último día (no se
+            # pisan entre obras); repetir un día y obra ejercita la actualización
+            fecha = ultimo + timedelta(days=rnd.randint(1, 30))
+            url = '/api/asistencias/registrar'
+            cuerpo = {'fecha': fecha.isoformat(), 'obra_id': obra_id, 'registros': [
+                {'empleado_id': e, 'presente': rnd.random() > 0.08,
+                 'tipo_jornada': 'dia', 'horas_extras': rnd.choice((0, 0, 0, 1, 2))}
+                for e in contexto['cuadrillas'][obra_id]]}
+        elif nombre == 'GET /api/asistencias (mes, cliente)':
+            url = '/api/asistencias?' + urlencode({'fecha_desde': desde, 'fecha_hasta': hasta,
+                                                   'cliente_id': rnd.choice(contexto['clientes']),
+                                                   'fields': CAMPOS_CONSULTA})
+        elif nombre == 'GET /api/asistencias (mes, obra)':
+            url = '/api/asistencias?' + urlencode({'fecha_desde': desde, 'fecha_hasta': hasta,
+                                                   'obra_id': obra_id, 'fields': CAMPOS_CONSULTA})
+        elif nombre == 'GET /api/asistencias (año, empleado)':
+            url = '/api/asistencias?' + urlencode({
+                'fecha_desde': (ultimo - timedelta(days=365)).isoformat(),
+                'fecha_hasta': ultimo.isoformat(),
+                'empleado_id': rnd.choice(contexto['empleados']),
+                'fields': CAMPOS_CONSULTA})
+        elif nombre == 'GET /api/asistencias/resumen':
+            url = '/api/asistencias/resumen?' + urlencode({'fecha_desde': desde, 'fecha_hasta': hasta})
+        elif nombre == 'GET /api/asistencias/resumen?agrupar=obra':
+            url = '/api/asistencias/resumen?' + urlencode({'fecha_desde': desde, 'fecha_hasta': hasta,
+                                                           'agrupar': 'obra'})
+        elif nombre == 'GET /api/asistencias/exportar/komei':
+            url = '/api/asistencias/exportar/komei?' + urlencode({'fecha_desde': desde, 'fecha_hasta': hasta,
+                                                                  'obra_id': obra_id})
+        else:
+            url = nombre.split(' ', 1)[1]
+        pedidos.append((nombre, nombre.split(' ', 1)[0], url, cuerpo))
+    return pedidos
+
+
+# =====================================================
+# MEDICIÓN
+# =====================================================
+
+def percentil(ordenados, p):
+    """Percentil por rango más cercano de una lista ya ordenada."""
+    if not ordenados:
+        return None
+    return ordenados[max(0, math.ceil(p / 100 * len(ordenados)) - 1)]
+
+
+RECHAZOS = (429, 503)   # control de admisión: no son errores, pero tampoco trabajo hecho
+
+
+def resumir(mediciones, segundos):
+    """mediciones: [(endpoint, código, segundos, bytes, segundos de CPU o None)]
+    → estadísticas por endpoint y totales."""
+    por_endpoint = {}
+    for nombre, codigo, duracion, _, _ in mediciones:
+        por_endpoint.setdefault(nombre, []).append((codigo, duracion))
+    endpoints = {}
+    for nombre in sorted(por_endpoint):
+        filas = por_endpoint[nombre]
+        tiempos = sorted(d for _, d in filas)
+        codigos = {}
+        for codigo, _ in filas:
+            codigos[str(codigo)] = codigos.get(str(codigo), 0) + 1
+        endpoints[nombre] = {
+            'pedidos':  len(filas),
+            'errores':  sum(1 for codigo, _ in filas
+                            if codigo is None or (codigo >= 500 and codigo not in RECHAZOS)),
+            'rechazados': sum(1 for codigo, _ in filas if codigo in RECHAZOS),
+            'codigos':  codigos,
+            'rps':      round(len(filas) / segundos, 2),
+            'p50_ms':   round(percentil(tiempos, 50) * 1000, 2),
+            'p95_ms':   round(percentil(tiempos, 95) * 1000, 2),
+            'p99_ms':   round(percentil(tiempos, 99) * 1000, 2),
+            'max_ms':   round(tiempos[-1] * 1000, 2),
+            'media_ms': round(sum(tiempos) / len(tiempos) * 1000, 2),
+        }
+    bytes_y_cpu = {}
+    for nombre, _, _, tamano, cpu in mediciones:
+        bytes_y_cpu.setdefault(nombre, []).append((tamano, cpu))
+    for nombre, filas in bytes_y_cpu.items():
+        endpoints[nombre]['bytes_media'] = round(sum(b for b, _ in filas) / len(filas))
+        if filas[0][1] is not None:
+            endpoints[nombre]['cpu_ms'] = round(sum(c for _, c in filas) / len(filas) * 1000, 2)
+    tiempos = sorted(m[2] for m in mediciones)
+    return {
+        'segundos': round(segundos, 2),
+        'pedidos':  len(mediciones),
+        'rps':      round(len(mediciones) / segundos, 2),
+        'rechazados': sum(1 for m in mediciones if m[1] in RECHAZOS),
+        'p50_ms':   round(percentil(tiempos, 50) * 1000, 2),
+        'p95_ms':   round(percentil(tiempos, 95) * 1000, 2),
+        'p99_ms':   round(percentil(tiempos, 99) * 1000, 2),
+        'bytes_media': round(sum(m[3] for m in mediciones) / len(mediciones)),
+        'endpoints': endpoints,
+    }
+
+
+def copiar_datos(datos, directorio):
+    """Copia la base al directorio de la corrida: cada corrida parte de los mismos datos."""
+    shutil.copyfile(datos, os.path.join(directorio, 'asistencias.db'))
+
+
+def correr_cliente(datos, pedidos, calentamiento):
+    """Los pedidos en orden, en este proceso, con el test client de Flask (sin red)."""
+    with tempfile.TemporaryDirectory() as tmp:
+        copiar_datos(datos, tmp)
+        anterior = os.getcwd()
+        os.chdir(tmp)
+        try:
+            os.environ['TAREAS_ACTIVAS'] = '0'   # sin backup nocturno en medio de la medición
+            sys.path.insert(0, RAIZ)
+            t0 = time.perf_counter()
+            import app as modulo
+            with contextlib.redirect_stdout(sys.stderr):   # el JSON de la corrida va por stdout
+                cliente = modulo.create_app().test_client()
+            listo = time.perf_counter() - t0
+
+            def pedir(metodo, url, cuerpo):
+                with cliente.open(url, method=metodo, json=cuerpo) as respuesta:
+                    return respuesta.status_code, len(respuesta.get_data())
+
+            arranque = calentar(lambda lista: [pedir(*p[1:]) for p in lista], pedidos[:calentamiento], listo)
+            mediciones = []
+            inicio = time.perf_counter()
+            for nombre, metodo, url, cuerpo in pedidos[calentamiento:]:
+                t0 = time.perf_counter()
+                cpu0 = time.thread_time()   # servidor y cliente en este hilo: CPU del pedido completo
+                codigo, tamano = pedir(metodo, url, cuerpo)
+                mediciones.append((nombre, codigo, time.perf_counter() - t0, tamano,
+                                   time.thread_time() - cpu0))
+            total = time.perf_counter() - inicio
+            modulo.cerrar_pool()
+        finally:
+            os.chdir(anterior)
+    return dict(resumir(mediciones, total), arranque=arranque)
+
+
+def calentar(correr, pedidos, listo):
+    """Corre el calentamiento midiendo el arranque en frío.
+
+    `listo`: segundos desde lanzar el servidor hasta que responde. Se mide
+    aparte el primer pedido (cachés, conexiones y páginas de SQLite vacías) y
+    el ritmo del resto del calentamiento, para comparar con el estable.
+    """
+    t0 = time.perf_counter()
+    correr(pedidos[:1])
+    primero = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    correr(pedidos[1:])
+    resto = time.perf_counter() - t0
+    return {
+        'listo_s':          round(listo, 3),
+        'primer_pedido_ms': round(primero * 1000, 2),
+        'calentamiento_rps': round((len(pedidos) - 1) / resto, 2) if resto and len(pedidos) > 1 else None,
+    }
+
+
+def _puerto_libre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _esperar_servidor(puerto, proceso, limite=60):
+    fin = time.monotonic() + limite
+    while time.monotonic() < fin:
+        if proceso.poll() is not None:
+            raise click.ClickException('gunicorn terminó al arrancar')
+        try:
+            conexion = http.client.HTTPConnection('127.0.0.1', puerto, timeout=5)
+            conexion.request('GET', '/api/sistema/db')
+            if conexion.getresponse().status == 200:
+                conexion.close()
+                return
+        except OSError:
+            pass
+        time.sleep(0.1)
+    raise click.ClickException('gunicorn no respondió a tiempo')
+
+
+def correr_gunicorn(datos, pedidos, calentamiento, workers, hilos, concurrencia):
+    """Los pedidos repartidos entre `concurrencia` clientes HTTP contra gunicorn real,
+    con gunicorn.conf.py (el mismo arranque que en producción).
+
+    `workers` y `hilos` en None dejan los de la configuración.
+
+    El CPU del servidor (master y workers, calentamiento incluido) se lee al
+    terminar gunicorn, de los tiempos de los procesos hijos ya esperados.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        copiar_datos(datos, tmp)
+        puerto = _puerto_libre()
+        comando = [sys.executable, '-m', 'gunicorn', '-c', os.path.join(RAIZ, 'gunicorn.conf.py'),
+                   '--pythonpath', RAIZ, '--bind', f'127.0.0.1:{puerto}', '--log-level', 'warning']
+        if workers:
+            comando += ['--workers', str(workers)]
+        if hilos:
+            comando += ['--threads', str(hilos)]
+        cpu0 = os.times()
+        t0 = time.perf_counter()
+        proceso = subprocess.Popen(comando, cwd=tmp, env=dict(os.environ, TAREAS_ACTIVAS='0'),
+                                   stdout=subprocess.DEVNULL)
+        try:
+            _esperar_servidor(puerto, proceso)
+            listo = time.perf_counter() - t0
+
+            def cliente(propios, mediciones):
+                conexion = http.client.HTTPConnection('127.0.0.1', puerto, timeout=120)
+                for nombre, metodo, url, cuerpo in propios:
+                    datos_cuerpo = None if cuerpo is None else json.dumps(cuerpo).encode()
+                    cabeceras = {} if cuerpo is None else {'Content-Type': 'application/json'}
+                    t0 = time.perf_counter()
+                    try:
+                        conexion.request(metodo, url, body=datos_cuerpo, headers=cabeceras)
+                        respuesta = conexion.getresponse()
+                        tamano = len(respuesta.read())
+                        codigo = respuesta.status
+                    except (OSError, http.client.HTTPException):
+                        conexion.close()
+                        codigo, tamano = None, 0
+                    if mediciones is not None:
+                        mediciones.append((nombre, codigo, time.perf_counter() - t0, tamano, None))
+                conexion.close()
+
+            def en_paralelo(lista, mediciones):
+                hilos_cliente = [threading.Thread(target=cliente, args=(lista[i::concurrencia], mediciones))
+                                 for i in range(concurrencia)]
+                for hilo in hilos_cliente:
+                    hilo.start()
+                for hilo in hilos_cliente:
+                    hilo.join()
+
+            arranque = calentar(lambda lista: en_paralelo(lista, None), pedidos[:calentamiento], listo)
+            mediciones = []
+            inicio = time.perf_counter()
+            en_paralelo(pedidos[calentamiento:], mediciones)
+            total = time.perf_counter() - inicio
+        finally:
+            proceso.terminate()
+            proceso.wait(timeout=30)
+        cpu1 = os.times()
+    resultado = dict(resumir(mediciones, total), arranque=arranque)
+    cpu = (cpu1.children_user + cpu1.children_system) - (cpu0.children_user + cpu0.children_system)
+    resultado['cpu_servidor_ms'] = round(cpu / len(pedidos) * 1000, 2)   # por pedido
+    return resultado
+
+
+def _version():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=RAIZ,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def imprimir(resultado):
+    """Tabla legible por stderr; el JSON va aparte."""
+    for modo, datos in resultado['modos'].items():
+        click.echo(f"\n{modo}: {datos['pedidos']} pedidos en {datos['segundos']}s, "
+                   f"{datos['rps']} req/s, p95 {datos['p95_ms']} ms, "
+                   f"{datos['rechazados']} rechazados (429/503)", err=True)
+        if 'cpu_servidor_ms' in datos:
+            click.echo(f"  CPU del servidor: {datos['cpu_servidor_ms']} ms por pedido", err=True)
+        arranque = datos['arranque']
+        click.echo(f"  Arranque: listo en {arranque['listo_s']}s, primer pedido "
+                   f"{arranque['primer_pedido_ms']} ms, calentamiento {arranque['calentamiento_rps']} req/s",
+                   err=True)
+        click.echo(f"  {'endpoint':45} {'n':>5} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8} "
+                   f"{'bytes':>9} {'cpu':>8}", err=True)
+        for nombre, e in datos['endpoints'].items():
+            click.echo(f"  {nombre:45} {e['pedidos']:5} {e['rps']:8} {e['p50_ms']:8} "
+                       f"{e['p95_ms']:8} {e['p99_ms']:8} {e['bytes_media']:9} {e.get('cpu_ms', '-'):>8}",
+                       err=True)
+
+
+def comparar(anterior, nuevo):
+    """Cambio de req/s, p95, bytes y CPU por endpoint entre dos salidas JSON."""
+    for modo, datos in nuevo['modos'].items():
+        base = anterior['modos'].get(modo)
+        if base is None:
+            continue
+        click.echo(f"\n{modo}: {base['rps']} → {datos['rps']} req/s, "
+                   f"p95 {base['p95_ms']} → {datos['p95_ms']} ms")
+        if 'arranque' in base:
+            click.echo(f"  Arranque: listo en {base['arranque']['listo_s']} → {datos['arranque']['listo_s']} s, "
+                       f"primer pedido {base['arranque']['primer_pedido_ms']} → "
+                       f"{datos['arranque']['primer_pedido_ms']} ms")
+        if 'cpu_servidor_ms' in base and 'cpu_servidor_ms' in datos:
+            click.echo(f"  CPU del servidor por pedido: {base['cpu_servidor_ms']} → "
+                       f"{datos['cpu_servidor_ms']} ms ({_cambio(base['cpu_servidor_ms'], datos['cpu_servidor_ms'])})")
+        for nombre, e in datos['endpoints'].items():
+            b = base['endpoints'].get(nombre)
+            if b is None:
+                continue
+            linea = f"  {nombre:45} p95 {b['p95_ms']:8} → {e['p95_ms']:8} ms ({_cambio(b['p95_ms'], e['p95_ms'])})"
+            if 'bytes_media' in b:
+                linea += f"  bytes {b['bytes_media']} → {e['bytes_media']} ({_cambio(b['bytes_media'], e['bytes_media'])})"
+            if 'cpu_ms' in b and 'cpu_ms' in e:
+                linea += f"  cpu {b['cpu_ms']} → {e['cpu_ms']} ms ({_cambio(b['cpu_ms'], e['cpu_ms'])})"
+            click.echo(linea)
+
+
+def _cambio(antes, despues):
+    return f'{(despues - antes) / antes * 100:+.0f} %' if antes else '-'
+
+
+
+@click.command()
+@click.option('--datos', default='benchmark.db', show_default=True,
+              help='Base de prueba; se genera si no existe.')
+@click.option('--modo', type=click.Choice(['cliente', 'gunicorn', 'ambos']), default='ambos',
+              show_default=True)
+@click.option('--pedidos', default=2000, show_default=True, help='Pedidos medidos por modo.')
+@click.option('--calentamiento', default=100, show_default=True, help='Pedidos previos sin medir.')
+@click.option('--workers', type=int, help='Workers de gunicorn (por defecto, los de gunicorn.conf.py).')
+@click.option('--hilos', type=int, help='Hilos por worker de gunicorn (por defecto, los de gunicorn.conf.py).')
+@click.option('--concurrencia', default=8, show_default=True, help='Clientes simultáneos contra gunicorn.')
+@click.option('--semilla', default=1, show_default=True)
+@click.option('--empleados', default=3000, show_default=True, help='Al generar la base.')
+@click.option('--obras', default=300, show_default=True, help='Al generar la base.')
+@click.option('--anios', default=3, show_default=True, help='Al generar la base.')
+@click.option('--salida', type=click.Path(), help='Archivo JSON (por defecto, stdout).')
+@click.option('--comparar', 'archivos', nargs=2, type=click.Path(exists=True),
+              help='Compara dos salidas anteriores y termina.')
+def main(datos, modo, pedidos, calentamiento, workers, hilos, concurrencia, semilla,
+         empleados, obras, anios, salida, archivos):
+    """Prueba de carga del sistema de asistencias (ver el docstring del módulo)."""
+    if archivos:
+        with open(archivos[0]) as a, open(archivos[1]) as b:
+            comparar(json.load(a), json.load(b))
+        return
+
+    preparar_datos(datos, empleados, obras, anios, semilla)
+    contexto = leer_contexto(datos)
+    lista = armar_pedidos(random.Random(semilla), contexto, calentamiento + pedidos)
+
+    resultado = {
+        'fecha':   datetime.now().isoformat(timespec='seconds'),
+        'version': _version(),
+        'entorno': {'python': platform.python_version(), 'sqlite': sqlite3.sqlite_version,
+                    'cpus': os.cpu_count(), 'sistema': platform.platform()},
+        'datos':   dict(contexto['resumen'], archivo=os.path.basename(datos)),
+        'parametros': {'pedidos': pedidos, 'calentamiento': calentamiento, 'semilla': semilla,
+                       'workers': workers, 'hilos': hilos, 'concurrencia': concurrencia,
+                       'mezcla': MEZCLA},
+        'modos': {},
+    }
+    if modo in ('cliente', 'ambos'):
+        click.echo('Corriendo con el test client...', err=True)
+        resultado['modos']['cliente'] = correr_cliente(datos, lista, calentamiento)
+    if modo in ('gunicorn', 'ambos'):
+        click.echo(f"Corriendo con gunicorn ({workers or 'config'} workers, {hilos or 'config'} hilos, "
+                   f"{concurrencia} clientes)...", err=True)
+        resultado['modos']['gunicorn'] = correr_gunicorn(datos, lista, calentamiento,
+                                                         workers, hilos, concurrencia)
+    imprimir(resultado)
+
+    texto = json.dumps(resultado, indent=2, ensure_ascii=False)
+    if salida:
+        with open(salida, 'w') as archivo:
+            archivo.write(texto + '\n')
+    else:
+        click.echo(texto)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+// =====================================================
+// COLA DE ASISTENCIAS SIN CONEXIÓN (IndexedDB)
+// =====================================================
+// Cada guardado del registro de asistencia se encola acá con un id propio y
+// se envía después, de a lotes, a /api/sync/asistencias. La usan la página
+// (script.js) y el service worker (sw.js), que la vacía cuando vuelve la red.
+// Los cambios rechazados por el servidor (conflictos) se guardan aparte para
+// avisarle al usuario la próxima vez que abra la app.
+
+const ColaAsistencias = (() => {
+    const BASE = 'asistencias-offline';
+    const PENDIENTES = 'pendientes';
+    const RECHAZADOS = 'rechazados';
+    const LOTE = 50;                    // cambios por pedido (el servidor acepta hasta 100)
+    const URL_SYNC = '/api/sync/asistencias';
+
+    let conexion = null;
+    let envioEnCurso = null;
+
+    function abrir() {
+        if (!conexion) {
+            conexion = new Promise((resolve, reject) => {
+                const pedido = indexedDB.open(BASE, 1);
+                pedido.onupgradeneeded = () => {
+                    pedido.result.createObjectStore(PENDIENTES, { keyPath: 'id' })
+                        .createIndex('creado', 'creado');
+                    pedido.result.createObjectStore(RECHAZADOS, { keyPath: 'id' });
+                };
+                pedido.onsuccess = () => resolve(pedido.result);
+                pedido.onerror = () => reject(pedido.error);
+            });
+        }
+        return conexion;
+    }
+
+    async function operar(almacen, modo, accion) {
+        const db = await abrir();
+        return new Promise((resolve, reject) => {
+            const tx = db.transaction(almacen, modo);
+            const resultado = accion(tx.objectStore(almacen));
+            tx.oncomplete = () => resolve(resultado && resultado.result);
+            tx.onerror = () => reject(tx.error);
+        });
+    }
+
+    // Id único sin depender de crypto.randomUUID (que exige HTTPS)
+    function nuevoId() {
+        const bytes = crypto.getRandomValues(new Uint8Array(16));
+        return Array.from(bytes, b => b.toString(16).padStart(2, '0')).join('');
+    }
+
+    function encolar(dia) {
+        const cambio = { ...dia, id: nuevoId(), creado: new Date().toISOString() };
+        return operar(PENDIENTES, 'readwrite', store => store.put(cambio)).then(() => cambio);
+    }
+
+    function pendientes() {
+        return operar(PENDIENTES, 'readonly', store => store.index('creado').getAll());
+    }
+
+    function quitar(almacen, ids) {
+        return operar(almacen, 'readwrite', store => ids.forEach(id => store.delete(id)));
+    }
+
+    function rechazados() {
+        return operar(RECHAZADOS, 'readonly', store => store.getAll());
+    }
+
+    async function enviar() {
+        let aplicados = 0;
+        while (true) {
+            const lote = (await pendientes()).slice(0, LOTE);
+            if (lote.length === 0) break;
+
+            let respuesta;
+            try {
+                respuesta = await fetch(URL_SYNC, {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({ cambios: lote })
+                });
+            } catch (error) {
+                break;   // sin conexión: se reintenta más tarde
+            }
+            if (!respuesta.ok) break;
+
+            const { resultados } = await respuesta.json();
+            const rechazos = resultados.filter(r => r.estado !== 'aplicado');
+            if (rechazos.length > 0) {
+                await operar(RECHAZADOS, 'readwrite', store => rechazos.forEach(r => store.put(r)));
+            }
+            await quitar(PENDIENTES, resultados.map(r => r.id));
+            aplicados += resultados.length - rechazos.length;
+            if (resultados.length < lote.length) break;
+        }
+        return { aplicados, pendientes: (await pendientes()).length };
+    }
+
+    // Un solo envío a la vez por contexto; los reenvíos los descarta el servidor
+    function sincronizar() {
+        if (!envioEnCurso) {
+            envioEnCurso = enviar().finally(() => { envioEnCurso = null; });
+        }
+        return envioEnCurso;
+    }
+
+    return { encolar, pendientes, rechazados, quitarRechazados: ids => quitar(RECHAZADOS, ids), sincronizar };
+})();
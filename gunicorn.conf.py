@@ -0,0 +1,44 @@
+# =====================================================
+# CONFIGURACIÓN DE GUNICORN
+# =====================================================
+# `gunicorn` la lee sola al arrancar en esta carpeta (Procfile y render.yaml la
+# nombran igual con -c). El master importa la app y aplica el esquema una sola
+# vez (preload_app + create_app); cada worker nace con el fork y abre lo suyo
+# en post_fork: conexiones SQLite, hilo programador, pool de exportaciones.
+#
+# Workers con hilos (gthread): casi todo el tiempo de un pedido es esperar a
+# SQLite, al disco o a un cliente lento, y en esas esperas el GIL queda libre.
+# Pocos procesos con varios hilos rinden lo mismo que muchos procesos sync con
+# mucha menos memoria, y SQLite admite un solo escritor a la vez de todos modos.
+#
+# Recarga sin cortar pedidos:
+#   kill -HUP <master>    relee esta configuración y reemplaza los workers de a
+#                         poco; con preload_app el código sigue siendo el cargado
+#   kill -USR2 <master>   arranca un master nuevo con el código nuevo; cuando
+#                         responde, `kill -TERM <master viejo>` (o lo hace el deploy)
+
+import os
+
+wsgi_app = 'app:create_app()'
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+preload_app = True
+
+worker_class = 'gthread'
+workers = int(os.environ.get('WEB_CONCURRENCY', '2'))
+threads = int(os.environ.get('GUNICORN_THREADS', '8'))   # hilos por worker
+
+# Con gthread el timeout vigila al worker, no a cada pedido: una descarga larga
+# no lo dispara, un worker colgado sí
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '60'))
+graceful_timeout = 30    # segundos para terminar los pedidos en curso al recargar o detener
+keepalive = 5
+
+
+def post_fork(server, worker):
+    import app
+    app.iniciar_worker()
+
+
+def worker_exit(server, worker):
+    import app
+    app.cerrar_pool()
@@ -4,6 +4,7 @@ const API_URL = window.location.origin + '/api';
 // Estado global
 let currentShift = 'dia';
 let registrosAsistencia = {};
+let contextoRegistro = null;   // obra, plantel, asistencias y ocupados de la obra/fecha del registro
 
 // =====================================================
 // SANITIZACIÓN XSS — escapar siempre antes de innerHTML
@@ -18,6 +19,140 @@ function esc(str) {
         .replace(/'/g, '&#x27;');
 }
 
+// =====================================================
+// DATOS MAESTROS — caché local actualizada con /api/sync
+// =====================================================
+// Clientes, líderes, empleados, obras y asignaciones quedan guardados en el
+// navegador (localStorage). Cada pantalla pide a /api/sync sólo lo que cambió
+// desde la última secuencia recibida, y sin conexión usa lo guardado.
+// Subir CLAVE si cambian las columnas que devuelve el servidor.
+
+const Maestros = (() => {
+    const CLAVE = 'maestros-v1';
+    const ORDEN = {
+        clientes: ['nombre'],
+        lideres: ['nombre', 'apellido'],
+        empleados: ['nombre', 'apellido'],
+        obras: ['nombre'],
+        obra_empleados: ['id']
+    };
+
+    let datos = leer();
+    let pedidoEnCurso = null;
+
+    function vacio() {
+        const tablas = {};
+        Object.keys(ORDEN).forEach(tabla => { tablas[tabla] = {}; });
+        return { seq: 0, tablas };
+    }
+
+    function leer() {
+        try {
+            return JSON.parse(localStorage.getItem(CLAVE)) || vacio();
+        } catch (error) {
+            return vacio();
+        }
+    }
+
+    function guardar() {
+        try {
+            localStorage.setItem(CLAVE, JSON.stringify(datos));
+        } catch (error) {
+            console.warn('No se pudo guardar la caché de datos maestros:', error);
+        }
+    }
+
+    // Primera carga: todos los listados en un pedido (con ETag, el navegador lo revalida)
+    async function pedirTodo() {
+        const response = await fetch(`${API_URL}/bootstrap`);
+        if (!response.ok) throw new Error(`Error HTTP: ${response.status}`);
+        const { seq, ...listas } = await response.json();
+        const nuevos = vacio();
+        Object.entries(listas).forEach(([tabla, filas]) => {
+            filas.forEach(fila => { nuevos.tablas[tabla][fila.id] = fila; });
+        });
+        nuevos.seq = seq;
+        datos = nuevos;
+        guardar();
+    }
+
+    async function pedirCambios() {
+        if (datos.seq === 0) return pedirTodo();
+        const response = await fetch(`${API_URL}/sync?since=${datos.seq}`);
+        if (!response.ok) throw new Error(`Error HTTP: ${response.status}`);
+        const { seq, completo, cambios, borrados } = await response.json();
+        const nuevos = completo ? vacio() : datos;
+        Object.entries(cambios).forEach(([tabla, filas]) => {
+            filas.forEach(fila => { nuevos.tablas[tabla][fila.id] = fila; });
+        });
+        Object.entries(borrados).forEach(([tabla, ids]) => {
+            ids.forEach(id => { delete nuevos.tablas[tabla][id]; });
+        });
+        nuevos.seq = seq;
+        datos = nuevos;
+        guardar();
+    }
+
+    // Un solo pedido a la vez: las pantallas que cargan varias tablas comparten el mismo
+    async function actualizar() {
+        if (!pedidoEnCurso) {
+            pedidoEnCurso = pedirCambios().finally(() => { pedidoEnCurso = null; });
+        }
+        try {
+            await pedidoEnCurso;
+        } catch (error) {
+            if (datos.seq === 0) throw error;   // nunca se cargó nada: no hay con qué seguir
+            console.warn('Sin conexión, se usan los datos guardados:', error);
+        }
+    }
+
+    function comparar(campos) {
+        return (a, b) => {
+            for (const campo of campos) {
+                const x = a[campo] ?? '';
+                const y = b[campo] ?? '';
+                if (x < y) return -1;
+                if (x > y) return 1;
+            }
+            return a.id - b.id;
+        };
+    }
+
+    // Lo guardado, ordenado como los listados del servidor, sin ir a la red
+    function local(tabla) {
+        return Object.values(datos.tablas[tabla]).sort(comparar(ORDEN[tabla]));
+    }
+
+    async function lista(tabla) {
+        await actualizar();
+        return local(tabla);
+    }
+
+    // Empleados activos asignados a la obra (como /api/obras/<id>/empleados)
+    async function empleadosDeObra(obraId) {
+        await actualizar();
+        const asignados = new Set(local('obra_empleados')
+            .filter(a => a.obra_id == obraId)
+            .map(a => a.empleado_id));
+        return local('empleados').filter(e => asignados.has(e.id) && e.estado === 'activo');
+    }
+
+    // Un registro recién leído del servidor (p. ej. para editarlo); sin red, el guardado.
+    // `embed` trae relaciones en el mismo pedido (ver /api/<tabla>/<id>)
+    async function registro(tabla, id, embed = '') {
+        try {
+            const response = await fetch(`${API_URL}/${tabla}/${id}` + (embed ? `?embed=${embed}` : ''));
+            if (response.status === 404) return null;
+            if (response.ok) return await response.json();
+        } catch (error) {
+            console.warn('Sin conexión, se usan los datos guardados:', error);
+        }
+        return datos.tablas[tabla][id] || null;
+    }
+
+    return { lista, local, registro, empleadosDeObra, actualizar };
+})();
+
 // =====================================================
 // VALIDACIÓN DE FECHAS — año máx 4 dígitos, entre 2000-2099
 // =====================================================
@@ -80,6 +215,9 @@ document.addEventListener('DOMContentLoaded', async () => {
     // Activar validación de años en todos los inputs de fecha
     inicializarValidacionFechas();
     
+    // Cola de asistencias sin conexión y service worker
+    inicializarSincronizacion();
+    
     // Cargar datos iniciales
     await cargarDatosIniciales();
     
@@ -174,8 +312,7 @@ async function cargarEmpleadosRegistro() {
             return;
         }
         
-        const response = await fetch(`${API_URL}/empleados?estado=activo`);
-        const empleados = await response.json();
+        const empleados = (await Maestros.lista('empleados')).filter(e => e.estado === 'activo');
         
         const container = document.getElementById('listaEmpleadosRegistro');
         container.innerHTML = '';
@@ -189,8 +326,8 @@ async function cargarEmpleadosRegistro() {
             const registro = registrosAsistencia[empleado.id] || {};
             const presente = registro.presente;
             
-            const fotoHtml = empleado.foto 
-                ? `<img src="${esc(empleado.foto)}" class="employee-photo-small" alt="${esc(empleado.nombre)}">` 
+            const fotoHtml = empleado.foto_miniatura 
+                ? `<img src="${esc(empleado.foto_miniatura)}" class="employee-photo-small" alt="${esc(empleado.nombre)}" loading="lazy">` 
                 : `<div class="employee-photo-placeholder">👷</div>`;
             
             const item = document.createElement('div');
@@ -253,7 +390,7 @@ function marcarAsistencia(empleadoId, presente) {
     // Recargar empleados respetando la obra seleccionada
     const obraId = document.getElementById('registroObra').value;
     if (obraId) {
-        cargarEmpleadosDeObra(obraId);
+        pintarEmpleadosDeObra();
     } else {
         cargarEmpleadosRegistro();
     }
@@ -289,9 +426,10 @@ async function guardarAsistencias() {
         return;
     }
     
-    // Obtener el líder de la obra
-    const obras = await fetch(`${API_URL}/obras`).then(r => r.json());
-    const obra = obras.find(o => o.id == obraId);
+    // El líder sale del contexto ya cargado o de los datos maestros guardados (sin ir a la red)
+    const obra = contextoRegistro && contextoRegistro.obra && contextoRegistro.obra.id == obraId
+        ? contextoRegistro.obra
+        : Maestros.local('obras').find(o => o.id == obraId);
     
     if (!obra || !obra.lider_id) {
         mostrarNotificacion('責任者を選択してください', 'error');
@@ -312,44 +450,114 @@ async function guardarAsistencias() {
         return;
     }
     
+    let cambio;
     try {
-        const response = await fetch(`${API_URL}/asistencias/registrar`, {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({
-                fecha,
-                obra_id: parseInt(obraId),
-                lider_id: obra.lider_id,
-                registros
-            })
-        });
-        
-        if (response.status === 409) {
-            // Conflicto: empleado ya presente en otra obra ese día
-            const data = await response.json();
-            mostrarNotificacion(data.message, 'error');
-            return;
-        }
-        
-        if (response.ok) {
-            mostrarNotificacion(`✓ ${registros.length}件の出勤データを保存しました`);
-            registrosAsistencia = {};
-            // Limpiar vista: resetear obra y ocultar empleados
-            document.getElementById('registroObra').value = '';
-            const listaEmpleados = document.getElementById('listaEmpleadosRegistro');
-            if (listaEmpleados) listaEmpleados.innerHTML = '';
-            // Limpiar stats
-            const statP = document.getElementById('statPresentes');
-            const statA = document.getElementById('statAusentes');
-            if (statP) statP.textContent = '0';
-            if (statA) statA.textContent = '0';
-        } else {
-            throw new Error('保存エラー');
-        }
+        // Primero al dispositivo: guardar nunca espera a la red
+        cambio = await ColaAsistencias.encolar({ fecha, obra_id: parseInt(obraId), registros });
     } catch (error) {
         console.error('Error:', error);
         mostrarNotificacion('出勤保存エラー', 'error');
+        return;
+    }
+    limpiarRegistro();
+    
+    const { pendientes } = await sincronizarCola(cambio.id);
+    const rechazado = (await ColaAsistencias.rechazados()).find(r => r.id === cambio.id);
+    if (rechazado) {
+        // Conflicto: empleado ya presente en otra obra ese día → volver al formulario
+        await ColaAsistencias.quitarRechazados([cambio.id]);
+        restaurarRegistro(cambio);
+        mostrarNotificacion(rechazado.message || rechazado.error, 'error');
+    } else if (pendientes > 0) {
+        mostrarNotificacion(`📴 ${registros.length}件の出勤データを端末に保存しました。接続が戻ると自動で送信します`);
+    } else {
+        mostrarNotificacion(`✓ ${registros.length}件の出勤データを保存しました`);
+    }
+}
+
+function limpiarRegistro() {
+    registrosAsistencia = {};
+    // Limpiar vista: resetear obra y ocultar empleados
+    document.getElementById('registroObra').value = '';
+    const listaEmpleados = document.getElementById('listaEmpleadosRegistro');
+    if (listaEmpleados) listaEmpleados.innerHTML = '';
+    // Limpiar stats
+    const statP = document.getElementById('statPresentes');
+    const statA = document.getElementById('statAusentes');
+    if (statP) statP.textContent = '0';
+    if (statA) statA.textContent = '0';
+}
+
+function restaurarRegistro(cambio) {
+    document.getElementById('registroFecha').value = cambio.fecha;
+    document.getElementById('registroObra').value = cambio.obra_id;
+    registrosAsistencia = {};
+    cambio.registros.forEach(r => {
+        registrosAsistencia[r.empleado_id] = { presente: r.presente, horas_extras: r.horas_extras };
+    });
+    cargarInfoObra();
+}
+
+// =====================================================
+// SINCRONIZACIÓN (cola sin conexión, ver cola.js y sw.js)
+// =====================================================
+
+async function sincronizarCola(reservado = null) {
+    let resultado;
+    try {
+        resultado = await ColaAsistencias.sincronizar();
+    } catch (error) {
+        console.error('Error al sincronizar:', error);
+        return { aplicados: 0, pendientes: 0 };
+    }
+    mostrarEstadoCola(resultado.pendientes);
+    if (resultado.pendientes > 0 && 'serviceWorker' in navigator) {
+        // Si se cierra la página antes de recuperar la red, que los envíe el service worker
+        navigator.serviceWorker.ready
+            .then(registro => registro.sync && registro.sync.register('sync-asistencias'))
+            .catch(() => {});
+    }
+    await avisarRechazados(reservado);
+    return resultado;
+}
+
+// Conflictos de envíos anteriores (p. ej. hechos sin conexión); el del guardado
+// en curso (`reservado`) lo muestra guardarAsistencias
+async function avisarRechazados(reservado = null) {
+    const rechazados = (await ColaAsistencias.rechazados()).filter(r => r.id !== reservado);
+    if (rechazados.length === 0) return;
+    const mensajes = rechazados.map(r =>
+        `${formatearFecha(r.fecha)}：${r.message || r.error}`);
+    mostrarNotificacion(`送信できなかった出勤データがあります。${mensajes.join(' / ')}`, 'error');
+    await ColaAsistencias.quitarRechazados(rechazados.map(r => r.id));
+}
+
+function mostrarEstadoCola(pendientes) {
+    const estado = document.getElementById('estadoCola');
+    if (!estado) return;
+    estado.textContent = pendientes > 0 ? `📴 送信待ち：${pendientes}件` : '';
+    estado.style.display = pendientes > 0 ? 'block' : 'none';
+}
+
+function inicializarSincronizacion() {
+    if ('serviceWorker' in navigator) {
+        navigator.serviceWorker.register('/sw.js').catch(error =>
+            console.warn('Service worker no disponible:', error));
+        navigator.serviceWorker.addEventListener('message', event => {
+            if (event.data && event.data.tipo === 'cola-sincronizada') {
+                mostrarEstadoCola(event.data.pendientes);
+                avisarRechazados();
+            }
+        });
     }
+    window.addEventListener('online', () => sincronizarCola());
+    // Por si el evento online no llega (señal que va y viene) o no hay Background Sync
+    setInterval(() => sincronizarCola(), 60000);
+    ColaAsistencias.pendientes().then(p => {
+        mostrarEstadoCola(p.length);
+        if (p.length > 0) sincronizarCola();
+        else avisarRechazados();
+    }).catch(error => console.warn('IndexedDB no disponible:', error));
 }
 
 async function cargarAsistenciaExistente() {
@@ -362,8 +570,8 @@ async function cargarAsistenciaExistente() {
     }
     
     try {
-        const response = await fetch(`${API_URL}/asistencias/verificar?fecha=${fecha}&obra_id=${obraId}`);
-        const asistencias = await response.json();
+        contextoRegistro = await pedirContextoRegistro(obraId, fecha);
+        const asistencias = contextoRegistro.asistencias;
         
         if (asistencias.length === 0) {
             mostrarNotificacion('この日付と現場のデータがありません', 'error');
@@ -373,7 +581,7 @@ async function cargarAsistenciaExistente() {
         registrosAsistencia = {};
         asistencias.forEach(asist => {
             registrosAsistencia[asist.empleado_id] = {
-                presente: asist.presente,
+                presente: Boolean(asist.presente),   // SQLite lo devuelve como 1 o 0
                 horas_extras: asist.horas_extras
             };
         });
@@ -382,7 +590,7 @@ async function cargarAsistenciaExistente() {
             selectShift(asistencias[0].tipo_jornada);
         }
         
-        cargarEmpleadosRegistro();
+        pintarEmpleadosDeObra();
         mostrarNotificacion(`✓ Cargados ${asistencias.length} registros`);
     } catch (error) {
         console.error('Error:', error);
@@ -396,8 +604,7 @@ async function cargarAsistenciaExistente() {
 
 async function cargarEmpleados() {
     try {
-        const response = await fetch(`${API_URL}/empleados`);
-        const empleados = await response.json();
+        const empleados = await Maestros.lista('empleados');
         
         const select = document.getElementById('consultaEmpleado');
         if (select) {
@@ -413,8 +620,7 @@ async function cargarEmpleados() {
 
 async function cargarTablaEmpleados() {
     try {
-        const response = await fetch(`${API_URL}/empleados`);
-        const empleados = await response.json();
+        const empleados = await Maestros.lista('empleados');
         
         const tbody = document.querySelector('#tablaEmpleados tbody');
         if (!tbody) return;
@@ -428,8 +634,8 @@ async function cargarTablaEmpleados() {
         
         empleados.forEach(emp => {
             // Generar HTML para la foto
-            const fotoHtml = emp.foto 
-                ? `<img src="${emp.foto}" class="employee-photo-small" alt="${esc(emp.nombre)}" style="width: 50px; height: 50px; border-radius: 50%; object-fit: cover;">` 
+            const fotoHtml = emp.foto_miniatura 
+                ? `<img src="${esc(emp.foto_miniatura)}" class="employee-photo-small" alt="${esc(emp.nombre)}" loading="lazy" style="width: 50px; height: 50px; border-radius: 50%; object-fit: cover;">` 
                 : `<div class="employee-photo-placeholder" style="width: 50px; height: 50px; border-radius: 50%; background: #f0f0f0; display: flex; align-items: center; justify-content: center; font-size: 24px;">👷</div>`;
             
             const tr = document.createElement('tr');
@@ -492,6 +698,7 @@ function cerrarModalEmpleado() {
 // FUNCIONES DE FOTO
 // =====================================================
 
+// Data URL de una foto nueva, o la URL de la foto actual (el servidor la conserva)
 let fotoBase64 = null;
 
 function previsualizarFoto(input) {
@@ -558,9 +765,7 @@ function eliminarFoto() {
 
 async function editarEmpleado(id) {
     try {
-        const response = await fetch(`${API_URL}/empleados`);
-        const empleados = await response.json();
-        const empleado = empleados.find(e => e.id === id);
+        const empleado = await Maestros.registro('empleados', id);
         
         if (!empleado) return;
         
@@ -678,8 +883,7 @@ async function eliminarEmpleado(id) {
 
 async function cargarClientes() {
     try {
-        const response = await fetch(`${API_URL}/clientes`);
-        const clientes = await response.json();
+        const clientes = await Maestros.lista('clientes');
         
         // Solo cargar en los selects de filtros (consulta y reporte)
         const selects = ['consultaCliente', 'reporteCliente'];
@@ -701,8 +905,7 @@ async function cargarClientes() {
 
 async function cargarTablaClientes() {
     try {
-        const response = await fetch(`${API_URL}/clientes`);
-        const clientes = await response.json();
+        const clientes = await Maestros.lista('clientes');
         
         const tbody = document.querySelector('#tablaClientes tbody');
         if (!tbody) return;
@@ -753,9 +956,7 @@ function cerrarModalCliente() {
 
 async function editarCliente(id) {
     try {
-        const response = await fetch(`${API_URL}/clientes`);
-        const clientes = await response.json();
-        const cliente = clientes.find(c => c.id === id);
+        const cliente = await Maestros.registro('clientes', id);
         
         if (!cliente) return;
         
@@ -845,8 +1046,7 @@ let empleadosSeleccionados = [];
 
 async function cargarObras() {
     try {
-        const response = await fetch(`${API_URL}/obras`);
-        const obras = await response.json();
+        const obras = await Maestros.lista('obras');
         
         const selects = ['registroObra', 'consultaObra', 'reporteObra'];
         selects.forEach(selectId => {
@@ -865,8 +1065,7 @@ async function cargarObras() {
 
 async function cargarTablaObras() {
     try {
-        const response = await fetch(`${API_URL}/obras`);
-        const obras = await response.json();
+        const obras = await Maestros.lista('obras');
         
         const tbody = document.querySelector('#tablaObras tbody');
         if (!tbody) return;
@@ -927,8 +1126,7 @@ async function mostrarModalObra() {
 async function cargarClientesYLideresParaObra() {
     try {
         // Cargar clientes
-        const responseClientes = await fetch(`${API_URL}/clientes`);
-        const clientes = await responseClientes.json();
+        const clientes = await Maestros.lista('clientes');
         
         const selectCliente = document.getElementById('obraCliente');
         selectCliente.innerHTML = '<option value="">取引先を選択...</option>';
@@ -937,8 +1135,7 @@ async function cargarClientesYLideresParaObra() {
         });
         
         // Cargar líderes
-        const responseLideres = await fetch(`${API_URL}/lideres`);
-        const lideres = await responseLideres.json();
+        const lideres = await Maestros.lista('lideres');
         
         const selectLider = document.getElementById('obraLider');
         selectLider.innerHTML = '<option value="">責任者を選択...</option>';
@@ -956,9 +1153,8 @@ function cerrarModalObra() {
 
 async function editarObra(id) {
     try {
-        const response = await fetch(`${API_URL}/obras`);
-        const obras = await response.json();
-        const obra = obras.find(o => o.id === id);
+        // La obra y sus empleados asignados en un solo pedido
+        const obra = await Maestros.registro('obras', id, 'empleados');
         
         if (!obra) return;
         
@@ -977,9 +1173,8 @@ async function editarObra(id) {
         document.getElementById('obraCliente').value = obra.cliente_id || '';
         document.getElementById('obraLider').value = obra.lider_id || '';
         
-        // Cargar empleados asignados
-        const empResponse = await fetch(`${API_URL}/obras/${id}/empleados`);
-        const empleadosObra = await empResponse.json();
+        // Empleados asignados (sin red, de los datos maestros guardados)
+        const empleadosObra = obra.empleados || await Maestros.empleadosDeObra(id);
         empleadosSeleccionados = empleadosObra.map(e => e.id);
         
         await cargarEmpleadosParaObra();
@@ -1065,8 +1260,7 @@ async function eliminarObra(id) {
 
 async function cargarEmpleadosParaObra() {
     try {
-        const response = await fetch(`${API_URL}/empleados?estado=activo`);
-        const empleados = await response.json();
+        const empleados = (await Maestros.lista('empleados')).filter(e => e.estado === 'activo');
         
         const container = document.getElementById('listaEmpleadosObra');
         container.innerHTML = '';
@@ -1105,9 +1299,11 @@ function toggleEmpleadoObra(empleadoId, checked) {
 
 async function cargarInfoObra() {
     const obraId = document.getElementById('registroObra').value;
+    const fecha = document.getElementById('registroFecha').value;
     const container = document.getElementById('obraInfoContainer');
     
     if (!obraId) {
+        contextoRegistro = null;
         container.style.display = 'none';
         // Cuando no hay obra seleccionada, mostrar todos los empleados activos
         cargarEmpleadosRegistro();
@@ -1115,9 +1311,12 @@ async function cargarInfoObra() {
     }
     
     try {
-        const response = await fetch(`${API_URL}/obras`);
-        const obras = await response.json();
-        const obra = obras.find(o => o.id == obraId);
+        const contexto = await pedirContextoRegistro(obraId, fecha);
+        // Si mientras tanto se eligió otra obra o fecha, esta respuesta ya no sirve
+        if (document.getElementById('registroObra').value !== obraId ||
+            document.getElementById('registroFecha').value !== fecha) return;
+        contextoRegistro = contexto;
+        const obra = contexto.obra;
         
         if (obra) {
             // Usar los IDs sin conflicto (con prefijo 'info')
@@ -1126,18 +1325,36 @@ async function cargarInfoObra() {
             document.getElementById('infoObraDireccion').textContent = obra.direccion || '-';
             container.style.display = 'block';
             
-            // Cargar SOLO los empleados asignados a esta obra
-            cargarEmpleadosDeObra(obraId);
+            // Mostrar SOLO los empleados asignados a esta obra
+            pintarEmpleadosDeObra();
         }
     } catch (error) {
         console.error('Error:', error);
     }
 }
 
-async function cargarEmpleadosDeObra(obraId) {
+// Obra, plantel activo, asistencias del día y ocupados en otras obras, en un pedido.
+// Sin red, la obra y el plantel de los datos maestros guardados
+async function pedirContextoRegistro(obraId, fecha) {
     try {
-        const response = await fetch(`${API_URL}/obras/${obraId}/empleados`);
-        const empleados = await response.json();
+        const response = await fetch(`${API_URL}/registro/contexto?obra_id=${obraId}&fecha=${fecha}`);
+        if (response.ok) return await response.json();
+    } catch (error) {
+        console.warn('Sin conexión, se usan los datos guardados:', error);
+    }
+    return {
+        fecha,
+        obra: Maestros.local('obras').find(o => o.id == obraId) || null,
+        empleados: await Maestros.empleadosDeObra(obraId),
+        asistencias: [],
+        ocupados: {}
+    };
+}
+
+function pintarEmpleadosDeObra() {
+    if (!contextoRegistro) return;
+    try {
+        const { empleados, ocupados } = contextoRegistro;
         
         const container = document.getElementById('listaEmpleadosRegistro');
         container.innerHTML = '';
@@ -1151,12 +1368,17 @@ async function cargarEmpleadosDeObra(obraId) {
             const registro = registrosAsistencia[empleado.id] || {};
             const presente = registro.presente;
             
-            const fotoHtml = empleado.foto 
-                ? `<img src="${esc(empleado.foto)}" class="employee-photo-small" alt="${esc(empleado.nombre)}">` 
+            const fotoHtml = empleado.foto_miniatura 
+                ? `<img src="${esc(empleado.foto_miniatura)}" class="employee-photo-small" alt="${esc(empleado.nombre)}" loading="lazy">` 
                 : `<div class="employee-photo-placeholder">👷</div>`;
             
+            // Ya marcado PRESENTE en otra obra ese día: el servidor rechazaría el guardado
+            const otraObraId = ocupados[empleado.id];
+            const otraObra = otraObraId &&
+                (Maestros.local('obras').find(o => o.id === otraObraId)?.nombre || `#${otraObraId}`);
+            
             const item = document.createElement('div');
-            item.className = 'worker-item';
+            item.className = otraObraId ? 'worker-item worker-ocupado' : 'worker-item';
             item.innerHTML = `
                 <div class="worker-info">
                     <div style="display: flex; align-items: center; gap: 12px; margin-bottom: 8px;">
@@ -1164,6 +1386,7 @@ async function cargarEmpleadosDeObra(obraId) {
                         <div>
                             <div class="worker-name">${esc(empleado.nombre)} ${esc(empleado.apellido)}</div>
                             <div class="worker-meta">${esc(empleado.cargo) || '役職なし'}${empleado.telefono ? ' • ' + esc(String(empleado.telefono)) : ''}</div>
+                            ${otraObraId ? `<div class="worker-ocupado-aviso">⚠ ${esc(otraObra)}で出勤済み</div>` : ''}
                         </div>
                     </div>
                 </div>
@@ -1207,8 +1430,7 @@ async function cargarEmpleadosDeObra(obraId) {
 
 async function cargarLideres() {
     try {
-        const response = await fetch(`${API_URL}/lideres`);
-        const lideres = await response.json();
+        const lideres = await Maestros.lista('lideres');
         
         // Solo cargar en los selects de filtros (consulta y reporte)
         const selects = ['consultaLider', 'reporteLider'];
@@ -1230,8 +1452,7 @@ async function cargarLideres() {
 
 async function cargarTablaLideres() {
     try {
-        const response = await fetch(`${API_URL}/lideres`);
-        const lideres = await response.json();
+        const lideres = await Maestros.lista('lideres');
         
         const tbody = document.querySelector('#tablaLideres tbody');
         if (!tbody) return;
@@ -1278,9 +1499,7 @@ function cerrarModalLider() {
 
 async function editarLider(id) {
     try {
-        const response = await fetch(`${API_URL}/lideres`);
-        const lideres = await response.json();
-        const lider = lideres.find(l => l.id === id);
+        const lider = await Maestros.registro('lideres', id);
         
         if (!lider) return;
         
@@ -1371,6 +1590,10 @@ async function cargarFiltrosConsultas() {
     ]);
 }
 
+// Columnas que muestra la tabla de consultas (el servidor no manda las demás)
+const CAMPOS_CONSULTA = 'fecha,cliente_nombre,obra_nombre,empleado_nombre,empleado_apellido,cargo,' +
+                        'lider_nombre,lider_apellido,presente,tipo_jornada,horas_extras';
+
 async function buscarAsistencias() {
     const fechaDesde = document.getElementById('consultaFechaDesde').value;
     const fechaHasta = document.getElementById('consultaFechaHasta').value;
@@ -1379,31 +1602,27 @@ async function buscarAsistencias() {
     const empleadoId = document.getElementById('consultaEmpleado').value;
     const liderId = document.getElementById('consultaLider').value;
     
-    let url = `${API_URL}/asistencias?`;
-    if (fechaDesde) url += `fecha_desde=${fechaDesde}&`;
-    if (fechaHasta) url += `fecha_hasta=${fechaHasta}&`;
-    if (clienteId) url += `cliente_id=${clienteId}&`;
-    if (obraId) url += `obra_id=${obraId}&`;
-    if (empleadoId) url += `empleado_id=${empleadoId}&`;
-    if (liderId) url += `lider_id=${liderId}&`;
+    let filtros = '';
+    if (fechaDesde) filtros += `fecha_desde=${fechaDesde}&`;
+    if (fechaHasta) filtros += `fecha_hasta=${fechaHasta}&`;
+    if (clienteId) filtros += `cliente_id=${clienteId}&`;
+    if (obraId) filtros += `obra_id=${obraId}&`;
+    if (empleadoId) filtros += `empleado_id=${empleadoId}&`;
+    if (liderId) filtros += `lider_id=${liderId}&`;
     
     try {
-        const response = await fetch(url);
+        const response = await fetch(`${API_URL}/asistencias?${filtros}fields=${CAMPOS_CONSULTA}`);
         const asistencias = await response.json();
         
-        // Guardar para exportar (junto con las fechas exactas del formulario)
-        ultimasAsistenciasConsulta = asistencias;
-        rangoFechasConsulta = {
-            desde: fechaDesde || asistencias[0]?.fecha || new Date().toISOString().split('T')[0],
-            hasta: fechaHasta || asistencias[asistencias.length - 1]?.fecha || new Date().toISOString().split('T')[0]
-        };
+        // Guardar los filtros para exportar (sin fechas, el servidor usa el rango de los datos)
+        filtrosConsulta = filtros;
         
         const tbody = document.querySelector('#tablaConsultas tbody');
         tbody.innerHTML = '';
         
         if (asistencias.length === 0) {
             tbody.innerHTML = '<tr><td colspan="9" style="text-align: center;">データが見つかりません</td></tr>';
-            ultimasAsistenciasConsulta = [];
+            filtrosConsulta = null;
             return;
         }
         
@@ -1441,9 +1660,9 @@ async function buscarAsistencias() {
 async function cargarFiltrosReportes() {
     // Cargar datos en paralelo
     const [clientes, obras, lideres] = await Promise.all([
-        fetch(`${API_URL}/clientes`).then(r => r.json()),
-        fetch(`${API_URL}/obras`).then(r => r.json()),
-        fetch(`${API_URL}/lideres`).then(r => r.json())
+        Maestros.lista('clientes'),
+        Maestros.lista('obras'),
+        Maestros.lista('lideres')
     ]);
     
     // Llenar selector de clientes
@@ -1495,41 +1714,33 @@ async function generarReporte() {
         return;
     }
     
-    let url = `${API_URL}/asistencias?fecha_desde=${fechaDesde}&fecha_hasta=${fechaHasta}`;
-    if (clienteId) url += `&cliente_id=${clienteId}`;
-    if (obraId) url += `&obra_id=${obraId}`;
-    if (liderId) url += `&lider_id=${liderId}`;
+    let filtros = `fecha_desde=${fechaDesde}&fecha_hasta=${fechaHasta}`;
+    if (clienteId) filtros += `&cliente_id=${clienteId}`;
+    if (obraId) filtros += `&obra_id=${obraId}`;
+    if (liderId) filtros += `&lider_id=${liderId}`;
     
     try {
-        console.log('Generando reporte con URL:', url);
-        
-        const response = await fetch(url);
+        // Los totales se calculan en el servidor; las filas solo se piden al exportar
+        const response = await fetch(`${API_URL}/asistencias/resumen?${filtros}`);
         
         if (!response.ok) {
             throw new Error(`Error HTTP: ${response.status}`);
         }
         
-        const asistencias = await response.json();
-        
-        // Guardar para exportar (junto con las fechas exactas del formulario)
-        ultimasAsistenciasReporte = asistencias;
-        rangoFechasReporte = { desde: fechaDesde, hasta: fechaHasta };
+        const { totales } = await response.json();
         
-        console.log('Asistencias recibidas:', asistencias.length);
+        // Guardar filtros para exportar (junto con las fechas exactas del formulario)
+        filtrosReporte = totales.total > 0 ? filtros : null;
         
-        const totalAsistencias = asistencias.length;
-        const presentes = asistencias.filter(a => a.presente).length;
-        const ausentes = asistencias.filter(a => !a.presente).length;
-        const totalHorasExtras = asistencias.reduce((sum, a) => sum + (parseFloat(a.horas_extras) || 0), 0);
+        const totalAsistencias = totales.total;
         
         // Actualizar los valores en el DOM
         document.getElementById('reporteTotalAsistencias').textContent = totalAsistencias;
-        document.getElementById('reportePresentes').textContent = presentes;
-        document.getElementById('reporteAusentes').textContent = ausentes;
-        document.getElementById('reporteHorasExtras').textContent = totalHorasExtras.toFixed(1);
+        document.getElementById('reportePresentes').textContent = totales.presentes;
+        document.getElementById('reporteAusentes').textContent = totales.ausentes;
+        document.getElementById('reporteHorasExtras').textContent = totales.horas_extras.toFixed(1);
         
         if (totalAsistencias === 0) {
-            ultimasAsistenciasReporte = [];
             mostrarNotificacion('⚠️ 選択した期間にデータがありません', 'error');
         } else {
             mostrarNotificacion(`✓ レポート作成完了：${totalAsistencias}件`);
@@ -1573,318 +1784,70 @@ function mostrarNotificacion(mensaje, tipo = 'success') {
 // EXPORTAR A EXCEL - FORMATO KOMEI DENSETSU
 // =====================================================
 
-let ultimasAsistenciasConsulta = [];
-let ultimasAsistenciasReporte = [];
-let rangoFechasConsulta = { desde: null, hasta: null };
-let rangoFechasReporte = { desde: null, hasta: null };
-
-async function exportarConsultasExcel() {
-    if (ultimasAsistenciasConsulta.length === 0) {
-        mostrarNotificacion('先に検索してください', 'error');
-        return;
-    }
-    try {
-        const agrupadoPorObra = agruparAsistenciasPorRango(
-            ultimasAsistenciasConsulta,
-            rangoFechasConsulta.desde,
-            rangoFechasConsulta.hasta
-        );
-        if (agrupadoPorObra.length === 0) {
-            mostrarNotificacion('出力するデータがありません', 'error');
-            return;
-        }
-        const wb = XLSX.utils.book_new();
-        for (const obra of agrupadoPorObra) {
-            const ws = crearHojaKomeiDensetsu(obra);
-            XLSX.utils.book_append_sheet(wb, ws, sanitizarNombreHoja(obra.nombreObra));
-        }
-        const fecha = new Date().toISOString().split('T')[0].replace(/-/g, '');
-        XLSX.writeFile(wb, `出勤表_${fecha}.xlsx`);
-        mostrarNotificacion('✓ Excel出力完了');
-    } catch (error) {
-        console.error('Error:', error);
-        mostrarNotificacion('Excel出力エラー：' + error.message, 'error');
-    }
-}
+let filtrosConsulta = null;  // query string de la última búsqueda con resultados
+let filtrosReporte = null;   // query string del último reporte generado
 
-async function exportarReporteExcel() {
-    if (ultimasAsistenciasReporte.length === 0) {
-        mostrarNotificacion('先にレポートを作成してください', 'error');
-        return;
-    }
-    try {
-        const agrupadoPorObra = agruparAsistenciasPorRango(
-            ultimasAsistenciasReporte,
-            rangoFechasReporte.desde,
-            rangoFechasReporte.hasta
-        );
-        if (agrupadoPorObra.length === 0) {
-            mostrarNotificacion('出力するデータがありません', 'error');
-            return;
-        }
-        const wb = XLSX.utils.book_new();
-        for (const obra of agrupadoPorObra) {
-            const ws = crearHojaKomeiDensetsu(obra);
-            XLSX.utils.book_append_sheet(wb, ws, sanitizarNombreHoja(obra.nombreObra));
-        }
-        const fecha = new Date().toISOString().split('T')[0].replace(/-/g, '');
-        XLSX.writeFile(wb, `出勤表_${fecha}.xlsx`);
-        mostrarNotificacion('✓ Excel出力完了');
-    } catch (error) {
-        console.error('Error:', error);
-        mostrarNotificacion('Excel出力エラー：' + error.message, 'error');
-    }
-}
+const EXPORTACION_CONSULTA_MS = 1000;   // cada cuánto se pregunta por el avance de una exportación
 
 /**
- * Agrupa asistencias por obra usando el rango de fechas exacto del formulario
+ * Pide una exportación en segundo plano (/api/exportaciones) y espera a que
+ * el servidor la termine. Devuelve el trabajo listo, con su URL de descarga.
  */
-function agruparAsistenciasPorRango(asistencias, fechaDesde, fechaHasta) {
-    const grupos = {};
-
-    // Calcular el rango de días a mostrar en el Excel
-    const inicio = new Date(fechaDesde + 'T00:00:00');
-    const fin    = new Date(fechaHasta + 'T00:00:00');
-
-    asistencias.forEach(asist => {
-        const key = asist.obra_id;
-        if (!grupos[key]) {
-            grupos[key] = {
-                obraId:       asist.obra_id,
-                nombreObra:   asist.obra_nombre,
-                clienteNombre: asist.cliente_nombre || '',
-                fechaDesde:   inicio,
-                fechaHasta:   fin,
-                empleados:    {}
-            };
-        }
-        const empKey = asist.empleado_id;
-        if (!grupos[key].empleados[empKey]) {
-            grupos[key].empleados[empKey] = {
-                nombre:      `${asist.empleado_nombre}　${asist.empleado_apellido}`,
-                asistencias: {},   // key: 'YYYY-MM-DD' → true/false
-                horasExtras: {}    // key: 'YYYY-MM-DD' → número
-            };
-        }
-        grupos[key].empleados[empKey].asistencias[asist.fecha] = asist.presente;
-        grupos[key].empleados[empKey].horasExtras[asist.fecha]  = parseFloat(asist.horas_extras) || 0;
+async function ejecutarExportacion(tipo, filtros, alAvanzar = () => {}) {
+    let response = await fetch(`${API_URL}/exportaciones`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ tipo, filtros })
     });
-
-    return Object.values(grupos);
+    let trabajo = await response.json();
+    while (response.ok && (trabajo.estado === 'pendiente' || trabajo.estado === 'en_curso')) {
+        alAvanzar(trabajo.progreso);
+        await new Promise(resolve => setTimeout(resolve, EXPORTACION_CONSULTA_MS));
+        response = await fetch(`${API_URL}/exportaciones/${trabajo.id}`);
+        trabajo = await response.json();
+    }
+    if (!response.ok || trabajo.estado === 'error') {
+        throw new Error(trabajo.error || `Error HTTP: ${response.status}`);
+    }
+    return trabajo;
 }
 
 /**
- * Genera un array con todas las fechas entre dos fechas inclusive.
- * USA MÉTODOS LOCALES para evitar el problema de UTC vs zona horaria.
- * Retorna strings 'YYYY-MM-DD'.
+ * El 出勤表 (una hoja por obra) se genera en el servidor, fuera del worker
+ * que atiende los pedidos, y se descarga cuando está listo; el navegador no
+ * procesa ninguna fila.
  */
-function generarRangoDias(desde, hasta) {
-    const dias = [];
-    // Crear con año/mes/día locales para no depender de UTC
-    const cur = new Date(desde.getFullYear(), desde.getMonth(), desde.getDate());
-    const fin = new Date(hasta.getFullYear(), hasta.getMonth(), hasta.getDate());
-    while (cur <= fin) {
-        const y = cur.getFullYear();
-        const m = String(cur.getMonth() + 1).padStart(2, '0');
-        const d = String(cur.getDate()).padStart(2, '0');
-        dias.push(`${y}-${m}-${d}`);
-        cur.setDate(cur.getDate() + 1);
+async function descargarExcelKomei(filtros) {
+    mostrarNotificacion('Excel出力を準備しています…');
+    try {
+        const trabajo = await ejecutarExportacion('komei', Object.fromEntries(new URLSearchParams(filtros)),
+            progreso => mostrarNotificacion(`Excel出力を準備しています… ${Math.round(progreso * 100)}%`));
+        const link = document.createElement('a');
+        link.href = window.location.origin + trabajo.descarga;
+        link.download = '';
+        document.body.appendChild(link);
+        link.click();
+        link.remove();
+        mostrarNotificacion('✓ Excel出力を開始しました');
+    } catch (error) {
+        mostrarNotificacion('Excel出力エラー: ' + error.message, 'error');
     }
-    return dias;
 }
 
-/**
- * Crea la hoja Excel en formato Komei Densetsu.
- * Las columnas de días reflejan EXACTAMENTE el rango elegido en el formulario.
- */
-function crearHojaKomeiDensetsu(obraData) {
-    const diasSemana = ['日', '月', '火', '水', '木', '金', '土'];
-
-    // Rango exacto del formulario
-    const rangoDias = generarRangoDias(obraData.fechaDesde, obraData.fechaHasta);
-    const totalDias = rangoDias.length;
-
-    // Fechas de inicio y fin para el encabezado
-    const añoInicio  = obraData.fechaDesde.getFullYear();
-    const mesInicio  = obraData.fechaDesde.getMonth() + 1;
-    const diaInicio  = obraData.fechaDesde.getDate();
-    const añoFin     = obraData.fechaHasta.getFullYear();
-    const mesFin     = obraData.fechaHasta.getMonth() + 1;
-    const diaFin     = obraData.fechaHasta.getDate();
-    const añoReiwaIn = añoInicio - 2018;
-    const añoReiwaFn = añoFin    - 2018;
-
-    // Índices de columnas de totales (base-0)
-    const colTotal   = 2 + totalDias;      // columna "定時小計"
-    const colResumen = 2 + totalDias + 1;  // columna "残業小計"
-
-    function colLetra(idx) { return XLSX.utils.encode_col(idx); }
-
-    // Construir contenido como array-of-arrays y luego aplicar fórmulas
-    const aoa = [];
-
-    // ── FILA 1 ──────────────────────────────────────────────────
-    const f1 = Array(colResumen + 1).fill('');
-    f1[0]            = '会社名';
-    f1[1]            = 'Komei Densetsu';
-    f1[16]           = '出　　　勤　　　表';
-    f1[colTotal - 1] = '自';
-    f1[colTotal]     = `令和　${añoReiwaIn}年　${mesInicio}月 ${diaInicio}日`;
-    aoa.push(f1);
-
-    // ── FILA 2 ──────────────────────────────────────────────────
-    const f2 = Array(colResumen + 1).fill('');
-    f2[0]            = '現場名';
-    f2[1]            = obraData.nombreObra;
-    f2[colTotal - 1] = '至';
-    f2[colTotal]     = `令和　${añoReiwaFn}年　${mesFin}月 ${diaFin}日`;
-    aoa.push(f2);
-
-    // ── FILA 3 – Etiqueta de mes ─────────────────────────────────
-    const f3 = Array(colResumen + 1).fill('');
-    f3[0]           = '１';
-    f3[colTotal]    = '定時小計';
-    f3[colResumen]  = '残業小計';
-    let mesActual = null;
-    rangoDias.forEach((fechaStr, i) => {
-        const m = parseInt(fechaStr.split('-')[1]);
-        if (m !== mesActual) {
-            f3[2 + i] = `（ ${m}月 ）`;
-            mesActual = m;
-        }
-    });
-    aoa.push(f3);
-
-    // ── FILA 4 – Días numéricos ──────────────────────────────────
-    const f4 = Array(colResumen + 1).fill('');
-    f4[0] = 'No';
-    f4[1] = '氏　名';
-    rangoDias.forEach((fechaStr, i) => {
-        f4[2 + i] = parseInt(fechaStr.split('-')[2]);
-    });
-    aoa.push(f4);
-
-    // ── FILA 5 – Días de la semana ───────────────────────────────
-    const f5 = Array(colResumen + 1).fill('');
-    rangoDias.forEach((fechaStr, i) => {
-        // Parsear con métodos locales: new Date(año, mes-1, día)
-        const [y, m, d] = fechaStr.split('-').map(Number);
-        f5[2 + i] = diasSemana[new Date(y, m - 1, d).getDay()];
-    });
-    aoa.push(f5);
-
-    // ── EMPLEADOS ────────────────────────────────────────────────
-    const formulasPendientes = [];
-    const colIni = colLetra(2);
-    const colFin = colLetra(2 + totalDias - 1);
-
-    // Guardar referencias de filas de asistencia y HE para el gran total
-    const filasAsistencia = [];  // filas (1-based) de cada empleado
-    const filasHorasExtras = [];
-
-    Object.values(obraData.empleados).forEach((emp, idx) => {
-        // Fila de asistencia — número va aquí (columna A)
-        const fa = Array(colResumen + 1).fill('');
-        fa[0] = idx + 1;        // ← número de empleado en la fila del nombre
-        fa[1] = emp.nombre;
-        rangoDias.forEach((fechaStr, i) => {
-            fa[2 + i] = emp.asistencias[fechaStr] ? '出' : '';
-        });
-        aoa.push(fa);
-        const filaAsist = aoa.length; // 1-based
-        filasAsistencia.push(filaAsist);
-
-        formulasPendientes.push({
-            cellRef: `${colLetra(colTotal)}${filaAsist}`,
-            formula: `COUNTIF(${colIni}${filaAsist}:${colFin}${filaAsist},"出")`
-        });
-
-        // Fila de horas extras — sin número (columna A vacía)
-        const fhe = Array(colResumen + 1).fill('');
-        fhe[1] = '残業時間';    // ← columna A queda vacía
-        rangoDias.forEach((fechaStr, i) => {
-            const h = emp.horasExtras[fechaStr] || 0;
-            fhe[2 + i] = h > 0 ? h : '';
-        });
-        aoa.push(fhe);
-        const filaHE = aoa.length; // 1-based
-        filasHorasExtras.push(filaHE);
-
-        formulasPendientes.push({
-            cellRef: `${colLetra(colResumen)}${filaHE}`,
-            formula: `SUM(${colIni}${filaHE}:${colFin}${filaHE})`
-        });
-    });
-
-    // ── GRAN TOTAL ───────────────────────────────────────────────
-    // Etiqueta pegada justo a la izquierda de la columna de totales
-    const ftA = Array(colResumen + 1).fill('');
-    ftA[colTotal - 1] = '合　計';
-    aoa.push(ftA);
-    const filaGranTotalAsist = aoa.length;
-
-    const ftHE = Array(colResumen + 1).fill('');
-    ftHE[colTotal - 1] = '残業合計';
-    aoa.push(ftHE);
-    const filaGranTotalHE = aoa.length;
-
-    // Fórmulas del gran total: sumar las celdas de totales de cada empleado
-    if (filasAsistencia.length > 0) {
-        const sumaAsist = filasAsistencia
-            .map(f => `${colLetra(colTotal)}${f}`)
-            .join('+');
-        formulasPendientes.push({
-            cellRef: `${colLetra(colTotal)}${filaGranTotalAsist}`,
-            formula: sumaAsist
-        });
-
-        const sumaHE = filasHorasExtras
-            .map(f => `${colLetra(colResumen)}${f}`)
-            .join('+');
-        formulasPendientes.push({
-            cellRef: `${colLetra(colResumen)}${filaGranTotalHE}`,
-            formula: sumaHE
-        });
+function exportarConsultasExcel() {
+    if (filtrosConsulta === null) {
+        mostrarNotificacion('先に検索してください', 'error');
+        return;
     }
-
-    // Crear hoja desde array-of-arrays
-    const ws = XLSX.utils.aoa_to_sheet(aoa);
-
-    // Aplicar fórmulas reales (aoa_to_sheet las escribe como texto)
-    formulasPendientes.forEach(({ cellRef, formula }) => {
-        ws[cellRef] = { t: 'n', f: formula };
-    });
-
-    // Merged cells
-    const colTotalLetra   = colLetra(colTotal);
-    const colResumenLetra = colLetra(colResumen);
-    // Título 出勤表: columna Q (índice 16) a columna X (índice 23) → 8 columnas centradas
-    const colTituloIni = colLetra(16);
-    const colTituloFin = colLetra(23);
-    ws['!merges'] = [
-        XLSX.utils.decode_range('B1:D1'),
-        XLSX.utils.decode_range('B2:D2'),
-        XLSX.utils.decode_range(`${colTituloIni}1:${colTituloFin}1`),
-        XLSX.utils.decode_range(`${colTotalLetra}1:${colResumenLetra}1`),
-        XLSX.utils.decode_range(`${colTotalLetra}2:${colResumenLetra}2`),
-        XLSX.utils.decode_range(`${colTotalLetra}3:${colTotalLetra}5`),
-        XLSX.utils.decode_range(`${colResumenLetra}3:${colResumenLetra}5`)
-    ];
-
-    // Anchos de columna
-    ws['!cols'] = [
-        { wch: 9.71 },
-        { wch: 17.14 },
-        ...Array(totalDias).fill({ wch: 3.57 }),
-        { wch: 11 },
-        { wch: 11 }
-    ];
-
-    return ws;
+    descargarExcelKomei(filtrosConsulta);
 }
 
-function sanitizarNombreHoja(nombre) {
-    return nombre.replace(/[:\\/?*\[\]]/g, '').substring(0, 31);
+function exportarReporteExcel() {
+    if (!filtrosReporte) {
+        mostrarNotificacion('先にレポートを作成してください', 'error');
+        return;
+    }
+    descargarExcelKomei(filtrosReporte);
 }
 
 // =====================================================
@@ -1937,12 +1900,13 @@ async function generarReporteMensual() {
     }
     
     try {
-        // Obtener todos los datos necesarios
-        const [asistencias, empleados, obras] = await Promise.all([
-            fetch(`${API_URL}/asistencias?fecha_desde=${fechaDesde}&fecha_hasta=${fechaHasta}`).then(r => r.json()),
-            fetch(`${API_URL}/empleados`).then(r => r.json()),
-            fetch(`${API_URL}/obras`).then(r => r.json())
-        ]);
+        // Una fila por empleado/día/obra ya agregada en el servidor, como exportación en
+        // segundo plano: un año entero no ocupa al worker que atiende los pedidos
+        const trabajo = await ejecutarExportacion('resumen', {
+            fecha_desde: fechaDesde, fecha_hasta: fechaHasta, agrupar: 'dia,empleado,obra'
+        });
+        const response = await fetch(window.location.origin + trabajo.descarga);
+        const { grupos: asistencias } = await response.json();
         
         if (asistencias.length === 0) {
             mostrarNotificacion('この期間にデータがありません', 'error');
@@ -1952,7 +1916,7 @@ async function generarReporteMensual() {
         // Agrupar asistencias por mes
         const porMes = {};
         asistencias.forEach(asist => {
-            if (!asist.presente) return; // Solo días trabajados
+            if (!asist.presentes) return; // Solo días trabajados
             
             const [y, m, d] = asist.fecha.split('-').map(Number); const fecha = new Date(y, m - 1, d);
             const mesKey = `${fecha.getFullYear()}-${String(fecha.getMonth() + 1).padStart(2, '0')}`;
@@ -1967,7 +1931,7 @@ async function generarReporteMensual() {
         // Crear una hoja por cada mes
         Object.keys(porMes).sort().forEach(mesKey => {
             const [año, mes] = mesKey.split('-').map(Number);
-            const ws = crearHojaMensual(año, mes, porMes[mesKey], empleados, obras);
+            const ws = crearHojaMensual(año, mes, porMes[mesKey]);
             
             // Nombre de hoja en japonés
             const mesNombre = `${mes}月`;
@@ -1985,7 +1949,7 @@ async function generarReporteMensual() {
     }
 }
 
-function crearHojaMensual(año, mes, asistencias, empleados, obras) {
+function crearHojaMensual(año, mes, asistencias) {
     const diasSemana = ['日', '月', '火', '水', '木', '金', '土'];
     const diasEnMes = new Date(año, mes, 0).getDate(); // último día del mes
     
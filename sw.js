@@ -0,0 +1,78 @@
+// =====================================================
+// SERVICE WORKER — la app abre sin conexión y la cola se envía sola
+// =====================================================
+// - /estaticos/* (nombre con huella, nunca cambia): primero la caché.
+// - La página y los GET de /api: primero la red; sin red, lo último guardado.
+// - Background Sync: cuando vuelve la red, envía la cola de asistencias aunque
+//   la página esté cerrada (donde el navegador lo soporta).
+
+importScripts('/cola.js');
+
+const CACHE = 'asistencias-v1';
+const TAG_SYNC = 'sync-asistencias';
+
+self.addEventListener('install', event => {
+    // La página y los recursos que referencia, para poder abrir sin conexión
+    event.waitUntil((async () => {
+        const cache = await caches.open(CACHE);
+        const respuesta = await fetch('/', { cache: 'no-cache' });
+        const html = await respuesta.clone().text();
+        await cache.put('/', respuesta);
+        const recursos = [...html.matchAll(/(?:src|href)="(\/estaticos\/[^"]+)"/g)].map(m => m[1]);
+        await cache.addAll(recursos);
+        await self.skipWaiting();
+    })());
+});
+
+self.addEventListener('activate', event => {
+    event.waitUntil((async () => {
+        for (const nombre of await caches.keys()) {
+            if (nombre !== CACHE) await caches.delete(nombre);
+        }
+        await self.clients.claim();
+    })());
+});
+
+async function primeroCache(request) {
+    const guardada = await caches.match(request);
+    if (guardada) return guardada;
+    const respuesta = await fetch(request);
+    if (respuesta.ok) (await caches.open(CACHE)).put(request, respuesta.clone());
+    return respuesta;
+}
+
+async function primeroRed(request) {
+    try {
+        const respuesta = await fetch(request);
+        if (respuesta.ok) (await caches.open(CACHE)).put(request, respuesta.clone());
+        return respuesta;
+    } catch (error) {
+        const guardada = await caches.match(request, { ignoreVary: true });
+        if (guardada) return guardada;
+        throw error;
+    }
+}
+
+self.addEventListener('fetch', event => {
+    const url = new URL(event.request.url);
+    if (event.request.method !== 'GET' || url.origin !== self.location.origin) return;
+
+    if (url.pathname.startsWith('/estaticos/')) {
+        event.respondWith(primeroCache(event.request));
+    } else if (event.request.mode === 'navigate' && url.pathname === '/') {
+        event.respondWith(primeroRed(event.request));
+    } else if (url.pathname.startsWith('/api/')) {
+        event.respondWith(primeroRed(event.request));
+    }
+});
+
+async function sincronizarYAvisar() {
+    const resultado = await ColaAsistencias.sincronizar();
+    for (const cliente of await self.clients.matchAll()) {
+        cliente.postMessage({ tipo: 'cola-sincronizada', ...resultado });
+    }
+}
+
+self.addEventListener('sync', event => {
+    if (event.tag === TAG_SYNC) event.waitUntil(sincronizarYAvisar());
+});
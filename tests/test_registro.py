@@ -0,0 +1,71 @@
+"""Regresiones del registro de asistencias.
+
+    python -m unittest discover tests
+
+Cada prueba corre la app real sobre una base nueva en un directorio temporal
+(con los datos de ejemplo de init_db: empleados 1 a 3 en la obra 1).
+"""
+import os
+import sys
+import tempfile
+import unittest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.environ['TAREAS_ACTIVAS'] = '0'
+sys.path.insert(0, RAIZ)
+
+import app as modulo  # noqa: E402
+
+
+class RegistroTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.anterior = os.getcwd()
+        os.chdir(self.tmp.name)
+        modulo.init_db()
+        modulo.cerrar_pool()
+        self.cliente = modulo.app.test_client()
+
+    def tearDown(self):
+        modulo.cerrar_pool()
+        os.chdir(self.anterior)
+        self.tmp.cleanup()
+
+    def registrar(self, registros, fecha='2025-01-10', obra_id=1):
+        return self.cliente.post('/api/asistencias/registrar', json={
+            'fecha': fecha, 'obra_id': obra_id, 'registros': registros})
+
+    def guardados(self, fecha='2025-01-10', obra_id=1):
+        respuesta = self.cliente.get(f'/api/asistencias/verificar?fecha={fecha}&obra_id={obra_id}')
+        return sorted(r['empleado_id'] for r in respuesta.get_json())
+
+    def test_ids_como_texto_no_borran_lo_guardado(self):
+        registros = [{'empleado_id': '1', 'presente': True, 'tipo_jornada': 'dia', 'horas_extras': 0}]
+        primera = self.registrar(registros, obra_id='1')
+        self.assertEqual(primera.status_code, 201)
+        self.assertEqual(primera.get_json()['insertados'], 1)
+
+        segunda = self.registrar(registros, obra_id='1')
+        self.assertEqual(segunda.status_code, 201)
+        self.assertEqual(segunda.get_json()['sin_cambios'], 1)
+        self.assertEqual(segunda.get_json()['eliminados'], 0)
+        self.assertEqual(self.guardados(), [1])
+
+    def test_ids_como_texto_en_sync(self):
+        cambio = {'fecha': '2025-01-10', 'obra_id': '1',
+                  'registros': [{'empleado_id': '2', 'presente': True, 'tipo_jornada': 'dia'}]}
+        for i in range(2):
+            respuesta = self.cliente.post('/api/sync/asistencias',
+                                          json={'cambios': [dict(cambio, id=f'c{i}')]})
+            self.assertEqual(respuesta.get_json()['resultados'][0]['estado'], 'aplicado')
+        self.assertEqual(self.guardados(), [2])
+
+    def test_id_no_numerico_es_400(self):
+        respuesta = self.registrar([{'empleado_id': 'uno', 'presente': True}])
+        self.assertEqual(respuesta.status_code, 400)
+        self.assertIn('error', respuesta.get_json())
+
+
+if __name__ == '__main__':
+    unittest.main()